@@ -0,0 +1,50 @@
+"""added full text search index on image text
+
+Revision ID: 3b2a9d4c1f07
+Revises: 8c7e750c5f11
+Create Date: 2020-03-01 14:21:09.113027
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = '3b2a9d4c1f07'
+down_revision = '8c7e750c5f11'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        # external content table, kept in sync with the images table using triggers
+        op.execute("CREATE VIRTUAL TABLE images_fts USING fts5("
+                   "text, content='images', content_rowid='id', tokenize='unicode61', prefix='2 3')")
+        op.execute("CREATE TRIGGER images_fts_insert AFTER INSERT ON images BEGIN "
+                   "INSERT INTO images_fts(rowid, text) VALUES (new.id, new.text); "
+                   "END")
+        op.execute("CREATE TRIGGER images_fts_delete AFTER DELETE ON images BEGIN "
+                   "INSERT INTO images_fts(images_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+                   "END")
+        op.execute("CREATE TRIGGER images_fts_update AFTER UPDATE OF text ON images BEGIN "
+                   "INSERT INTO images_fts(images_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+                   "INSERT INTO images_fts(rowid, text) VALUES (new.id, new.text); "
+                   "END")
+        op.execute("INSERT INTO images_fts(images_fts) VALUES ('rebuild')")
+    elif dialect == 'postgresql':
+        # expression index, postgres keeps it up to date by itself
+        op.execute("CREATE INDEX ix_images_text_fts ON images "
+                   "USING GIN (to_tsvector('simple', coalesce(text, '')))")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+
+    if dialect == 'sqlite':
+        op.execute("DROP TRIGGER images_fts_update")
+        op.execute("DROP TRIGGER images_fts_delete")
+        op.execute("DROP TRIGGER images_fts_insert")
+        op.execute("DROP TABLE images_fts")
+    elif dialect == 'postgresql':
+        op.drop_index('ix_images_text_fts', table_name='images')
@@ -28,6 +28,13 @@ class RegularIntervalWorker:
         self._interval = interval
         self._timer = None
 
+    @property
+    def running(self) -> bool:
+        """
+        :return: True if the worker has been started
+        """
+        return self._timer is not None
+
     def start(self):
         """
         Starts the worker
@@ -64,7 +71,9 @@ class RegularIntervalWorker:
         except Exception as e:
             LOGGER.error(e, exc_info=True)
         finally:
-            self._schedule_next_run()
+            # do not reschedule if the worker has been stopped while it was running
+            if self._timer is not None:
+                self._schedule_next_run()
 
     def _run(self):
         """
@@ -38,6 +38,13 @@ class ImageAnalyser:
         """
         raise NotImplementedError()
 
+    def is_local(self) -> bool:
+        """
+        :return: True if this analyser does the work on this machine (and can be run in a process pool),
+        False if it calls a remote service
+        """
+        return False
+
     def find_text(self, image: bytes) -> str or None:
         """
         Analyses the given image
@@ -45,3 +52,23 @@ class ImageAnalyser:
         :return: recognized text
         """
         raise NotImplementedError()
+
+    def find_text_batch(self, images: [bytes]) -> [str or None or Exception]:
+        """
+        Analyses multiple images, analysers that support it do this with less overhead per image than find_text
+        :param images: the images to analyse
+        :return: the recognized text of each image, or the exception that occurred while analysing it
+        """
+        result = []
+        for image in images:
+            try:
+                result.append(self.find_text(image))
+            except Exception as e:
+                result.append(e)
+        return result
+
+    def close(self) -> None:
+        """
+        Releases all resources held by this analyser
+        """
+        pass
@@ -15,13 +15,15 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 from infinitewisdom.analysis import ImageAnalyser
-from infinitewisdom.stats import GOOGLE_VISION_FIND_TEXT_TIME
+from infinitewisdom.stats import GOOGLE_VISION_FIND_TEXT_TIME, GOOGLE_VISION_FIND_TEXT_BATCH_TIME
 
 
 class GoogleVision(ImageAnalyser):
     """
     Google Vision API implementation
     """
+    # maximum number of images per batch_annotate_images request
+    MAX_BATCH_SIZE = 16
 
     def __init__(self, auth_file_path: str, monthly_capacity: float = None):
         """
@@ -65,3 +67,23 @@ class GoogleVision(ImageAnalyser):
             return text_annotations[0].description
         else:
             return None
+
+    @GOOGLE_VISION_FIND_TEXT_BATCH_TIME.time()
+    def find_text_batch(self, images: [bytes]) -> [str or None or Exception]:
+        from google.cloud.vision import enums, types
+
+        feature = types.Feature(type=enums.Feature.Type.TEXT_DETECTION)
+        result = []
+        for start in range(0, len(images), self.MAX_BATCH_SIZE):
+            requests = [types.AnnotateImageRequest(image=types.Image(content=image), features=[feature])
+                        for image in images[start:start + self.MAX_BATCH_SIZE]]
+            response = self._client.batch_annotate_images(requests)
+            for image_response in response.responses:
+                if image_response.error.code != 0:
+                    result.append(Exception(image_response.error.message))
+                elif len(image_response.text_annotations) > 0:
+                    # the first annotation contains the whole thing
+                    result.append(image_response.text_annotations[0].description)
+                else:
+                    result.append(None)
+        return result
@@ -14,11 +14,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import requests
+from concurrent.futures import ThreadPoolExecutor
 
 from infinitewisdom.analysis import ImageAnalyser
-from infinitewisdom.const import REQUESTS_TIMEOUT
-from infinitewisdom.stats import MICROSOFT_AZURE_FIND_TEXT_TIME
+from infinitewisdom.httpclient import HTTP_CLIENT
+from infinitewisdom.stats import MICROSOFT_AZURE_FIND_TEXT_TIME, MICROSOFT_AZURE_FIND_TEXT_BATCH_TIME
 
 
 class AzureComputerVision(ImageAnalyser):
@@ -26,11 +26,13 @@ class AzureComputerVision(ImageAnalyser):
     Microsoft Azure Computer Vision API implementation
     """
 
-    def __init__(self, subscription_key: str, region: str = "francecentral", monthly_capacity: float = None):
+    def __init__(self, subscription_key: str, region: str = "francecentral", monthly_capacity: float = None,
+                 concurrency: int = 4):
         """
         :param subscription_key: subscription key
         :param region: You must use the same region in your REST call as you used to get your subscription keys.
         :param monthly_capacity: custom monthly capacity (optional)
+        :param concurrency: maximum number of concurrent requests when analysing a batch of images
         """
         self._subscription_key = subscription_key
         self._region = region
@@ -43,6 +45,9 @@ class AzureComputerVision(ImageAnalyser):
         else:
             self._monthly_capacity = float(monthly_capacity)
 
+        # the api has no batch endpoint, so the requests of a batch are sent concurrently
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="azure-ocr")
+
     def get_identifier(self) -> str:
         from infinitewisdom.const import IMAGE_ANALYSIS_TYPE_AZURE
         return IMAGE_ANALYSIS_TYPE_AZURE
@@ -71,7 +76,7 @@ class AzureComputerVision(ImageAnalyser):
         # response = requests.post(self._ocr_url, headers=headers, params=params, json=json_data,
         #                          timeout=REQUESTS_TIMEOUT)
 
-        response = requests.post(self._ocr_url, headers=headers, params=params, data=image, timeout=REQUESTS_TIMEOUT)
+        response = HTTP_CLIENT.post(self._ocr_url, headers=headers, params=params, data=image)
         response.raise_for_status()
         analysis = response.json()
 
@@ -88,3 +93,17 @@ class AzureComputerVision(ImageAnalyser):
             return text
         else:
             return None
+
+    @MICROSOFT_AZURE_FIND_TEXT_BATCH_TIME.time()
+    def find_text_batch(self, images: [bytes]) -> [str or None or Exception]:
+        futures = [self._executor.submit(self.find_text, image) for image in images]
+        result = []
+        for future in futures:
+            try:
+                result.append(future.result())
+            except Exception as e:
+                result.append(e)
+        return result
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
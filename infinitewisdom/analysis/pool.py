@@ -0,0 +1,178 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, Future
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.util import Finalize
+
+from infinitewisdom.analysis import ImageAnalyser
+from infinitewisdom.persistence.image_data.factory import create_image_data_backend
+from infinitewisdom.stats import IMAGE_ANALYSIS_WORKER_BUSY_TIME, IMAGE_ANALYSIS_WORKER_UTILIZATION, \
+    ANALYSER_FIND_TEXT_TIME
+from infinitewisdom.util import create_perceptual_hash
+
+LOGGER = logging.getLogger(__name__)
+
+# image data backend and analyser of an analysis worker process
+_worker_store = None
+_worker_analyser = None
+
+
+def _init_worker(backend_settings: dict, analyser: ImageAnalyser) -> None:
+    """
+    Opens the image data backend of a worker process
+    :param backend_settings: keyword arguments for create_image_data_backend
+    :param analyser: the analyser to run
+    """
+    global _worker_store, _worker_analyser
+    _worker_store = create_image_data_backend(**backend_settings)
+    _worker_analyser = analyser
+    # release the resources of the analyser (f.ex. tesseract engines) when the pool shuts the process down
+    Finalize(None, analyser.close, exitpriority=10)
+
+
+def _analyse(image_hash: str, with_perceptual_hash: bool) -> "AnalysisResult":
+    """
+    Analyses the stored image data of the given hash in a worker process
+    :param image_hash: hash of the image
+    :param with_perceptual_hash: whether to compute the perceptual hash of the image too
+    :return: the result
+    """
+    start = time.perf_counter()
+    image_data = _worker_store.get(image_hash)
+    if image_data is None:
+        return AnalysisResult(image_hash, os.getpid(), time.perf_counter() - start, found=False)
+
+    text = _worker_analyser.find_text(image_data)
+    perceptual_hash = create_perceptual_hash(image_data) if with_perceptual_hash else None
+    return AnalysisResult(image_hash, os.getpid(), time.perf_counter() - start, text=text,
+                          perceptual_hash=perceptual_hash)
+
+
+class AnalysisResult:
+    """
+    Result of the analysis of a single image in a worker process
+    """
+
+    def __init__(self, image_hash: str, worker: int, busy_time: float, found: bool = True, text: str = None,
+                 perceptual_hash: str = None):
+        """
+        :param image_hash: hash of the analysed image
+        :param worker: process id of the worker
+        :param busy_time: seconds the worker spent on the image
+        :param found: False if the image data did not exist
+        :param text: the recognized text
+        :param perceptual_hash: the perceptual hash, if requested
+        """
+        self.image_hash = image_hash
+        self.worker = worker
+        self.busy_time = busy_time
+        self.found = found
+        self.text = text
+        self.perceptual_hash = perceptual_hash
+
+
+class AnalysisPool:
+    """
+    Runs a local image analyser in a pool of processes, so CPU heavy text recognition uses all cores.
+    Only image hashes and results are passed between processes, the workers read the image data
+    from their own (read-only) connection to the image data store.
+    """
+    UTILIZATION_WINDOW = 60
+
+    def __init__(self, analyser: ImageAnalyser, backend_settings: dict, workers: int):
+        """
+        :param analyser: the (local) analyser to run, it is pickled once for every worker process
+        :param backend_settings: image data backend settings, see ImageDataPersistence.image_data_backend_settings
+        :param workers: number of worker processes
+        """
+        self._analyser = analyser
+        self._backend_settings = dict(backend_settings)
+        # the workers read every image only once, caching would only waste their memory
+        self._backend_settings["cache_size"] = 0
+        # the store is written by the main process only
+        self._backend_settings["read_only"] = True
+        self._workers = workers
+        self._worker_names = {}
+        self._busy_times = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+        self._executor = self._create_executor()
+
+    @property
+    def analyser(self) -> ImageAnalyser:
+        return self._analyser
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    def submit(self, image_hash: str, with_perceptual_hash: bool = False) -> Future:
+        """
+        Schedules the analysis of an image
+        :param image_hash: hash of the image
+        :param with_perceptual_hash: whether to compute the perceptual hash of the image too
+        :return: future of the AnalysisResult
+        """
+        try:
+            future = self._executor.submit(_analyse, image_hash, with_perceptual_hash)
+        except BrokenProcessPool:
+            LOGGER.warning("Analysis process pool is broken, restarting it")
+            with self._lock:
+                self._worker_names.clear()
+            self._executor = self._create_executor()
+            future = self._executor.submit(_analyse, image_hash, with_perceptual_hash)
+        future.add_done_callback(self._record)
+        return future
+
+    def shutdown(self) -> None:
+        """
+        Stops all worker processes after the scheduled analyses have finished
+        """
+        self._executor.shutdown(wait=True)
+
+    def _create_executor(self) -> ProcessPoolExecutor:
+        # spawn, to not fork the threads and database connections of the bot
+        context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(max_workers=self._workers, mp_context=context, initializer=_init_worker,
+                                   initargs=(self._backend_settings, self._analyser))
+
+    def _record(self, future: Future) -> None:
+        """
+        Updates the utilization statistics with a finished analysis
+        """
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        now = time.time()
+        with self._lock:
+            # label workers by their start order instead of their (ever changing) process ids
+            name = self._worker_names.setdefault(result.worker, str(len(self._worker_names)))
+            self._busy_times.setdefault(name, deque()).append((now, result.busy_time))
+            IMAGE_ANALYSIS_WORKER_BUSY_TIME.labels(worker=name).inc(result.busy_time)
+            ANALYSER_FIND_TEXT_TIME.labels(name=self._analyser.get_identifier()).observe(result.busy_time)
+
+            window = max(1.0, min(self.UTILIZATION_WINDOW, now - self._started))
+            for worker, busy_times in self._busy_times.items():
+                while len(busy_times) > 0 and busy_times[0][0] < now - self.UTILIZATION_WINDOW:
+                    busy_times.popleft()
+                busy = sum(map(lambda x: x[1], busy_times))
+                IMAGE_ANALYSIS_WORKER_UTILIZATION.labels(worker=worker).set(min(1.0, busy / window))
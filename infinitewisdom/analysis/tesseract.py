@@ -37,6 +37,9 @@ class Tesseract(ImageAnalyser):
     def get_monthly_capacity(self):
         return math.inf
 
+    def is_local(self) -> bool:
+        return True
+
     @TESSERACT_FIND_TEXT_TIME.time()
     def find_text(self, image: bytes):
         try:
@@ -0,0 +1,78 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import threading
+
+from infinitewisdom.analysis.tesseract import Tesseract
+from infinitewisdom.stats import TESSERACT_FIND_TEXT_TIME
+
+
+class TesseractApi(Tesseract):
+    """
+    tesserocr implementation, that keeps a Tesseract engine per thread instead of
+    starting a tesseract process (and loading its language model) for every image.
+    Results are stored with the same identifier as the pytesseract implementation.
+    """
+
+    def __init__(self, language: str = "eng"):
+        """
+        :param language: the language model to load
+        """
+        # fail on startup if tesserocr is not installed, instead of failing the analysis of every image
+        from tesserocr import PyTessBaseAPI
+
+        self._api_class = PyTessBaseAPI
+        self._language = language
+        self._local = threading.local()
+        # engines of all threads, to release them in close()
+        self._apis = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # engines can not be shared with other processes, they are created on first use
+        return {"_language": self._language}
+
+    def __setstate__(self, state):
+        self.__init__(state["_language"])
+
+    @TESSERACT_FIND_TEXT_TIME.time()
+    def find_text(self, image: bytes):
+        # errors are raised (instead of returning None) so the image is analysed again later
+        image = self._preprocess(image)
+        api = self._get_api()
+        height, width = image.shape
+        # the grayscale image is passed to the engine directly, without encoding it again
+        api.SetImageBytes(image.tobytes(), width, height, 1, width)
+        return api.GetUTF8Text()
+
+    def _get_api(self):
+        """
+        :return: the engine of the current thread
+        """
+        api = getattr(self._local, "api", None)
+        if api is None:
+            api = self._api_class(lang=self._language)
+            self._local.api = api
+            with self._lock:
+                self._apis.append(api)
+        return api
+
+    def close(self) -> None:
+        with self._lock:
+            for api in self._apis:
+                api.End()
+            self._apis.clear()
+            # threads that are still used get a new engine
+            self._local = threading.local()
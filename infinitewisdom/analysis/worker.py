@@ -14,15 +14,20 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
+import math
+import os
 import time
+from concurrent.futures import Future, wait, FIRST_COMPLETED
 
 from infinitewisdom import RegularIntervalWorker
 from infinitewisdom.analysis import ImageAnalyser
+from infinitewisdom.analysis.pool import AnalysisPool
 from infinitewisdom.config.config import AppConfig
-from infinitewisdom.persistence import ImageDataPersistence, _session_scope
+from infinitewisdom.id_queue import IdQueue
+from infinitewisdom.persistence import ImageDataPersistence, Image, _session_scope
 from infinitewisdom.stats import ANALYSER_TIME, ANALYSER_CAPACITY, IMAGE_ANALYSIS_QUEUE_LENGTH
 from infinitewisdom.util import select_best_available_analyser, format_for_single_line_log, remaining_capacity, \
-    download_image_bytes
+    download_image_bytes, create_perceptual_hash
 
 LOGGER = logging.getLogger(__name__)
 
@@ -51,8 +56,14 @@ class AnalysisWorker(RegularIntervalWorker):
             self._target_quality = sorted(self._image_analysers, key=lambda x: x.get_quality(), reverse=True)[
                 0].get_quality()
 
+        workers = config.IMAGE_ANALYSIS_WORKERS.value
+        self._workers = workers if workers > 0 else os.cpu_count() or 1
+        self._batch_size = config.IMAGE_ANALYSIS_BATCH_SIZE.value
+        self._pools = {}
+
+        self._not_optimal_ids = IdQueue(config.IMAGE_ANALYSIS_QUEUE_SIZE.value, IMAGE_ANALYSIS_QUEUE_LENGTH)
         with _session_scope() as session:
-            self._not_optimal_ids = set(self._persistence.find_non_optimal(session, self._target_quality))
+            self._not_optimal_ids.load(self._persistence.find_non_optimal(session, self._target_quality))
 
     def start(self):
         if len(self._image_analysers) <= 0:
@@ -62,97 +73,262 @@ class AnalysisWorker(RegularIntervalWorker):
         with _session_scope(False) as session:
             self._update_stats(session)
 
+        if self._workers > 1:
+            backend_settings = self._persistence.image_data_backend_settings
+            for analyser in filter(lambda x: x.is_local(), self._image_analysers):
+                LOGGER.debug("Running {} in {} processes".format(analyser.get_identifier(), self._workers))
+                self._pools[analyser.get_identifier()] = AnalysisPool(analyser, backend_settings, self._workers)
+
         super().start()
 
-    def add_image_to_queue(self, image_entity_id: int):
-        self._not_optimal_ids.add(image_entity_id)
+    def stop(self):
+        super().stop()
+        for pool in self._pools.values():
+            pool.shutdown()
+        for analyser in self._image_analysers:
+            analyser.close()
+
+    def add_image_to_queue(self, image_entity_id: int, timeout: float = None) -> bool:
+        """
+        Schedules an image for analysis, waiting if the queue is full
+        :param image_entity_id: the entity id
+        :param timeout: maximum number of seconds to wait, None waits forever
+        :return: True if the image has been queued, False if it will be picked up from the database later
+        """
+        if not self.running:
+            # nobody is going to empty the queue
+            timeout = 0
+        return self._not_optimal_ids.put(image_entity_id, timeout)
 
     @ANALYSER_TIME.time()
     def _run(self):
         """
         The job that is executed regularly by this crawler
         """
+        if len(self._pools) > 0:
+            self._run_pools()
+            return
+
         with _session_scope() as session:
-            queue_length = len(self._not_optimal_ids)
-            IMAGE_ANALYSIS_QUEUE_LENGTH.set(queue_length)
-            if queue_length <= 0:
-                # sleep for a longer time period to reduce load
-                time.sleep(60)
-                self._not_optimal_ids = set(self._persistence.find_non_optimal(session, self._target_quality))
+            batch = self._next_batch(session)
+            if batch is None:
+                self._idle(session)
                 return
+            analyser, entities = batch
+            self._analyse(session, analyser, entities)
+            self._update_stats(session)
 
-            entity = None
-            while entity is None:
-                if queue_length <= 0:
-                    return
-                image_id = self._not_optimal_ids.pop()
-                queue_length -= 1
-                IMAGE_ANALYSIS_QUEUE_LENGTH.set(queue_length)
-                entity = self._persistence.get_image(session, image_id)
-                if entity is None:
-                    LOGGER.warning(f"Image id scheduled for analysis not found: {image_id}")
-                    # the entity has probably been removed in the meantime
-                    continue
+    def _run_pools(self):
+        """
+        Keeps the process pools busy until there is nothing left to analyse or the worker is stopped
+        """
+        in_flight = {}
+        while self.running:
+            with _session_scope() as session:
+                idle = self._submit(session, in_flight)
 
-            analyser = select_best_available_analyser(session, self._image_analysers, self._persistence)
-            if analyser is None:
-                # No analyser available, skipping
-                # sleep for a longer time period to reduce db load
-                time.sleep(60)
+            if len(in_flight) <= 0:
+                if idle:
+                    with _session_scope() as session:
+                        self._idle(session)
                 return
 
+            done, _ = wait(in_flight.keys(), return_when=FIRST_COMPLETED)
+            with _session_scope() as session:
+                for future in done:
+                    entity_id, analyser = in_flight.pop(future)
+                    self._apply_result(session, entity_id, analyser, future)
+                self._update_stats(session)
+
+    def _submit(self, session, in_flight: dict) -> bool:
+        """
+        Hands entities to the process pools until every worker process has a queued image
+        :param in_flight: future -> (entity id, analyser) of all scheduled analyses
+        :return: True if there is nothing to analyse right now
+        """
+        while len(in_flight) < 2 * self._workers:
+            batch = self._next_batch(session, 2 * self._workers - len(in_flight))
+            if batch is None:
+                return True
+            analyser, entities = batch
+
+            pool = self._pools.get(analyser.get_identifier(), None)
+            if pool is None:
+                # remote analysers are called from this thread
+                self._analyse(session, analyser, entities)
+                continue
+
+            for entity in entities:
+                if entity.image_hash is None or not self._persistence.image_data_store.exists(entity.image_hash):
+                    self._restore_image_data(session, entity)
+                    continue
+                future = pool.submit(entity.image_hash, entity.perceptual_hash is None)
+                in_flight[future] = (entity.id, analyser)
+        return False
+
+    def _next_batch(self, session, pool_slots: int = None) -> (ImageAnalyser, [Image]) or None:
+        """
+        Selects the analyser to use and takes the entities it should analyse next from the queue
+        :param pool_slots: maximum number of entities for an analyser that runs in a process pool
+        :return: analyser and entities or None if there is nothing to analyse right now
+        """
+        analyser = select_best_available_analyser(session, self._image_analysers, self._persistence)
+        if analyser is None:
+            # No analyser available, skipping
+            return None
+
+        limit = self._batch_size
+        if analyser.get_identifier() in self._pools and pool_slots is not None:
+            limit = pool_slots
+        if not math.isinf(analyser.get_monthly_capacity()):
+            # do not exceed the monthly capacity by analysing a whole batch
+            limit = max(1, min(limit, int(remaining_capacity(session, analyser, self._persistence))))
+
+        entities = []
+        while len(entities) < limit:
+            image_id = self._not_optimal_ids.pop()
+            if image_id is None:
+                break
+            entity = self._persistence.get_image(session, image_id)
+            if entity is None:
+                LOGGER.warning(f"Image id scheduled for analysis not found: {image_id}")
+                # the entity has probably been removed in the meantime
+                continue
             if entity.analyser_quality is not None and entity.analyser_quality >= analyser.get_quality():
                 LOGGER.debug(
                     "Not analysing '{}' with '{}' because it wouldn't improve analysis quality ({} vs {})".format(
                         entity.url, analyser.get_identifier(), entity.analyser_quality, analyser.get_quality()))
-                # sleep for a longer time period to reduce db load
-                time.sleep(60)
-                return
+                continue
+            entities.append(entity)
+
+        if len(entities) <= 0:
+            return None
+        return analyser, entities
+
+    def _idle(self, session):
+        """
+        Waits for new work when there is nothing to analyse
+        """
+        # sleep for a longer time period to reduce load
+        time.sleep(60)
+        if len(self._not_optimal_ids) <= 0:
+            self._not_optimal_ids.load(self._persistence.find_non_optimal(session, self._target_quality))
 
+    def _analyse(self, session, analyser: ImageAnalyser, entities: [Image]):
+        """
+        Analyses a batch of entities in the current thread
+        """
+        analysed = []
+        images = []
+        for entity in entities:
             image_data = self._persistence.get_image_data(entity)
             if image_data is None:
-                LOGGER.warning(
-                    "No image data found for entity with image_hash {}, it will not be analysed.".format(
-                        entity.image_hash))
-                try:
-                    image_data = download_image_bytes(entity.url)
-                    self._persistence.update(session, entity, image_data)
-                except Exception as e:
-                    # if len(entity.telegram_ids) > 0:
-                    #     LOGGER.warning(
-                    #         "Error downloading image data from original source, using telegram upload instead. {}".format(
-                    #             entity))
-                    #     # TODO:
-                    # else:
-                    LOGGER.error(
-                        "Error trying to download missing image data for url '{}', deleting entity.".format(entity.url),
-                        e)
-                    self._persistence.delete(session, entity)
-                return
+                self._restore_image_data(session, entity)
+                continue
+
+            if entity.perceptual_hash is None:
+                # images added before perceptual hashes were introduced
+                entity.perceptual_hash = create_perceptual_hash(image_data)
+            analysed.append(entity)
+            images.append(image_data)
 
-            old_analyser = entity.analyser
-            old_quality = entity.analyser_quality
-            if old_quality is None:
-                old_quality = 0
+        if len(images) <= 0:
+            return
+
+        try:
+            texts = analyser.find_text_batch(images)
+        except Exception as e:
+            # f.ex. the quota of a remote service is exceeded, try the whole batch again later
+            LOGGER.error("Error analysing a batch of {} images with '{}': {}".format(
+                len(analysed), analyser.get_identifier(), e))
+            for entity in analysed:
+                self._not_optimal_ids.put(entity.id, 0)
+            return
+
+        for entity, text in zip(analysed, texts):
+            if isinstance(text, Exception):
+                LOGGER.error("Error analysing '{}' with '{}': {}".format(entity.url, analyser.get_identifier(), text))
+                # try again later, unless the queue is full (then it is picked up from the database)
+                self._not_optimal_ids.put(entity.id, 0)
+                continue
+            self._update_analysis(session, entity, analyser, text)
+
+    def _apply_result(self, session, entity_id: int, analyser: ImageAnalyser, future: Future):
+        """
+        Updates an entity with the result of an analysis that has been run in a process pool
+        """
+        try:
+            result = future.result()
+        except Exception as e:
+            LOGGER.error("Error analysing image #{} with '{}': {}".format(entity_id, analyser.get_identifier(), e))
+            # try again later, unless the queue is full (then it is picked up from the database)
+            self._not_optimal_ids.put(entity_id, 0)
+            return
 
-            entity.analyser = analyser.get_identifier()
-            entity.analyser_quality = analyser.get_quality()
-            new_text = analyser.find_text(image_data)
+        entity = self._persistence.get_image(session, entity_id)
+        if entity is None:
+            # the entity has probably been removed in the meantime
+            return
+        if not result.found:
+            if self._persistence.image_data_store.exists(entity.image_hash):
+                # the worker process did not see the data (yet), try again later instead of downloading it again
+                LOGGER.warning("Analysis worker did not find existing image data of image #{}".format(entity_id))
+                self._not_optimal_ids.put(entity.id, 0)
+                return
+            self._restore_image_data(session, entity)
+            return
 
-            if (new_text is None or len(new_text) <= 0) and entity.text is not None and len(entity.text) > 0:
-                LOGGER.debug("Ignoring new analysis text because it would delete it")
-            else:
-                entity.text = new_text
+        if result.perceptual_hash is not None:
+            entity.perceptual_hash = result.perceptual_hash
+        self._update_analysis(session, entity, analyser, result.text)
 
+    def _restore_image_data(self, session, entity: Image):
+        """
+        Downloads missing image data of an entity again, the entity is deleted if that is not possible
+        """
+        LOGGER.warning(
+            "No image data found for entity with image_hash {}, it will not be analysed.".format(entity.image_hash))
+        try:
+            image_data = download_image_bytes(entity.url)
             self._persistence.update(session, entity, image_data)
-            LOGGER.debug(
-                "Updated analysis of '{}' with '{}' (was '{}') with a quality improvement of {} ({} -> {}): {}".format(
-                    entity.url, analyser.get_identifier(), old_analyser, entity.analyser_quality - old_quality,
-                    old_quality,
-                    entity.analyser_quality,
-                    format_for_single_line_log(entity.text)))
+        except Exception as e:
+            # if len(entity.telegram_ids) > 0:
+            #     LOGGER.warning(
+            #         "Error downloading image data from original source, using telegram upload instead. {}".format(
+            #             entity))
+            #     # TODO:
+            # else:
+            LOGGER.error(
+                "Error trying to download missing image data for url '{}', deleting entity.".format(entity.url), e)
+            self._persistence.delete(session, entity)
 
-            self._update_stats(session)
+    def _update_analysis(self, session, entity: Image, analyser: ImageAnalyser, new_text: str or None):
+        """
+        Stores the result of an analysis
+        :param entity: the analysed entity
+        :param analyser: the analyser that has been used
+        :param new_text: the recognized text
+        """
+        old_analyser = entity.analyser
+        old_quality = entity.analyser_quality
+        if old_quality is None:
+            old_quality = 0
+
+        entity.analyser = analyser.get_identifier()
+        entity.analyser_quality = analyser.get_quality()
+
+        if (new_text is None or len(new_text) <= 0) and entity.text is not None and len(entity.text) > 0:
+            LOGGER.debug("Ignoring new analysis text because it would delete it")
+        else:
+            entity.text = new_text
+
+        self._persistence.update(session, entity)
+        LOGGER.debug(
+            "Updated analysis of '{}' with '{}' (was '{}') with a quality improvement of {} ({} -> {}): {}".format(
+                entity.url, analyser.get_identifier(), old_analyser, entity.analyser_quality - old_quality,
+                old_quality,
+                entity.analyser_quality,
+                format_for_single_line_log(entity.text)))
 
     def _update_stats(self, session):
         for analyser in self._image_analysers:
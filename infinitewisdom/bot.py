@@ -29,9 +29,9 @@ from infinitewisdom.config.config import AppConfig
 from infinitewisdom.const import COMMAND_START, REPLY_COMMAND_DELETE, IMAGE_ANALYSIS_TYPE_HUMAN, COMMAND_FORCE_ANALYSIS, \
     REPLY_COMMAND_INFO, COMMAND_INSPIRE, REPLY_COMMAND_TEXT, COMMAND_STATS, COMMAND_VERSION, COMMAND_COMMANDS, \
     COMMAND_CONFIG
-from infinitewisdom.persistence import Image, ImageDataPersistence, _session_scope
+from infinitewisdom.persistence import Image, ImageDataPersistence, ImageRecord, _session_scope
 from infinitewisdom.stats import INSPIRE_TIME, INLINE_TIME, START_TIME, CHOSEN_INLINE_RESULTS, format_metrics
-from infinitewisdom.util import send_photo, send_message, cryptographic_hash
+from infinitewisdom.util import send_photo, send_message
 
 LOGGER = logging.getLogger(__name__)
 
@@ -94,7 +94,9 @@ class InfiniteWisdomBot:
         self._persistence = persistence
         self._image_analysers = image_analysers
 
-        self._updater = Updater(token=self._config.TELEGRAM_BOT_TOKEN.value, use_context=True)
+        self._updater = Updater(token=self._config.TELEGRAM_BOT_TOKEN.value,
+                                base_url=self._config.TELEGRAM_BOT_API_URL.value,
+                                use_context=True)
         LOGGER.debug("Using bot id '{}' ({})".format(self._updater.bot.id, self._updater.bot.name))
 
         self._dispatcher = self._updater.dispatcher
@@ -452,14 +454,14 @@ class InfiniteWisdomBot:
             offset = int(offset)
         badge_size = self._config.TELEGRAM_INLINE_BADGE_SIZE.value
 
-        with _session_scope() as session:
+        with _session_scope(False) as session:
             if len(query) > 0:
-                entities = self._persistence.find_by_text(session, query, badge_size, offset)
+                records = self._persistence.find_records_by_text(session, self.bot.token, query, badge_size, offset)
             else:
-                entities = self._persistence.get_random(session, page_size=badge_size)
+                records = self._persistence.get_random_records(session, self.bot.token, page_size=badge_size)
+
+        results = list(map(lambda x: self._entity_to_inline_query_result(x), records))
 
-            results = list(map(lambda x: self._entity_to_inline_query_result(x), entities))
-        
         LOGGER.debug('Inline query "{}": {}+{} results'.format(query, len(results), offset))
         if len(results) > 0:
             new_offset = offset + badge_size
@@ -490,64 +492,50 @@ class InfiniteWisdomBot:
         chat_id = update.effective_chat.id
         bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
 
-        with _session_scope() as session:
+        with _session_scope(False) as session:
+            records = self._persistence.get_random_records(session, bot.token, page_size=1)
+        if len(records) <= 0:
+            LOGGER.warning("No images available to send to chat id: {}".format(chat_id))
+            return
+        record = records[0]
+        LOGGER.debug("Sending random quote '{}' to chat id: {}".format(record.image_hash, chat_id))
 
-            entity = self._persistence.get_random(session)
-            LOGGER.debug("Sending random quote '{}' to chat id: {}".format(entity.image_hash, chat_id))
-
-            caption = None
-            if self._config.TELEGRAM_CAPTION_IMAGES_WITH_TEXT.value:
-                caption = entity.text
-
-            telegram_file_ids_for_current_bot = self.find_telegram_file_ids_for_current_bot(bot.token, entity)
-            if len(telegram_file_ids_for_current_bot) > 0:
-                file_ids = send_photo(bot=bot, chat_id=chat_id, file_id=telegram_file_ids_for_current_bot[0].id,
-                                      caption=caption)
-                bot_token = self._persistence.get_bot_token(session, bot.token)
-                for file_id in file_ids:
-                    entity.add_file_id(bot_token, file_id)
-                self._persistence.update(session, entity)
+        caption = None
+        if self._config.TELEGRAM_CAPTION_IMAGES_WITH_TEXT.value:
+            caption = record.text
+
+        # no database session is held while talking to telegram
+        if record.telegram_file_id is not None:
+            file_ids = send_photo(bot=bot, chat_id=chat_id, file_id=record.telegram_file_id, caption=caption)
+        else:
+            image_file = self._persistence.open_image_data(record)
+            if image_file is None:
+                LOGGER.warning("Missing image data for entity: {}".format(record.image_hash))
                 return
+            try:
+                file_ids = send_photo(bot=bot, chat_id=chat_id, image_data=image_file, caption=caption)
+            finally:
+                image_file.close()
 
-            image_bytes = self._persistence.get_image_data(entity)
-            file_ids = send_photo(bot=bot, chat_id=chat_id, image_data=image_bytes, caption=caption)
-            bot_token = self._persistence.get_bot_token(session, bot.token)
-            for file_id in file_ids:
-                entity.add_file_id(bot_token, file_id)
-            self._persistence.update(session, entity, image_bytes)
+        self._persistence.add_telegram_file_ids(record.id, bot.token, file_ids)
 
-    def _entity_to_inline_query_result(self, entity: Image):
+    @staticmethod
+    def _entity_to_inline_query_result(record: ImageRecord):
         """
-        Creates a telegram inline query result object for the given entity
-        :param entity: the entity to use
+        Creates a telegram inline query result object for the given record
+        :param record: the image record to use
         :return: inline result object
         """
-        telegram_file_ids_for_current_bot = self.find_telegram_file_ids_for_current_bot(self.bot.token, entity)
-        if len(telegram_file_ids_for_current_bot) > 0:
+        if record.telegram_file_id is not None:
             return InlineQueryResultCachedPhoto(
-                id=entity.image_hash,
-                photo_file_id=str(telegram_file_ids_for_current_bot[0].id),
+                id=record.image_hash,
+                photo_file_id=str(record.telegram_file_id),
             )
         else:
             return InlineQueryResultPhoto(
-                id=entity.image_hash,
-                photo_url=entity.url,
-                thumb_url=entity.url,
+                id=record.image_hash,
+                photo_url=record.url,
+                thumb_url=record.url,
                 photo_height=50,
                 photo_width=50
             )
-
-    @staticmethod
-    def find_telegram_file_ids_for_current_bot(token: str, entity: Image) -> []:
-        """
-        Filters all telegram file ids of an image for the current bot
-        :param token: the bot token
-        :param entity: the image entity
-        :return: list of matching telegram file ids
-        """
-        hashed_bot_token = cryptographic_hash(token)
-        result = []
-        for file_id in entity.telegram_file_ids:
-            if hashed_bot_token in list(map(lambda x: x.hashed_token, file_id.bot_tokens)):
-                result.append(file_id)
-        return result
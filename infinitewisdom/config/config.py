@@ -33,7 +33,9 @@ from infinitewisdom.const import CONFIG_FILE_NAME, \
     CONFIG_NODE_CRAWLER, CONFIG_NODE_TELEGRAM, CONFIG_NODE_GOOGLE_VISION, \
     CONFIG_NODE_TESSERACT, CONFIG_NODE_ENABLED, CONFIG_NODE_CAPACITY_PER_MONTH, CONFIG_NODE_INTERVAL, \
     CONFIG_NODE_UPLOADER, DEFAULT_FILE_PERSISTENCE_BASE_PATH, CONFIG_NODE_MICROSOFT_AZURE, CONFIG_NODE_PORT, \
-    CONFIG_NODE_STATS
+    CONFIG_NODE_STATS, IMAGE_DATA_BACKEND_FILESYSTEM, IMAGE_DATA_BACKENDS, IMAGE_DATA_BACKEND_S3, CONFIG_NODE_S3, \
+    CRAWLER_MODES, CRAWLER_MODE_TIMER, CONFIG_NODE_HTTP, IMAGE_API_URL, TELEGRAM_BOT_API_URL, \
+    TESSERACT_ENGINES, TESSERACT_ENGINE_PYTESSERACT, DEFAULT_CRAWLER_MAX_INTERVAL
 
 
 class AppConfig(ConfigBase):
@@ -70,6 +72,15 @@ class AppConfig(ConfigBase):
         example="123456:ABC-DEF1234ghIkl-zyx57W2v1u123ew11",
         secret=True)
 
+    TELEGRAM_BOT_API_URL = StringConfigEntry(
+        description="Base url of the telegram bot API, the bot token is appended to it",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_TELEGRAM,
+            "bot_api_url"
+        ],
+        default=TELEGRAM_BOT_API_URL)
+
     TELEGRAM_INLINE_BADGE_SIZE = IntConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -117,6 +128,16 @@ class AppConfig(ConfigBase):
         ],
         default=3.0)
 
+    UPLOADER_QUEUE_SIZE = IntConfigEntry(
+        description="Maximum number of images waiting for upload in memory, "
+                    "the crawler slows down when the queue is full",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_UPLOADER,
+            "queue_size"
+        ],
+        default=1000)
+
     UPLOADER_CHAT_ID = IntConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -134,6 +155,113 @@ class AppConfig(ConfigBase):
         ],
         default=1.0)
 
+    CRAWLER_IMAGE_API_URL = StringConfigEntry(
+        description="Url of the image api that generates new image urls",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "image_api_url"
+        ],
+        default=IMAGE_API_URL)
+
+    CRAWLER_MAX_INTERVAL = FloatConfigEntry(
+        description="Interval in seconds the crawler slows down to when it only finds images that are already known, "
+                    "defaults to {} seconds or the crawler interval if that is longer".format(
+            DEFAULT_CRAWLER_MAX_INTERVAL),
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "max_interval"
+        ],
+        required=False,
+        default=None)
+
+    CRAWLER_NOVELTY_WINDOW = IntConfigEntry(
+        description="Number of recently crawled images used to calculate the ratio of new images",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "novelty_window"
+        ],
+        default=100)
+
+    CRAWLER_MODE = StringConfigEntry(
+        description="How the crawler is run, one of: " + ", ".join(CRAWLER_MODES),
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "mode"
+        ],
+        default=CRAWLER_MODE_TIMER)
+
+    CRAWLER_CONCURRENCY = IntConfigEntry(
+        description="Number of images that are crawled concurrently in asyncio mode",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "concurrency"
+        ],
+        default=4)
+
+    CRAWLER_RATE_LIMIT = FloatConfigEntry(
+        description="Maximum number of requests per second to a single host in asyncio mode, 0 disables the limit",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "rate_limit"
+        ],
+        default=2.0)
+
+    CRAWLER_QUEUE_SIZE = IntConfigEntry(
+        description="Maximum number of items waiting between two stages of the crawl pipeline in asyncio mode",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "queue_size"
+        ],
+        default=16)
+
+    CRAWLER_BACKPRESSURE_TIMEOUT = FloatConfigEntry(
+        description="Maximum number of seconds the crawler waits for space in the upload and analysis queues, "
+                    "images that do not fit are picked up from the database later",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "backpressure_timeout"
+        ],
+        default=60.0)
+
+    CRAWLER_URL_CACHE_SIZE = IntConfigEntry(
+        description="Number of recently crawled urls to keep in memory, "
+                    "older urls are tracked using a bloom filter",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "url_cache_size"
+        ],
+        default=10000)
+
+    CRAWLER_URL_CACHE_FILE = StringConfigEntry(
+        description="File to save the crawled url bloom filter to on shutdown, "
+                    "to not read all urls from the database on the next start",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "url_cache_file"
+        ],
+        required=False,
+        default=None)
+
+    CRAWLER_NEAR_DUPLICATE_DISTANCE = IntConfigEntry(
+        description="Maximum number of differing bits of the perceptual hashes of two images "
+                    "to consider them duplicates, -1 disables near duplicate detection",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_CRAWLER,
+            "near_duplicate_distance"
+        ],
+        default=8)
+
     SQL_PERSISTENCE_URL = StringConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -151,6 +279,114 @@ class AppConfig(ConfigBase):
         ],
         default=DEFAULT_FILE_PERSISTENCE_BASE_PATH)
 
+    FILE_PERSISTENCE_BACKEND = StringConfigEntry(
+        description="Storage backend for image data, one of: {}".format(", ".join(IMAGE_DATA_BACKENDS)),
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            "file_backend"
+        ],
+        default=IMAGE_DATA_BACKEND_FILESYSTEM)
+
+    FILE_PERSISTENCE_S3_BUCKET = StringConfigEntry(
+        description="Bucket name of the s3 image data backend",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            CONFIG_NODE_S3,
+            "bucket"
+        ],
+        default=None)
+
+    FILE_PERSISTENCE_S3_PREFIX = StringConfigEntry(
+        description="Object key prefix of the s3 image data backend",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            CONFIG_NODE_S3,
+            "prefix"
+        ],
+        default="")
+
+    FILE_PERSISTENCE_S3_ENDPOINT_URL = StringConfigEntry(
+        description="Custom endpoint url for S3 compatible services",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            CONFIG_NODE_S3,
+            "endpoint_url"
+        ],
+        default=None)
+
+    FILE_PERSISTENCE_S3_REGION = StringConfigEntry(
+        description="Region of the s3 image data backend",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            CONFIG_NODE_S3,
+            "region"
+        ],
+        default=None)
+
+    FILE_PERSISTENCE_S3_ACCESS_KEY_ID = StringConfigEntry(
+        description="Access key id of the s3 image data backend",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            CONFIG_NODE_S3,
+            "access_key_id"
+        ],
+        default=None,
+        secret=True)
+
+    FILE_PERSISTENCE_S3_SECRET_ACCESS_KEY = StringConfigEntry(
+        description="Secret access key of the s3 image data backend",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            CONFIG_NODE_S3,
+            "secret_access_key"
+        ],
+        default=None,
+        secret=True)
+
+    FILE_PERSISTENCE_CACHE_SIZE = IntConfigEntry(
+        description="Maximum number of bytes of image data to keep in memory, 0 disables the cache",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            "file_cache_size"
+        ],
+        default=64 * 1024 * 1024)
+
+    PERSISTENCE_RANDOM_SAMPLER_MAX_SIZE = IntConfigEntry(
+        description="Maximum number of image ids held in memory to select random images, "
+                    "a database query is used for bigger pools",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            "random_sampler_max_size"
+        ],
+        default=5000000)
+
+    PERSISTENCE_FILE_ID_CACHE_SIZE = IntConfigEntry(
+        description="Maximum number of images to cache the telegram file id of the current bot for",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            "file_id_cache_size"
+        ],
+        default=100000)
+
+    PERSISTENCE_FILE_ID_FLUSH_INTERVAL = FloatConfigEntry(
+        description="Interval in seconds to save buffered telegram file ids",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_PERSISTENCE,
+            "file_id_flush_interval"
+        ],
+        default=5.0)
+
     IMAGE_ANALYSIS_INTERVAL = FloatConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -159,6 +395,36 @@ class AppConfig(ConfigBase):
         ],
         default=1.0)
 
+    IMAGE_ANALYSIS_QUEUE_SIZE = IntConfigEntry(
+        description="Maximum number of images waiting for analysis in memory, "
+                    "the crawler slows down when the queue is full",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            "queue_size"
+        ],
+        default=1000)
+
+    IMAGE_ANALYSIS_BATCH_SIZE = IntConfigEntry(
+        description="Maximum number of images analysed at once, "
+                    "remote analysers send them in a single request or concurrently",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            "batch_size"
+        ],
+        default=16)
+
+    IMAGE_ANALYSIS_WORKERS = IntConfigEntry(
+        description="Number of processes local analysers (Tesseract) are run in, "
+                    "1 runs them in the analysis thread, 0 uses one process per CPU",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            "workers"
+        ],
+        default=1)
+
     IMAGE_ANALYSIS_TESSERACT_ENABLED = BoolConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -168,6 +434,16 @@ class AppConfig(ConfigBase):
         ],
         default=False)
 
+    IMAGE_ANALYSIS_TESSERACT_ENGINE = StringConfigEntry(
+        description="How Tesseract is run, one of: {}".format(", ".join(TESSERACT_ENGINES)),
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_TESSERACT,
+            "engine"
+        ],
+        default=TESSERACT_ENGINE_PYTESSERACT)
+
     IMAGE_ANALYSIS_GOOGLE_VISION_ENABLED = BoolConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -235,6 +511,43 @@ class AppConfig(ConfigBase):
         ],
         default=5000)
 
+    IMAGE_ANALYSIS_MICROSOFT_AZURE_CONCURRENCY = IntConfigEntry(
+        description="Maximum number of concurrent Microsoft Azure requests when analysing a batch of images",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_IMAGE_ANALYSIS,
+            CONFIG_NODE_MICROSOFT_AZURE,
+            "concurrency"
+        ],
+        default=4)
+
+    HTTP_POOL_SIZE = IntConfigEntry(
+        description="Maximum number of connections kept open per host for outbound HTTP requests",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            "pool_size"
+        ],
+        default=10)
+
+    HTTP_RETRIES = IntConfigEntry(
+        description="Maximum number of retries of failed outbound HTTP requests",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            "retries"
+        ],
+        default=3)
+
+    HTTP_RETRY_BACKOFF = FloatConfigEntry(
+        description="Base delay in seconds of the (jittered) exponential backoff between retries",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_HTTP,
+            "retry_backoff"
+        ],
+        default=0.5)
+
     STATS_PORT = IntConfigEntry(
         key_path=[
             CONFIG_NODE_ROOT,
@@ -244,6 +557,25 @@ class AppConfig(ConfigBase):
         default=8000
     )
 
+    STATS_INCREMENTAL = BoolConfigEntry(
+        description="Track persistence statistics from the changes of each write "
+                    "instead of counting all entities after every write",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_STATS,
+            "incremental"
+        ],
+        default=True)
+
+    STATS_RECONCILE_INTERVAL = FloatConfigEntry(
+        description="Interval in seconds to recount incrementally tracked statistics",
+        key_path=[
+            CONFIG_NODE_ROOT,
+            CONFIG_NODE_STATS,
+            "reconcile_interval"
+        ],
+        default=900.0)
+
     def _validate(self):
         """
         Validates the current configuration and throws an exception if something is wrong
@@ -252,6 +584,25 @@ class AppConfig(ConfigBase):
             raise AssertionError("Bot token is missing!")
         if self.CRAWLER_INTERVAL.value < 0:
             raise AssertionError("Image polling interval must be >= 0!")
+        if self.CRAWLER_MAX_INTERVAL.value is not None \
+                and self.CRAWLER_MAX_INTERVAL.value < self.CRAWLER_INTERVAL.value:
+            # only an explicitly configured maximum can be inconsistent, the default follows the interval
+            raise AssertionError("Maximum crawler interval must be >= crawler interval!")
+        if self.CRAWLER_MODE.value not in CRAWLER_MODES:
+            raise AssertionError("Unknown crawler mode: {}".format(self.CRAWLER_MODE.value))
+        if self.CRAWLER_CONCURRENCY.value < 1:
+            raise AssertionError("Crawler concurrency must be >= 1!")
+        if self.FILE_PERSISTENCE_BACKEND.value not in IMAGE_DATA_BACKENDS:
+            raise AssertionError("Unknown image data backend: {}".format(self.FILE_PERSISTENCE_BACKEND.value))
+        if self.FILE_PERSISTENCE_BACKEND.value == IMAGE_DATA_BACKEND_S3 \
+                and self.FILE_PERSISTENCE_S3_BUCKET.value is None:
+            raise AssertionError("Bucket name is required for the s3 image data backend")
+        if self.IMAGE_ANALYSIS_TESSERACT_ENGINE.value not in TESSERACT_ENGINES:
+            raise AssertionError("Unknown tesseract engine: {}".format(self.IMAGE_ANALYSIS_TESSERACT_ENGINE.value))
+        if self.IMAGE_ANALYSIS_BATCH_SIZE.value < 1:
+            raise AssertionError("Image analysis batch size must be >= 1!")
+        if self.IMAGE_ANALYSIS_WORKERS.value < 0:
+            raise AssertionError("Number of image analysis workers must be >= 0!")
 
         if self.IMAGE_ANALYSIS_GOOGLE_VISION_ENABLED.value:
             if self.IMAGE_ANALYSIS_GOOGLE_VISION_AUTH_FILE.value is None:
@@ -37,6 +37,25 @@ REPLY_COMMAND_DELETE = ['delete', 'd']
 
 DEFAULT_SQL_PERSISTENCE_URL = "sqlite:///infinitewisdom.db"
 DEFAULT_FILE_PERSISTENCE_BASE_PATH = "./.image_data"
+DEFAULT_CRAWLER_MAX_INTERVAL = 10.0
+
+IMAGE_DATA_BACKEND_FILESYSTEM = "filesystem"
+IMAGE_DATA_BACKEND_PACKFILE = "packfile"
+IMAGE_DATA_BACKEND_SQLITE = "sqlite"
+IMAGE_DATA_BACKEND_S3 = "s3"
+IMAGE_DATA_BACKENDS = [IMAGE_DATA_BACKEND_FILESYSTEM, IMAGE_DATA_BACKEND_PACKFILE, IMAGE_DATA_BACKEND_SQLITE,
+                       IMAGE_DATA_BACKEND_S3]
+
+CRAWLER_MODE_TIMER = "timer"
+CRAWLER_MODE_ASYNCIO = "asyncio"
+CRAWLER_MODES = [CRAWLER_MODE_TIMER, CRAWLER_MODE_ASYNCIO]
+
+TESSERACT_ENGINE_PYTESSERACT = "pytesseract"
+TESSERACT_ENGINE_TESSEROCR = "tesserocr"
+TESSERACT_ENGINES = [TESSERACT_ENGINE_PYTESSERACT, TESSERACT_ENGINE_TESSEROCR]
+
+IMAGE_API_URL = "https://inspirobot.me/api"
+TELEGRAM_BOT_API_URL = "https://api.telegram.org/bot"
 
 CONFIG_FILE_NAME = "infinitewisdom"
 
@@ -54,6 +73,8 @@ CONFIG_NODE_IMAGE_ANALYSIS = "image_analysis"
 CONFIG_NODE_INTERVAL = "interval"
 CONFIG_NODE_STATS = "stats"
 CONFIG_NODE_PORT = "port"
+CONFIG_NODE_S3 = "s3"
+CONFIG_NODE_HTTP = "http"
 
 CONFIG_NODE_TESSERACT = "tesseract"
 CONFIG_NODE_GOOGLE_VISION = "google_vision"
@@ -13,21 +13,26 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import asyncio
 import logging
+import threading
 import time
-
-import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
 
 from infinitewisdom import RegularIntervalWorker
 from infinitewisdom.analysis import ImageAnalyser
 from infinitewisdom.analysis.worker import AnalysisWorker
 from infinitewisdom.config.config import AppConfig
-from infinitewisdom.const import REQUESTS_TIMEOUT
-from infinitewisdom.persistence import ImageDataPersistence
+from infinitewisdom.const import DEFAULT_CRAWLER_MAX_INTERVAL
+from infinitewisdom.persistence import ImageDataPersistence, StagedImageData
 from infinitewisdom.persistence.sqlalchemy import Image, _session_scope
-from infinitewisdom.stats import CRAWLER_TIME
+from infinitewisdom.stats import CRAWLER_TIME, CRAWLER_NEAR_DUPLICATES, CRAWLER_IN_FLIGHT, CRAWLER_THROUGHPUT, \
+    CRAWLER_NOVELTY_RATIO, CRAWLER_EFFECTIVE_RATE, CRAWLER_STAGE_QUEUE_LENGTH, CRAWLER_STAGE_PROCESSED
 from infinitewisdom.uploader import TelegramUploader
-from infinitewisdom.util import download_image_bytes, create_hash
+from infinitewisdom.url_cache import UrlCache
+from infinitewisdom.util import download_image, create_perceptual_hash, fetch_generated_image_url
 
 LOGGER = logging.getLogger(__name__)
 
@@ -36,7 +41,6 @@ class Crawler(RegularIntervalWorker):
     """
     Crawler used to fetch new images from the image API
     """
-    URL_CACHE = {}
 
     def __init__(self, config: AppConfig, persistence: ImageDataPersistence,
                  telegram_uploader: TelegramUploader, image_analysers: [ImageAnalyser],
@@ -50,25 +54,102 @@ class Crawler(RegularIntervalWorker):
         self._image_analysers = image_analysers
         self._telegram_uploader = telegram_uploader
         self._analysis_worker = analysis_worker
+        self._image_api_url = config.CRAWLER_IMAGE_API_URL.value
+        self._near_duplicate_distance = config.CRAWLER_NEAR_DUPLICATE_DISTANCE.value
+        self._persist_lock = threading.Lock()
+        self._backpressure_timeout = config.CRAWLER_BACKPRESSURE_TIMEOUT.value
+        self._url_cache_file = config.CRAWLER_URL_CACHE_FILE.value
+        self._url_cache = UrlCache(config.CRAWLER_URL_CACHE_SIZE.value, verify=self._is_known_url)
+        self._load_url_cache()
+        self._crawl_rate = AdaptiveCrawlRate(config.CRAWLER_INTERVAL.value, config.CRAWLER_MAX_INTERVAL.value,
+                                             config.CRAWLER_NOVELTY_WINDOW.value)
+
+    def stop(self):
+        super().stop()
+        self._save_url_cache()
+
+    def _load_url_cache(self) -> None:
+        """
+        Loads the url cache file (if configured) and adds all urls that are missing in it from the database
+        """
+        if self._url_cache_file is not None:
+            self._url_cache.load(self._url_cache_file)
+        with _session_scope(False) as session:
+            self._url_cache.seed(self._persistence.get_all_urls(session, self._url_cache.max_entity_id))
+
+    def _save_url_cache(self) -> None:
+        if self._url_cache_file is None:
+            return
+        try:
+            self._url_cache.save(self._url_cache_file)
+        except Exception as e:
+            LOGGER.error("Error saving url cache: {}".format(e))
+
+    def _is_known_url(self, url: str) -> bool:
+        """
+        :return: True if an entity with the given url exists
+        """
+        with _session_scope(False) as session:
+            return self._persistence.has_url(session, url)
 
     @CRAWLER_TIME.time()
     def _run(self):
         with _session_scope() as session:
-            self._add_image_url_to_pool(session)
+            entity_id = self._add_image_url_to_pool(session)
+        # the transaction must not be kept open while waiting for the queues of the workers
+        if entity_id is not None:
+            self._fan_out(entity_id)
+        self._interval = self._crawl_rate.record(entity_id is not None)
 
-    def _add_image_url_to_pool(self, session) -> str or None:
+    def _add_image_url_to_pool(self, session) -> int or None:
         """
         Requests a new image url and adds it to the pool
-        :return: the added url
+        :return: the id of the added entity
         """
         url = self._fetch_generated_image_url()
-        if url in self.URL_CACHE:
+        if url in self._url_cache:
             # skip already processed url
             return None
+        return self._add_url(session, url)
+
+    def _add_url(self, session, url: str) -> int or None:
+        """
+        Downloads the image of the given url and adds it to the pool, unless it is already known.
+        The new entity has to be passed to _fan_out once the session has been committed.
+        :param url: the image url
+        :return: the id of the added entity
+        """
+        with self._persistence.stage_image_data() as image_data:
+            perceptual_hash = self._download(url, image_data)
+            return self._persist(session, url, image_data, perceptual_hash)
+
+    @staticmethod
+    def _download(url: str, image_data: StagedImageData) -> str or None:
+        """
+        Downloads an image into staged image data
+        :param url: the image url
+        :param image_data: the staged data to write to
+        :return: the perceptual hash of the image
+        """
+        download_image(url, image_data)
+        return create_perceptual_hash(image_data.getvalue())
 
-        image_data = download_image_bytes(url)
-        image_hash = create_hash(image_data)
+    def _persist(self, session, url: str, image_data: StagedImageData, perceptual_hash: str or None) -> int or None:
+        """
+        Adds a new entity for a downloaded image
+        :return: the id of the new entity or None if the image is already known
+        """
+        # the check and the insert must not interleave with those of concurrent downloads
+        with self._persist_lock:
+            entity = self._persist_unlocked(session, url, image_data, perceptual_hash)
+            if entity is None:
+                return None
+            LOGGER.debug('Added image #{} with URL: "{}"'.format(entity.id, url))
+            return entity.id
 
+    def _persist_unlocked(self, session, url: str, image_data: StagedImageData,
+                          perceptual_hash: str or None) -> Image or None:
+        image_hash = image_data.image_hash
         existing = self._persistence.find_by_image_hash(session, image_hash)
         if existing is not None:
             if existing.url != url:
@@ -77,25 +158,373 @@ class Crawler(RegularIntervalWorker):
                         existing.url, url, image_hash))
                 existing.url = url
                 self._persistence.update(session, existing, image_data)
-                self._telegram_uploader.add_image_to_queue(existing.id)
-            self.URL_CACHE[url] = True
+                # do not wait for the uploader while holding the lock,
+                # if its queue is full the image is picked up from the database later
+                self._telegram_uploader.add_image_to_queue(existing.id, 0)
+            self._url_cache.add(url)
             return None
 
-        entity = Image(url=url, created=time.time())
+        if perceptual_hash is not None and self._near_duplicate_distance >= 0:
+            similar = self._persistence.find_similar_image_ids(perceptual_hash, self._near_duplicate_distance)
+            if len(similar) > 0:
+                LOGGER.debug('Skipping near duplicate of image #{}: "{}"'.format(similar[0], url))
+                CRAWLER_NEAR_DUPLICATES.inc()
+                # the url is not stored, so it can not be confirmed by a database lookup later
+                self._url_cache.add(url, verifiable=False)
+                return None
+
+        entity = Image(url=url, created=time.time(), perceptual_hash=perceptual_hash)
         self._persistence.add(session, entity, image_data)
-        self._telegram_uploader.add_image_to_queue(entity.id)
-        self._analysis_worker.add_image_to_queue(entity.id)
-        LOGGER.debug('Added image #{} with URL: "{}"'.format(self._persistence.count(session), url))
+        self._url_cache.add(url, entity.id)
+        return entity
 
-        self.URL_CACHE[url] = True
-        return url
+    def _fan_out(self, entity_id: int) -> None:
+        """
+        Passes a new entity to the upload and analysis workers.
+        Blocks while their queues are full, which slows down the crawler to the pace of its consumers.
+        :param entity_id: the entity id
+        """
+        self._telegram_uploader.add_image_to_queue(entity_id, self._backpressure_timeout)
+        self._analysis_worker.add_image_to_queue(entity_id, self._backpressure_timeout)
 
-    @staticmethod
-    def _fetch_generated_image_url() -> str:
+    def _fetch_generated_image_url(self) -> str:
         """
         Requests the image api to generate a new image url
         :return: the image url
         """
-        url_page = requests.get('https://inspirobot.me/api', params={'generate': 'true'}, timeout=REQUESTS_TIMEOUT)
-        url_page.raise_for_status()
-        return url_page.text
+        return fetch_generated_image_url(self._image_api_url)
+
+
+class AdaptiveCrawlRate:
+    """
+    Adjusts the interval between image api requests to the ratio of new images among the recently crawled ones.
+    The interval is interpolated linearly between the given bounds:
+    if every image is new the crawler runs at the minimum interval, if none is new at the maximum interval.
+    """
+
+    def __init__(self, min_interval: float, max_interval: float or None, window: int):
+        """
+        :param min_interval: interval in seconds when all images are new
+        :param max_interval: interval in seconds when no image is new,
+                             None for DEFAULT_CRAWLER_MAX_INTERVAL (or min_interval if that is longer)
+        :param window: number of recent results the ratio is calculated from
+        """
+        if max_interval is None:
+            max_interval = DEFAULT_CRAWLER_MAX_INTERVAL
+        self._min_interval = min_interval
+        self._max_interval = max(min_interval, max_interval)
+        self._results = deque()
+        self._window = max(1, window)
+        self._new_count = 0
+        self._lock = threading.Lock()
+        self._publish()
+
+    @property
+    def novelty_ratio(self) -> float:
+        """
+        :return: ratio of new images among the recent results, 1 if there are no results yet
+        """
+        if len(self._results) <= 0:
+            return 1.0
+        return self._new_count / len(self._results)
+
+    @property
+    def interval(self) -> float:
+        """
+        :return: the current interval in seconds
+        """
+        return self._min_interval + (self._max_interval - self._min_interval) * (1 - self.novelty_ratio)
+
+    def record(self, new: bool) -> float:
+        """
+        Records the result of a crawl request
+        :param new: True if a new image has been added, False if it was a duplicate
+        :return: the new interval in seconds
+        """
+        with self._lock:
+            self._results.append(new)
+            self._new_count += new
+            if len(self._results) > self._window:
+                self._new_count -= self._results.popleft()
+            interval = self.interval
+            self._publish()
+        return interval
+
+    def _publish(self) -> None:
+        interval = self.interval
+        CRAWLER_NOVELTY_RATIO.set(self.novelty_ratio)
+        CRAWLER_EFFECTIVE_RATE.set(1 / interval if interval > 0 else 0)
+
+
+class HostRateLimiter:
+    """
+    Limits the number of requests per second to each host.
+    Must only be used from a single event loop.
+    """
+
+    def __init__(self, requests_per_second: float):
+        """
+        :param requests_per_second: maximum number of requests per second per host
+        """
+        self._interval = 1.0 / requests_per_second if requests_per_second > 0 else 0
+        self._host_intervals = {}
+        self._next_slots = {}
+
+    @property
+    def interval(self) -> float:
+        """
+        :return: the default interval in seconds between two requests to the same host
+        """
+        return self._interval
+
+    def set_interval(self, url: str, interval: float) -> None:
+        """
+        Overrides the interval between requests to the host of the given url
+        :param url: a url of the host
+        :param interval: interval in seconds
+        """
+        self._host_intervals[urlparse(url).hostname] = interval
+
+    async def acquire(self, url: str) -> None:
+        """
+        Waits until a request to the host of the given url is allowed
+        :param url: the url that will be requested
+        """
+        host = urlparse(url).hostname
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next_slots.get(host, now))
+        self._next_slots[host] = slot + self._host_intervals.get(host, self._interval)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class StageQueue:
+    """
+    Bounded queue between two stages of the asyncio crawl pipeline.
+    Producers wait while the queue is full, so a slow stage slows down all stages before it.
+    Must only be used from a single event loop.
+    """
+
+    def __init__(self, stage: str, maxsize: int):
+        """
+        :param stage: name of the stage consuming this queue
+        :param maxsize: maximum number of waiting items
+        """
+        self._queue = asyncio.Queue(maxsize)
+        self._gauge = CRAWLER_STAGE_QUEUE_LENGTH.labels(stage=stage)
+        self._gauge.set(0)
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    async def put(self, item) -> None:
+        await self._queue.put(item)
+        self._gauge.set(self._queue.qsize())
+
+    async def get(self):
+        item = await self._queue.get()
+        self._gauge.set(self._queue.qsize())
+        return item
+
+    def drain(self) -> list:
+        """
+        Removes all waiting items
+        :return: the removed items
+        """
+        items = []
+        while not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        self._gauge.set(0)
+        return items
+
+
+class AsyncCrawler(Crawler):
+    """
+    Crawler that runs the generate -> download -> persist -> fan out steps as separate stages on an asyncio event loop.
+    The stages are connected by bounded queues, so a slow stage (or a slow uploader or analysis worker)
+    slows down the stages before it instead of piling up work in memory.
+    The blocking steps are executed in a thread pool, requests to each host are rate limited.
+    """
+    THROUGHPUT_WINDOW = 60
+
+    STAGE_GENERATE = "generate"
+    STAGE_DOWNLOAD = "download"
+    STAGE_PERSIST = "persist"
+    STAGE_FAN_OUT = "fan_out"
+
+    def __init__(self, config: AppConfig, persistence: ImageDataPersistence,
+                 telegram_uploader: TelegramUploader, image_analysers: [ImageAnalyser],
+                 analysis_worker: AnalysisWorker):
+        super().__init__(config, persistence, telegram_uploader, image_analysers, analysis_worker)
+        self._concurrency = config.CRAWLER_CONCURRENCY.value
+        self._queue_size = config.CRAWLER_QUEUE_SIZE.value
+        self._rate_limiter = HostRateLimiter(config.CRAWLER_RATE_LIMIT.value)
+        # the rate limit is the upper bound of the adaptive rate of image api requests
+        self._crawl_rate = AdaptiveCrawlRate(self._rate_limiter.interval, config.CRAWLER_MAX_INTERVAL.value,
+                                             config.CRAWLER_NOVELTY_WINDOW.value)
+        self._loop = None
+        self._thread = None
+        self._tasks = []
+        self._finished_times = deque()
+
+    def start(self):
+        if self._thread is not None:
+            LOGGER.debug("Already running, ignoring start() call")
+            return
+        LOGGER.debug("Starting worker: {} with {} concurrent downloads".format(self.__class__.__name__,
+                                                                             self._concurrency))
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name="async-crawler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._cancel_stages)
+        self._thread.join()
+        self._thread = None
+        self._loop = None
+        self._save_url_cache()
+
+    def _run_loop(self) -> None:
+        # generate and download stages, plus one thread each for the persist and fan out stages
+        executor = ThreadPoolExecutor(max_workers=2 * self._concurrency + 2, thread_name_prefix="async-crawler")
+        self._loop.set_default_executor(executor)
+        try:
+            self._loop.run_until_complete(self._run_stages())
+        finally:
+            executor.shutdown(wait=True)
+            self._loop.close()
+
+    async def _run_stages(self) -> None:
+        urls = StageQueue(self.STAGE_DOWNLOAD, self._queue_size)
+        downloads = StageQueue(self.STAGE_PERSIST, self._queue_size)
+        entity_ids = StageQueue(self.STAGE_FAN_OUT, self._queue_size)
+
+        self._tasks = [asyncio.ensure_future(self._generate_stage(urls)) for _ in range(self._concurrency)]
+        self._tasks += [asyncio.ensure_future(self._download_stage(urls, downloads)) for _ in range(self._concurrency)]
+        self._tasks.append(asyncio.ensure_future(self._persist_stage(downloads, entity_ids)))
+        self._tasks.append(asyncio.ensure_future(self._fan_out_stage(entity_ids)))
+        try:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            for _, image_data, _ in downloads.drain():
+                image_data.discard()
+            # entities that have not been fanned out are picked up from the database by the workers
+            urls.drain()
+            entity_ids.drain()
+
+    def _cancel_stages(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+
+    async def _generate_stage(self, urls: StageQueue) -> None:
+        """
+        Requests new image urls from the image api
+        :param urls: queue of the download stage
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                await self._rate_limiter.acquire(self._image_api_url)
+                url = await loop.run_in_executor(None, self._fetch_generated_image_url)
+                CRAWLER_STAGE_PROCESSED.labels(stage=self.STAGE_GENERATE).inc()
+                if url in self._url_cache:
+                    # skip already processed url
+                    self._record(loop, False)
+                    continue
+                await urls.put(url)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(e, exc_info=True)
+                # back off like the timer based crawler does
+                await asyncio.sleep(self._interval)
+
+    async def _download_stage(self, urls: StageQueue, downloads: StageQueue) -> None:
+        """
+        Downloads and hashes images
+        :param urls: queue of urls to download
+        :param downloads: queue of the persist stage
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            url = await urls.get()
+            image_data = self._persistence.stage_image_data()
+            try:
+                await self._rate_limiter.acquire(url)
+                with CRAWLER_IN_FLIGHT.track_inprogress():
+                    perceptual_hash = await loop.run_in_executor(None, self._download, url, image_data)
+                CRAWLER_STAGE_PROCESSED.labels(stage=self.STAGE_DOWNLOAD).inc()
+                await downloads.put((url, image_data, perceptual_hash))
+            except asyncio.CancelledError:
+                image_data.discard()
+                raise
+            except Exception as e:
+                image_data.discard()
+                LOGGER.error(e, exc_info=True)
+
+    async def _persist_stage(self, downloads: StageQueue, entity_ids: StageQueue) -> None:
+        """
+        Adds downloaded images to the pool
+        :param downloads: queue of downloaded images
+        :param entity_ids: queue of the fan out stage
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            url, image_data, perceptual_hash = await downloads.get()
+            try:
+                with image_data:
+                    entity_id = await loop.run_in_executor(None, self._persist_in_session, url, image_data,
+                                                           perceptual_hash)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(e, exc_info=True)
+                entity_id = None
+            CRAWLER_STAGE_PROCESSED.labels(stage=self.STAGE_PERSIST).inc()
+            self._record(loop, entity_id is not None)
+            if entity_id is not None:
+                await entity_ids.put(entity_id)
+
+    async def _fan_out_stage(self, entity_ids: StageQueue) -> None:
+        """
+        Passes new entities to the upload and analysis workers, waiting while their queues are full
+        :param entity_ids: queue of new entity ids
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            entity_id = await entity_ids.get()
+            try:
+                await loop.run_in_executor(None, self._fan_out, entity_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                LOGGER.error(e, exc_info=True)
+            CRAWLER_STAGE_PROCESSED.labels(stage=self.STAGE_FAN_OUT).inc()
+
+    @CRAWLER_TIME.time()
+    def _persist_in_session(self, url: str, image_data: StagedImageData, perceptual_hash: str or None) -> int or None:
+        with _session_scope() as session:
+            return self._persist(session, url, image_data, perceptual_hash)
+
+    def _record(self, loop, added: bool) -> None:
+        """
+        Records the result of a crawled url
+        :param loop: the event loop
+        :param added: whether an image has been added
+        """
+        self._update_throughput(loop.time(), added)
+        self._rate_limiter.set_interval(self._image_api_url, self._crawl_rate.record(added))
+
+    def _update_throughput(self, now: float, added: bool) -> None:
+        """
+        Updates the throughput gauge with the number of images added per second during the last minute
+        :param now: current event loop time
+        :param added: whether an image has been added
+        """
+        if added:
+            self._finished_times.append(now)
+        while len(self._finished_times) > 0 and self._finished_times[0] < now - self.THROUGHPUT_WINDOW:
+            self._finished_times.popleft()
+        CRAWLER_THROUGHPUT.set(len(self._finished_times) / self.THROUGHPUT_WINDOW)
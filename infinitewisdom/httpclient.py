@@ -0,0 +1,146 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import random
+import time
+from threading import Lock
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from infinitewisdom.const import REQUESTS_TIMEOUT
+from infinitewisdom.stats import HTTP_REQUESTS, HTTP_REQUEST_TIME, HTTP_RETRIES, HTTP_POOL_CONNECTIONS_IN_USE, \
+    HTTP_POOL_CONNECTIONS_CREATED
+
+LOGGER = logging.getLogger(__name__)
+
+RETRY_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+class JitteredRetry(Retry):
+    """
+    Exponential backoff with "full jitter": the actual delay is a random value between 0 and the exponential delay,
+    so clients that failed at the same time don't retry at the same time again.
+    """
+
+    def get_backoff_time(self) -> float:
+        return random.uniform(0, super().get_backoff_time())
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        # raises MaxRetryError if there are no retries left, so only actual retries are counted
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        host = getattr(_pool, "host", None) or "unknown"
+        HTTP_RETRIES.labels(host=host).inc()
+        LOGGER.debug("Retrying {} request to {}{}: {}".format(method, host, url, error or response.status))
+        return retry
+
+
+class HttpClient:
+    """
+    Shared HTTP client for all outbound requests.
+    Connections are pooled (and kept alive) per host, failed requests are retried with a jittered exponential backoff.
+    Requests are thread safe.
+    """
+
+    def __init__(self, pool_size: int = 10, retries: int = 3, backoff_factor: float = 0.5):
+        """
+        :param pool_size: maximum number of connections kept open per host
+        :param retries: maximum number of retries of a failed request
+        :param backoff_factor: base delay in seconds of the exponential backoff
+        """
+        self._session = None
+        self._adapter = None
+        self._lock = Lock()
+        self.configure(pool_size, retries, backoff_factor)
+
+    def configure(self, pool_size: int, retries: int, backoff_factor: float) -> None:
+        """
+        Replaces the connection pools with pools using the given settings
+        :param pool_size: maximum number of connections kept open per host
+        :param retries: maximum number of retries of a failed request
+        :param backoff_factor: base delay in seconds of the exponential backoff
+        """
+        retry = JitteredRetry(total=retries, connect=retries, read=retries, status=retries,
+                              backoff_factor=backoff_factor, status_forcelist=RETRY_STATUS_CODES,
+                              # the OCR api is the only POST target and is safe to retry
+                              allowed_methods=None, raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        with self._lock:
+            old_session = self._session
+            self._session = session
+            self._adapter = adapter
+        if old_session is not None:
+            old_session.close()
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a GET request, see requests.get
+        """
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a POST request, see requests.post
+        """
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a request using a pooled connection, the default timeout is REQUESTS_TIMEOUT.
+        Streamed responses have to be closed (or used as a context manager) to return their connection to the pool.
+        :param method: HTTP method
+        :param url: the url
+        :param kwargs: arguments of requests.request
+        :return: the response
+        """
+        kwargs.setdefault("timeout", REQUESTS_TIMEOUT)
+        host = urlparse(url).hostname or "unknown"
+        start = time.perf_counter()
+        status = "error"
+        try:
+            response = self._session.request(method, url, **kwargs)
+            status = str(response.status_code)
+            return response
+        finally:
+            HTTP_REQUEST_TIME.labels(host=host).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(host=host, status=status).inc()
+            self._update_pool_stats()
+
+    def close(self) -> None:
+        """
+        Closes all pooled connections
+        """
+        self._session.close()
+
+    def _update_pool_stats(self) -> None:
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            # the queue holds idle connections (and placeholders for connections that have not been opened yet)
+            in_use = pool.pool.maxsize - pool.pool.qsize() if pool.pool is not None else 0
+            HTTP_POOL_CONNECTIONS_IN_USE.labels(host=pool.host).set(in_use)
+            HTTP_POOL_CONNECTIONS_CREATED.labels(host=pool.host).set(pool.num_connections)
+
+
+HTTP_CLIENT = HttpClient()
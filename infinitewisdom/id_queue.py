@@ -0,0 +1,93 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+from collections import OrderedDict
+from itertools import islice
+from threading import Condition
+from typing import Iterable
+
+from prometheus_client import Gauge
+
+LOGGER = logging.getLogger(__name__)
+
+
+class IdQueue:
+    """
+    Bounded FIFO queue of unique entity ids, used to pass work to background workers.
+    Producers wait while the queue is full, so a slow worker slows down its producers.
+    Since the database is the source of truth for all queued work, ids that can not be queued in time are dropped
+    and picked up again when the worker reloads its queue from the database.
+    """
+
+    def __init__(self, capacity: int, gauge: Gauge = None):
+        """
+        :param capacity: maximum number of ids in the queue
+        :param gauge: gauge to publish the queue length to
+        """
+        self._capacity = capacity
+        self._gauge = gauge
+        self._ids = OrderedDict()
+        self._condition = Condition()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, entity_id: int) -> bool:
+        return entity_id in self._ids
+
+    def load(self, entity_ids: Iterable[int]) -> None:
+        """
+        Replaces the content of the queue, ids exceeding the capacity are ignored
+        :param entity_ids: the ids to queue
+        """
+        with self._condition:
+            self._ids = OrderedDict.fromkeys(islice(entity_ids, self._capacity))
+            self._publish()
+            self._condition.notify_all()
+
+    def put(self, entity_id: int, timeout: float = None) -> bool:
+        """
+        Adds an id to the end of the queue, waiting for free space if the queue is full
+        :param entity_id: the id to add
+        :param timeout: maximum number of seconds to wait, None waits forever
+        :return: True if the id has been added (or was queued already), False if the queue was full
+        """
+        with self._condition:
+            if entity_id in self._ids:
+                return True
+            if not self._condition.wait_for(lambda: len(self._ids) < self._capacity, timeout):
+                LOGGER.debug("Queue is full, dropping id {}".format(entity_id))
+                return False
+            self._ids[entity_id] = None
+            self._publish()
+            return True
+
+    def pop(self) -> int or None:
+        """
+        Removes the first id of the queue
+        :return: the id or None if the queue is empty
+        """
+        with self._condition:
+            if len(self._ids) <= 0:
+                return None
+            entity_id, _ = self._ids.popitem(last=False)
+            self._publish()
+            self._condition.notify()
+            return entity_id
+
+    def _publish(self) -> None:
+        if self._gauge is not None:
+            self._gauge.set(len(self._ids))
@@ -0,0 +1,166 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import json
+import logging
+import random
+import threading
+import time
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+LOGGER = logging.getLogger(__name__)
+
+
+class FakeServer:
+    """
+    Base class of local stand-ins for external HTTP APIs, used to load test the bot without hitting the real services.
+    Requests are served by a thread per connection, every response is delayed by the configured latency.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0):
+        """
+        :param host: address to listen on
+        :param port: port to listen on, 0 picks a free port
+        :param latency: seconds every response is delayed by
+        :param jitter: maximum number of seconds randomly added to the latency
+        """
+        self._latency = latency
+        self._jitter = jitter
+        self._httpd = ThreadingHTTPServer((host, port), _RequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake_server = self
+        self._thread = None
+        self._request_counts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """
+        :return: base url of this server
+        """
+        host, port = self._httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    @property
+    def request_counts(self) -> dict:
+        """
+        :return: number of handled requests per endpoint
+        """
+        with self._lock:
+            return dict(self._request_counts)
+
+    def start(self) -> None:
+        """
+        Starts serving requests in a background thread
+        """
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name=self.__class__.__name__,
+                                        daemon=True)
+        self._thread.start()
+        LOGGER.debug("{} listening on {}".format(self.__class__.__name__, self.url))
+
+    def stop(self) -> None:
+        """
+        Stops serving requests
+        """
+        if self._thread is None:
+            return
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _delay(self) -> None:
+        delay = self._latency + random.uniform(0, self._jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _count(self, endpoint: str) -> None:
+        with self._lock:
+            self._request_counts[endpoint] = self._request_counts.get(endpoint, 0) + 1
+
+    def handle(self, request: "_RequestHandler", path: str, params: dict) -> None:
+        """
+        Handles a single request
+        :param request: the request handler to respond with
+        :param path: the requested path
+        :param params: query and body parameters, uploaded files are passed as bytes
+        """
+        raise NotImplementedError()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def log_message(self, format, *args):
+        LOGGER.debug(format % args)
+
+    def send(self, status: int, body: bytes, content_type: str) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, data, status: int = 200) -> None:
+        self.send(status, json.dumps(data).encode(), "application/json")
+
+    def _dispatch(self) -> None:
+        server = self.server.fake_server
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        params.update(self._read_body())
+        server._delay()
+        try:
+            server.handle(self, url.path, params)
+        except Exception as e:
+            LOGGER.error(e, exc_info=True)
+            self.send(500, str(e).encode(), "text/plain")
+
+    def _read_body(self) -> dict:
+        length = int(self.headers.get("Content-Length", 0))
+        if length <= 0:
+            return {}
+        body = self.rfile.read(length)
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("application/json"):
+            return json.loads(body)
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser().parsebytes(
+                "Content-Type: {}\r\n\r\n".format(content_type).encode() + body)
+            params = {}
+            for part in message.get_payload():
+                value = part.get_payload(decode=True)
+                if part.get_filename() is None:
+                    value = value.decode()
+                params[part.get_param("name", header="Content-Disposition")] = value
+            return params
+        return dict(parse_qsl(body.decode()))
@@ -0,0 +1,165 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import itertools
+import re
+import threading
+import time
+import uuid
+
+from infinitewisdom.loadtest import FakeServer
+
+METHOD_PATH_PATTERN = re.compile(r"^/bot([^/]+)/(\w+)$")
+
+# maximum number of seconds a getUpdates request is held open
+MAX_POLL_TIMEOUT = 10
+
+
+class FakeBotApi(FakeServer):
+    """
+    Local stand-in for the telegram bot API.
+    Accepts the requests the bot and the uploader send and returns well formed responses,
+    updates (commands and inline queries) are queued by the load test and delivered via getUpdates.
+    """
+
+    BOT_USER = {"id": 1, "is_bot": True, "first_name": "InfiniteWisdom", "username": "InfiniteWisdomLoadTestBot"}
+
+    def __init__(self, **kwargs):
+        """
+        :param kwargs: see FakeServer
+        """
+        super().__init__(**kwargs)
+        self._updates = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._updates_condition = threading.Condition()
+        self._methods = {
+            "getMe": self._get_me,
+            "getMyCommands": self._return_empty_list,
+            "setMyCommands": self._return_true,
+            "deleteWebhook": self._return_true,
+            "getUpdates": self._get_updates,
+            "sendPhoto": self._send_photo,
+            "sendMessage": self._send_message,
+            "sendChatAction": self._return_true,
+            "answerInlineQuery": self._return_true,
+        }
+
+    @property
+    def bot_api_url(self) -> str:
+        """
+        :return: url to configure as the bot api url of the bot, the token is appended to it
+        """
+        return self.url + "/bot"
+
+    @property
+    def pending_updates(self) -> int:
+        """
+        :return: number of updates that have not been fetched yet
+        """
+        with self._updates_condition:
+            return len(self._updates)
+
+    def add_command(self, command: str, chat_id: int = 2, username: str = "loadtest") -> None:
+        """
+        Queues a private chat message containing a bot command
+        :param command: the command including its arguments, f.ex. "/inspire"
+        :param chat_id: id of the chat (and user) that sends the command
+        :param username: name of the user that sends the command
+        """
+        user = {"id": chat_id, "is_bot": False, "first_name": username, "username": username}
+        command_length = len(command.split(" ")[0])
+        self._add_update({"message": {
+            "message_id": next(self._message_ids),
+            "from": user,
+            "chat": {"id": chat_id, "type": "private", "username": username},
+            "date": int(time.time()),
+            "text": command,
+            "entities": [{"type": "bot_command", "offset": 0, "length": command_length}],
+        }})
+
+    def add_inline_query(self, query: str, user_id: int = 2, username: str = "loadtest") -> None:
+        """
+        Queues an inline query
+        :param query: the query text
+        :param user_id: id of the user that sends the query
+        :param username: name of the user that sends the query
+        """
+        self._add_update({"inline_query": {
+            "id": uuid.uuid4().hex,
+            "from": {"id": user_id, "is_bot": False, "first_name": username, "username": username},
+            "query": query,
+            "offset": "",
+        }})
+
+    def handle(self, request, path: str, params: dict) -> None:
+        match = METHOD_PATH_PATTERN.match(path)
+        method = self._methods.get(match.group(2)) if match is not None else None
+        if method is None:
+            request.send_json({"ok": False, "error_code": 404, "description": "Not Found"}, status=404)
+            return
+        self._count(match.group(2))
+        request.send_json({"ok": True, "result": method(params)})
+
+    def _add_update(self, update: dict) -> None:
+        with self._updates_condition:
+            update["update_id"] = next(self._update_ids)
+            self._updates.append(update)
+            self._updates_condition.notify_all()
+
+    def _get_me(self, params: dict) -> dict:
+        return self.BOT_USER
+
+    @staticmethod
+    def _return_true(params: dict) -> bool:
+        return True
+
+    @staticmethod
+    def _return_empty_list(params: dict) -> list:
+        return []
+
+    def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = min(float(params.get("timeout") or 0), MAX_POLL_TIMEOUT)
+        with self._updates_condition:
+            # updates before the offset have been confirmed by the client
+            self._updates = [x for x in self._updates if x["update_id"] >= offset]
+            self._updates_condition.wait_for(lambda: len(self._updates) > 0, timeout)
+            return self._updates[:limit]
+
+    def _new_message(self, params: dict) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "from": self.BOT_USER,
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "date": int(time.time()),
+        }
+
+    def _send_message(self, params: dict) -> dict:
+        message = self._new_message(params)
+        message["text"] = params.get("text", "")
+        return message
+
+    def _send_photo(self, params: dict) -> dict:
+        photo = params["photo"]
+        # uploaded photos get a new file id, sending an existing file id reuses it
+        file_id = uuid.uuid4().hex if isinstance(photo, bytes) else photo
+        message = self._new_message(params)
+        message["photo"] = [{"file_id": file_id, "file_unique_id": file_id[:16], "width": 650, "height": 650,
+                             "file_size": len(photo) if isinstance(photo, bytes) else 0}]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        return message
@@ -0,0 +1,89 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import functools
+import random
+import re
+import threading
+
+from infinitewisdom.loadtest import FakeServer
+
+IMAGE_PATH_PATTERN = re.compile(r"^/images/(\d+)\.jpg$")
+
+
+class FakeImageApi(FakeServer):
+    """
+    Local stand-in for the image api.
+    Generates urls of a synthetic corpus of images, which are rendered on first request and served as JPEGs.
+    Since urls are picked randomly from a fixed size corpus, a growing number of generated urls is already known,
+    just like with the real api.
+    """
+
+    def __init__(self, corpus_size: int = 10000, image_size: (int, int) = (650, 650), seed: int = None, **kwargs):
+        """
+        :param corpus_size: number of distinct images
+        :param image_size: width and height of the images
+        :param seed: seed for the url generator, None for a random seed
+        :param kwargs: see FakeServer
+        """
+        super().__init__(**kwargs)
+        self._corpus_size = corpus_size
+        self._image_size = image_size
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    @property
+    def api_url(self) -> str:
+        """
+        :return: url to configure as the image api url of the crawler
+        """
+        return self.url + "/api"
+
+    def handle(self, request, path: str, params: dict) -> None:
+        if path == "/api" and params.get("generate") == "true":
+            self._count("generate")
+            with self._random_lock:
+                index = self._random.randrange(self._corpus_size)
+            request.send(200, "{}/images/{}.jpg".format(self.url, index).encode(), "text/html")
+            return
+
+        match = IMAGE_PATH_PATTERN.match(path)
+        if match is not None and int(match.group(1)) < self._corpus_size:
+            self._count("image")
+            request.send(200, self.render_image(int(match.group(1))), "image/jpeg")
+            return
+
+        request.send(404, b"Not Found", "text/plain")
+
+    @functools.lru_cache(maxsize=1024)
+    def render_image(self, index: int) -> bytes:
+        """
+        Renders an image of the corpus
+        :param index: index of the image in the corpus
+        :return: JPEG data
+        """
+        import cv2
+        import numpy as np
+
+        width, height = self._image_size
+        rng = np.random.RandomState(index)
+        image = np.full((height, width, 3), rng.randint(0, 255, 3), dtype=np.uint8)
+        for _ in range(8):
+            color = [int(x) for x in rng.randint(0, 255, 3)]
+            center = (int(rng.randint(width)), int(rng.randint(height)))
+            cv2.circle(image, center, int(rng.randint(width // 20, width // 3)), color, -1)
+        cv2.putText(image, "Wisdom #{}".format(index), (width // 10, height // 2), cv2.FONT_HERSHEY_SIMPLEX,
+                    width / 400, (255, 255, 255), max(1, width // 200))
+        return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes()
@@ -30,10 +30,13 @@ if __name__ == '__main__':
     from infinitewisdom.analysis.googlevision import GoogleVision
     from infinitewisdom.analysis.microsoftazure import AzureComputerVision
     from infinitewisdom.analysis.tesseract import Tesseract
+    from infinitewisdom.analysis.tesseract_api import TesseractApi
     from infinitewisdom.analysis.worker import AnalysisWorker
     from infinitewisdom.bot import InfiniteWisdomBot
     from infinitewisdom.config.config import AppConfig
-    from infinitewisdom.crawler import Crawler
+    from infinitewisdom.const import CRAWLER_MODE_ASYNCIO, TESSERACT_ENGINE_TESSEROCR
+    from infinitewisdom.crawler import Crawler, AsyncCrawler
+    from infinitewisdom.httpclient import HTTP_CLIENT
     from infinitewisdom.persistence import ImageDataPersistence
     from infinitewisdom.uploader import TelegramUploader
 
@@ -44,11 +47,16 @@ if __name__ == '__main__':
 
     LOGGER.debug("Config:\n{}".format(config.print(TomlFormatter())))
 
+    HTTP_CLIENT.configure(config.HTTP_POOL_SIZE.value, config.HTTP_RETRIES.value, config.HTTP_RETRY_BACKOFF.value)
+
     persistence = ImageDataPersistence(config)
 
     image_analysers = []
     if config.IMAGE_ANALYSIS_TESSERACT_ENABLED.value:
-        image_analysers.append(Tesseract())
+        if config.IMAGE_ANALYSIS_TESSERACT_ENGINE.value == TESSERACT_ENGINE_TESSEROCR:
+            image_analysers.append(TesseractApi())
+        else:
+            image_analysers.append(Tesseract())
     if config.IMAGE_ANALYSIS_GOOGLE_VISION_ENABLED.value:
         auth_file = config.IMAGE_ANALYSIS_GOOGLE_VISION_AUTH_FILE.value
         capacity = config.IMAGE_ANALYSIS_GOOGLE_VISION_CAPACITY.value
@@ -57,7 +65,8 @@ if __name__ == '__main__':
         key = config.IMAGE_ANALYSIS_MICROSOFT_AZURE_SUBSCRIPTION_KEY.value
         region = config.IMAGE_ANALYSIS_MICROSOFT_AZURE_REGION.value
         capacity = config.IMAGE_ANALYSIS_MICROSOFT_AZURE_CAPACITY.value
-        image_analysers.append(AzureComputerVision(key, region, capacity))
+        concurrency = config.IMAGE_ANALYSIS_MICROSOFT_AZURE_CONCURRENCY.value
+        image_analysers.append(AzureComputerVision(key, region, capacity, concurrency))
 
     # start prometheus server
     start_http_server(config.STATS_PORT.value)
@@ -65,10 +74,18 @@ if __name__ == '__main__':
     wisdom_bot = InfiniteWisdomBot(config, persistence, image_analysers)
     telegram_uploader = TelegramUploader(config, persistence, wisdom_bot._updater.bot)
     analysis_worker = AnalysisWorker(config, persistence, image_analysers)
-    crawler = Crawler(config, persistence, telegram_uploader, image_analysers, analysis_worker)
+    crawler_type = AsyncCrawler if config.CRAWLER_MODE.value == CRAWLER_MODE_ASYNCIO else Crawler
+    crawler = crawler_type(config, persistence, telegram_uploader, image_analysers, analysis_worker)
 
+    persistence.start()
     crawler.start()
     analysis_worker.start()
     telegram_uploader.start()
 
     wisdom_bot.start()
+
+    # save everything that is still buffered after the bot has been shut down
+    crawler.stop()
+    analysis_worker.stop()
+    telegram_uploader.stop()
+    persistence.stop()
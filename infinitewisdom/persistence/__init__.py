@@ -14,17 +14,25 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
-from typing import List
+from collections import Counter
+from typing import Iterator, Dict, Set, BinaryIO, Tuple
 
 from sqlalchemy.orm import Session
 
 from infinitewisdom.config.config import AppConfig
 from infinitewisdom.const import IMAGE_ANALYSIS_TYPE_TESSERACT, IMAGE_ANALYSIS_TYPE_GOOGLE_VISION, \
     IMAGE_ANALYSIS_TYPE_AZURE, IMAGE_ANALYSIS_TYPE_HUMAN
-from infinitewisdom.persistence.image_persistence import ImageDataStore
-from infinitewisdom.persistence.sqlalchemy import SQLAlchemyPersistence, Image, BotToken, _session_scope
-from infinitewisdom.stats import POOL_SIZE, TELEGRAM_ENTITIES_COUNT, IMAGE_ANALYSIS_TYPE_COUNT, \
-    IMAGE_ANALYSIS_HAS_TEXT_COUNT, ENTITIES_WITH_IMAGE_DATA_COUNT
+from infinitewisdom.persistence.bk_tree import BKTree
+from infinitewisdom.persistence.bot_context import BotContext, MISSING
+from infinitewisdom.persistence.file_id_buffer import TelegramFileIdBuffer
+from infinitewisdom.persistence.image_data import ImageDataBackend, StagedImageData
+from infinitewisdom.persistence.image_data.factory import create_image_data_backend, \
+    get_image_data_backend_settings
+from infinitewisdom.persistence.random_sampler import RandomImageSampler
+from infinitewisdom.persistence.sqlalchemy import SQLAlchemyPersistence, Image, BotToken, ImageRecord, \
+    _session_scope, _sessionmaker
+from infinitewisdom.persistence.statistics import PersistenceStatistics, StatisticsReconciler, KEY_POOL_SIZE, \
+    KEY_WITH_IMAGE_DATA, KEY_WITH_TELEGRAM_UPLOAD, KEY_WITH_TEXT, KEY_ANALYSER
 from infinitewisdom.util import create_hash
 
 LOGGER = logging.getLogger(__name__)
@@ -39,45 +47,182 @@ class ImageDataPersistence:
         self._config = config
 
         self._database = SQLAlchemyPersistence(config.SQL_PERSISTENCE_URL.value)
-        self._image_data_store = ImageDataStore(config.FILE_PERSISTENCE_BASE_PATH.value)
+        self._image_data_backend_settings = get_image_data_backend_settings(config)
+        self._image_data_store = create_image_data_backend(**self._image_data_backend_settings)
+        self._perceptual_hashes = BKTree()
+        self._random_sampler = RandomImageSampler(config.PERSISTENCE_RANDOM_SAMPLER_MAX_SIZE.value)
+        self._bot_context = BotContext(config.TELEGRAM_BOT_TOKEN.value,
+                                       config.PERSISTENCE_FILE_ID_CACHE_SIZE.value)
+        self._file_id_buffer = TelegramFileIdBuffer(config.PERSISTENCE_FILE_ID_FLUSH_INTERVAL.value,
+                                                    self._write_telegram_file_ids)
+
+        self._statistics = PersistenceStatistics(config.TELEGRAM_BOT_TOKEN.value)
+        self._statistics_reconciler = None
+        self._incremental_stats = config.STATS_INCREMENTAL.value
+        if self._incremental_stats:
+            self._statistics.track(_sessionmaker)
+            self._statistics_reconciler = StatisticsReconciler(config.STATS_RECONCILE_INTERVAL.value, self)
 
         with _session_scope() as session:
-            self._update_stats(session)
+            if self.count(session) <= config.PERSISTENCE_RANDOM_SAMPLER_MAX_SIZE.value:
+                self._random_sampler.load(self._database.get_all_ids(session))
+            else:
+                LOGGER.info("Image pool is too big for the random sampler, using database queries instead")
+
+            self._perceptual_hashes.load(self._database.get_all_perceptual_hashes(session))
+
+            bot_token_entity = self._database.get_or_add_bot_token(session, self._bot_context.token)
+            self._bot_context.load(bot_token_entity.id,
+                                   self._database.get_file_ids_of_bot(session, bot_token_entity.id))
+
+            self.update_stats(session)
+
+    def start(self) -> None:
+        """
+        Starts background tasks of the persistence
+        """
+        self._file_id_buffer.start()
+        if self._statistics_reconciler is not None:
+            self._statistics_reconciler.start()
+
+    def stop(self) -> None:
+        """
+        Stops background tasks of the persistence
+        """
+        if self._statistics_reconciler is not None:
+            self._statistics_reconciler.stop()
+        self._file_id_buffer.stop()
+
+    @property
+    def image_data_store(self) -> ImageDataBackend:
+        """
+        :return: the backend holding the image data
+        """
+        return self._image_data_store
+
+    @property
+    def image_data_backend_settings(self) -> dict:
+        """
+        :return: settings to create another instance of the image data backend, e.g. in a different process
+        """
+        return dict(self._image_data_backend_settings)
 
     def get_bot_token(self, session: Session, bot_token: str) -> BotToken:
         """
         :return: the bot token entity
         """
+        if self._bot_context.matches(bot_token):
+            return session.query(BotToken).get(self._bot_context.bot_token_id)
         return self._database.get_or_add_bot_token(session, bot_token)
 
+    def add_telegram_file_ids(self, entity_id: int, bot_token: str, file_ids: [str]) -> None:
+        """
+        Adds telegram file ids to an entity.
+        The file ids are buffered and saved in bulk in the background (see TelegramFileIdBuffer),
+        file ids that are already known for the current bot are skipped.
+        :param entity_id: the id of the entity that was sent
+        :param bot_token: the bot token that was used to upload the image
+        :param file_ids: the file ids returned by telegram
+        """
+        if len(file_ids) <= 0:
+            return
+
+        if self._bot_context.matches(bot_token):
+            known_file_id = self._bot_context.get_file_id(entity_id)
+            if known_file_id is not None and known_file_id is not MISSING and known_file_id in file_ids:
+                # the image was sent using a known file id
+                return
+            self._bot_context.put_file_id(entity_id, next(iter(file_ids)))
+
+        self._file_id_buffer.add(entity_id, bot_token, file_ids)
+
+    def flush_telegram_file_ids(self) -> None:
+        """
+        Saves all buffered telegram file ids immediately
+        """
+        self._file_id_buffer.flush()
+
+    def _write_telegram_file_ids(self, bot_token: str, file_ids: Dict[int, Set[str]]) -> None:
+        """
+        Saves telegram file ids of a single bot token
+        :param bot_token: the bot token that was used to upload the images
+        :param file_ids: image id -> file ids
+        """
+        with _session_scope() as session:
+            try:
+                if self._bot_context.matches(bot_token):
+                    bot_token_id = self._bot_context.bot_token_id
+                else:
+                    bot_token_id = self._database.get_or_add_bot_token(session, bot_token).id
+
+                uploaded = self._database.add_telegram_file_ids(session, bot_token_id, file_ids)
+                if self._incremental_stats and self._bot_context.matches(bot_token):
+                    self._statistics.record_uploads(session, len(uploaded))
+            finally:
+                self._update_stats_after_write(session)
+
     def get_all(self, session) -> [Image]:
         """
         :return: a list of all entities
         """
         return self._database.get_all(session)
 
-    def add(self, session: Session, image: Image, image_data: bytes) -> None:
+    def get_all_image_hashes(self, session: Session) -> Iterator[Tuple[int, str]]:
+        """
+        The ids and image hashes of all entities are streamed from the database,
+        so the session has to be kept open while iterating.
+        :return: iterator of (entity id, image hash) tuples
+        """
+        return self._database.get_all_image_hashes(session)
+
+    def get_all_urls(self, session: Session, min_id: int = 0) -> Iterator[Tuple[int, str]]:
+        """
+        The ids and urls of entities are streamed from the database,
+        so the session has to be kept open while iterating.
+        :param min_id: only entities with a greater id are returned
+        :return: iterator of (entity id, url) tuples
+        """
+        return self._database.get_all_urls(session, min_id)
+
+    def add(self, session: Session, image: Image, image_data: bytes or StagedImageData) -> None:
         """
         Persists a new entity
         :param image: the entity to add
-        :param image_data: image data
+        :param image_data: image data, or staged image data that is committed
         """
         try:
-            image_hash = create_hash(image_data)
-            image.image_hash = image_hash
+            image.image_hash = self._store_image_data(image_data)
             self._database.add(session, image)
-            self._image_data_store.put(image_hash, image_data)
+            self._random_sampler.add(image.id)
+            if image.perceptual_hash is not None:
+                self._perceptual_hashes.add(image.perceptual_hash, image.id)
         finally:
-            self._update_stats(session)
+            self._update_stats_after_write(session)
 
-    def get_image_data(self, entity: Image) -> bytes or None:
+    def stage_image_data(self) -> StagedImageData:
+        """
+        Creates a writer for new image data that is hashed while it is written,
+        pass it to add() or update() to store it
+        :return: the staged image data, use it as a context manager to discard it if it is not used
+        """
+        return self._image_data_store.stage()
+
+    def get_image_data(self, entity: Image or ImageRecord) -> bytes or None:
         """
         Get the image data for an entity
-        :param entity: the entity to get the image for
+        :param entity: the entity (or record) to get the image for
         :return: image data or None
         """
         return self._image_data_store.get(entity.image_hash)
 
+    def open_image_data(self, entity: Image or ImageRecord) -> BinaryIO or None:
+        """
+        Opens a stream of the image data of an entity, the caller has to close it
+        :param entity: the entity (or record) to get the image for
+        :return: file like object or None
+        """
+        return self._image_data_store.open(entity.image_hash)
+
     def get_random(self, session: Session, page_size: int = None) -> Image or [Image]:
         """
         Returns a random entity or number of random entities depending on parameters.
@@ -85,7 +230,59 @@ class ImageDataPersistence:
         :param page_size: number of elements to return
         :return: the entity
         """
-        return self._database.get_random(session, page_size)
+        if not self._random_sampler.enabled:
+            return self._database.get_random(session, page_size)
+
+        count = 1 if page_size is None else page_size
+        entities = self._database.get_by_ids(session, self._random_sampler.sample(count))
+        if page_size is None:
+            if len(entities) <= 0:
+                # the sampled id might have been removed by someone else in the meantime
+                return self._database.get_random(session)
+            return entities[0]
+        else:
+            return entities
+
+    def get_random_records(self, session: Session, bot_token: str, page_size: int) -> [ImageRecord]:
+        """
+        Returns a list of random image records
+        :param bot_token: the bot token to select telegram file ids for
+        :param page_size: number of elements to return
+        :return: list of records
+        """
+        if self._random_sampler.enabled:
+            records = self.get_records(session, bot_token, self._random_sampler.sample(page_size))
+            if len(records) > 0:
+                return records
+
+        entity_ids = self._database.get_random_ids(session, page_size)
+        return self.get_records(session, bot_token, entity_ids)
+
+    def get_records(self, session: Session, bot_token: str, entity_ids: [int]) -> [ImageRecord]:
+        """
+        Get image records by id
+        :param bot_token: the bot token to select telegram file ids for
+        :param entity_ids: entity ids
+        :return: list of records in the order of the given ids, missing entities are omitted
+        """
+        if not self._bot_context.matches(bot_token):
+            bot_token_id = self._database.find_bot_token_id(session, bot_token)
+            return self._database.get_records_by_ids(session, entity_ids, bot_token_id)
+
+        cached_file_ids = {entity_id: self._bot_context.get_file_id(entity_id) for entity_id in entity_ids}
+        if MISSING not in cached_file_ids.values():
+            records = self._database.get_records_by_ids(session, entity_ids, None)
+            for record in records:
+                record.telegram_file_id = cached_file_ids[record.id]
+            return records
+
+        records = self._database.get_records_by_ids(session, entity_ids, self._bot_context.bot_token_id)
+        for record in records:
+            self._bot_context.put_file_id(record.id, record.telegram_file_id)
+            if record.telegram_file_id is None and cached_file_ids[record.id] is not MISSING:
+                # file ids might still be waiting in the write buffer
+                record.telegram_file_id = cached_file_ids[record.id]
+        return records
 
     def find_by_url(self, session: Session, url: str) -> [Image]:
         """
@@ -95,6 +292,14 @@ class ImageDataPersistence:
         """
         return self._database.find_by_url(session, url)
 
+    def has_url(self, session: Session, url: str) -> bool:
+        """
+        Checks if an entity with exactly the given url exists, without loading it
+        :param url: the url to search for
+        :return: True if an entity exists, false otherwise
+        """
+        return self._database.has_url(session, url)
+
     def find_by_image_hash(self, session: Session, image_hash: str) -> Image or None:
         """
         Finds an entity with exactly the given image_hash
@@ -103,6 +308,15 @@ class ImageDataPersistence:
         """
         return self._database.find_by_image_hash(session, image_hash)
 
+    def find_similar_image_ids(self, perceptual_hash: str, max_distance: int) -> [int]:
+        """
+        Finds entities whose image looks similar to the image with the given perceptual hash
+        :param perceptual_hash: perceptual hash of an image (see create_perceptual_hash)
+        :param max_distance: maximum number of differing bits of the perceptual hashes
+        :return: entity ids ordered by similarity
+        """
+        return list(map(lambda x: x[1], self._perceptual_hashes.find(perceptual_hash, max_distance)))
+
     def find_by_telegram_file_id(self, session: Session, telegram_file_id: str) -> Image or None:
         """
         Finds an entity with exactly the given telegram file id
@@ -121,6 +335,19 @@ class ImageDataPersistence:
         """
         return self._database.find_by_text(session, text, limit, offset)
 
+    def find_records_by_text(self, session: Session, bot_token: str, text: str, limit: int = None,
+                             offset: int = None) -> [ImageRecord]:
+        """
+        Finds a list of image records containing the given text, ordered by relevance
+        :param bot_token: the bot token to select telegram file ids for
+        :param text: the text to search for
+        :param limit: number of items to return (defaults to 16)
+        :param offset: item offset
+        :return: list of records
+        """
+        entity_ids = self._database.find_ids_by_text(session, text, limit, offset)
+        return self.get_records(session, bot_token, entity_ids)
+
     def find_non_optimal(self, session: Session, target_quality: int) -> Image or None:
         """
         Finds an image with suboptimal analysis quality.
@@ -134,11 +361,12 @@ class ImageDataPersistence:
         """
         return self._database.find_all_non_optimal(session, target_quality)
 
-    def get_not_uploaded_image_ids(self, session: Session, bot_token: str) -> List[int]:
+    def get_not_uploaded_image_ids(self, session: Session, bot_token: str) -> Iterator[int]:
         """
-        Finds an image that has not yet been uploaded to telegram servers
+        Finds all images that have not yet been uploaded to telegram servers.
+        The ids are streamed from the database, so the session has to be kept open while iterating.
         :param bot_token: the bot token
-        :return: entity or None
+        :return: iterator of entity ids
         """
         return self._database.get_not_uploaded_image_ids(session, bot_token)
 
@@ -157,18 +385,19 @@ class ImageDataPersistence:
         """
         return self._database.get(session, entity_id)
 
-    def update(self, session: Session, entity: Image, image_data: bytes or None = None) -> None:
+    def update(self, session: Session, entity: Image, image_data: bytes or StagedImageData or None = None) -> None:
         """
         Updates the given entity
         :param entity: the entity with modified fields
-        :param image_data: the image data of the entity, passing None will not change existing image data
+        :param image_data: the image data of the entity (or staged image data that is committed),
+                           passing None will not change existing image data
         """
         try:
             existing_entity = self._database.find_by_image_hash(session, entity.image_hash)
 
             new_hash = None
             if image_data is not None:
-                new_hash = create_hash(image_data)
+                new_hash = self._store_image_data(image_data)
 
             if new_hash is not None and existing_entity.image_hash != new_hash:
                 LOGGER.debug(
@@ -176,12 +405,11 @@ class ImageDataPersistence:
                                                                                 new_hash,
                                                                                 entity.url))
                 entity.image_hash = new_hash
-            if self.get_image_data(entity) is None:
-                self._image_data_store.put(entity.image_hash, image_data)
-                LOGGER.debug("Saved new image data for hash: {}".format(entity.image_hash))
             self._database.update(session, entity)
+            if entity.perceptual_hash is not None:
+                self._perceptual_hashes.add(entity.perceptual_hash, entity.id)
         finally:
-            self._update_stats(session)
+            self._update_stats_after_write(session)
 
     def count_items_this_month(self, session: Session, analyser: str) -> int:
         """
@@ -199,20 +427,41 @@ class ImageDataPersistence:
         try:
             entity = self._database.find_by_image_hash(session, entity.image_hash)
             if entity is not None:
-                self._image_data_store.put(entity.image_hash, None)
+                if self._incremental_stats:
+                    self._statistics.record_delete(session, entity)
+                self._image_data_store.delete(entity.image_hash)
                 self._database.delete(session, entity.id)
+                self._random_sampler.remove(entity.id)
+                self._bot_context.remove(entity.id)
+                if entity.perceptual_hash is not None:
+                    self._perceptual_hashes.remove(entity.perceptual_hash, entity.id)
         finally:
-            self._update_stats(session)
+            self._update_stats_after_write(session)
 
     def clear(self, session: Session) -> None:
         """
         Removes all entries from the persistence
         """
-        try:
-            self._database.clear()
-            self._image_data_store.clear()
-        finally:
-            self._update_stats(session)
+        self._database.clear(session)
+        self._image_data_store.clear()
+        self._random_sampler.load([])
+        self._perceptual_hashes.load([])
+        self._bot_context.load(self._bot_context.bot_token_id, [])
+        # bulk deletes are not tracked by incremental statistics
+        self.update_stats(session)
+
+    def _store_image_data(self, image_data: bytes or StagedImageData) -> str:
+        """
+        Stores image data, existing data for the same hash is kept
+        :param image_data: image data or staged image data
+        :return: the hash of the image data
+        """
+        if isinstance(image_data, StagedImageData):
+            return image_data.commit()
+
+        image_hash = create_hash(image_data)
+        self._image_data_store.put(image_hash, image_data)
+        return image_hash
 
     @staticmethod
     def _contains_words(words: [str], text):
@@ -232,33 +481,35 @@ class ImageDataPersistence:
 
         return True
 
-    def _update_stats(self, session: Session):
+    def _update_stats_after_write(self, session: Session):
         """
-        Updates prometheus statistics related to persistence
+        Updates statistics after a write operation, unless they are tracked incrementally
         """
-        POOL_SIZE.set(self.count(session))
+        if not self._incremental_stats:
+            self.update_stats(session)
 
-        entites_with_image_data_count = self.count_items_with_image_data(session)
-        ENTITIES_WITH_IMAGE_DATA_COUNT.set(entites_with_image_data_count)
+    def update_stats(self, session: Session):
+        """
+        Counts all prometheus statistics related to persistence
+        """
+        values = Counter()
+        values[KEY_POOL_SIZE] = self.count(session)
+        values[KEY_WITH_IMAGE_DATA] = self.count_items_with_image_data(session)
 
         bot_token = self._config.TELEGRAM_BOT_TOKEN.value
-        uploaded_entites_count = self.count_items_with_telegram_upload(session, bot_token)
-        TELEGRAM_ENTITIES_COUNT.set(uploaded_entites_count)
-
-        tesseract_entites_count = self.count_items_by_analyser(session, IMAGE_ANALYSIS_TYPE_TESSERACT)
-        IMAGE_ANALYSIS_TYPE_COUNT.labels(type=IMAGE_ANALYSIS_TYPE_TESSERACT).set(tesseract_entites_count)
+        values[KEY_WITH_TELEGRAM_UPLOAD] = self.count_items_with_telegram_upload(session, bot_token)
 
-        google_vision_entites_count = self.count_items_by_analyser(session, IMAGE_ANALYSIS_TYPE_GOOGLE_VISION)
-        IMAGE_ANALYSIS_TYPE_COUNT.labels(type=IMAGE_ANALYSIS_TYPE_GOOGLE_VISION).set(google_vision_entites_count)
+        for analyser in [IMAGE_ANALYSIS_TYPE_TESSERACT, IMAGE_ANALYSIS_TYPE_GOOGLE_VISION, IMAGE_ANALYSIS_TYPE_AZURE,
+                         IMAGE_ANALYSIS_TYPE_HUMAN]:
+            values[KEY_ANALYSER.format(analyser)] = self.count_items_by_analyser(session, analyser)
 
-        microsoft_azure_entites_count = self.count_items_by_analyser(session, IMAGE_ANALYSIS_TYPE_AZURE)
-        IMAGE_ANALYSIS_TYPE_COUNT.labels(type=IMAGE_ANALYSIS_TYPE_AZURE).set(microsoft_azure_entites_count)
+        values[KEY_WITH_TEXT] = self.count_items_with_text(session)
 
-        human_entites_count = self.count_items_by_analyser(session, IMAGE_ANALYSIS_TYPE_HUMAN)
-        IMAGE_ANALYSIS_TYPE_COUNT.labels(type=IMAGE_ANALYSIS_TYPE_HUMAN).set(human_entites_count)
+        self._statistics.reset(values)
 
-        entities_with_text_count = self.count_items_with_text(session)
-        IMAGE_ANALYSIS_HAS_TEXT_COUNT.set(entities_with_text_count)
+        if self._random_sampler.can_enable(values[KEY_POOL_SIZE]):
+            LOGGER.info("Image pool is small enough for the random sampler again, enabling it")
+            self._random_sampler.load(self._database.get_all_ids(session))
 
     def count_items_with_telegram_upload(self, session: Session, bot_token: str) -> int:
         """
@@ -0,0 +1,130 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+from threading import Lock
+from typing import Iterable, List, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# node layout: [key, set of values, {distance: child node}]
+KEY = 0
+VALUES = 1
+CHILDREN = 2
+
+
+def _distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree of (perceptual) hashes using the hamming distance as metric.
+    Finds all entries within a given distance of a hash without comparing it to every entry.
+    Multiple values (entity ids) can be stored for the same hash.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return self._size
+
+    def load(self, entries: Iterable[Tuple[str, int]]) -> None:
+        """
+        (Re-)Initializes the tree
+        :param entries: (hex hash, value) tuples
+        """
+        with self._lock:
+            self._root = None
+            self._size = 0
+            for key, value in entries:
+                self._add(int(key, 16), value)
+        LOGGER.debug("BK-tree loaded {} entries".format(self._size))
+
+    def add(self, key: str, value: int) -> None:
+        """
+        Adds a value
+        :param key: hex hash
+        :param value: the value
+        """
+        with self._lock:
+            self._add(int(key, 16), value)
+
+    def remove(self, key: str, value: int) -> None:
+        """
+        Removes a value, the node of its hash is kept to not restructure the tree
+        :param key: hex hash
+        :param value: the value
+        """
+        key = int(key, 16)
+        with self._lock:
+            node = self._root
+            while node is not None:
+                distance = _distance(key, node[KEY])
+                if distance == 0:
+                    if value in node[VALUES]:
+                        node[VALUES].remove(value)
+                        self._size -= 1
+                    return
+                node = node[CHILDREN].get(distance, None)
+
+    def find(self, key: str, max_distance: int) -> List[Tuple[int, int]]:
+        """
+        Finds all values whose hash is within the given distance
+        :param key: hex hash
+        :param max_distance: maximum hamming distance (inclusive)
+        :return: list of (distance, value) tuples, ordered by distance
+        """
+        key = int(key, 16)
+        result = []
+        with self._lock:
+            if self._root is None:
+                return result
+            candidates = [self._root]
+            while len(candidates) > 0:
+                node = candidates.pop()
+                distance = _distance(key, node[KEY])
+                if distance <= max_distance:
+                    result.extend(map(lambda x: (distance, x), node[VALUES]))
+                # by the triangle inequality only children in this range can contain matches
+                for child_distance, child in node[CHILDREN].items():
+                    if distance - max_distance <= child_distance <= distance + max_distance:
+                        candidates.append(child)
+        result.sort()
+        return result
+
+    def _add(self, key: int, value: int) -> None:
+        if self._root is None:
+            self._root = [key, {value}, {}]
+            self._size += 1
+            return
+
+        node = self._root
+        while True:
+            distance = _distance(key, node[KEY])
+            if distance == 0:
+                if value not in node[VALUES]:
+                    node[VALUES].add(value)
+                    self._size += 1
+                return
+            child = node[CHILDREN].get(distance, None)
+            if child is None:
+                node[CHILDREN][distance] = [key, {value}, {}]
+                self._size += 1
+                return
+            node = child
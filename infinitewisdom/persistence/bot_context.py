@@ -0,0 +1,102 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterable, Tuple
+
+from infinitewisdom.util import cryptographic_hash
+
+LOGGER = logging.getLogger(__name__)
+
+MISSING = object()
+
+
+class BotContext:
+    """
+    Cached information about the bot this process is running for:
+    the hashed token, the id of its BotToken entity and a bounded
+    image id -> telegram file id map (None meaning "not uploaded yet").
+    """
+
+    def __init__(self, bot_token: str, max_size: int):
+        """
+        :param bot_token: the bot token
+        :param max_size: maximum number of image ids to cache file ids for
+        """
+        self.token = bot_token
+        self.hashed_token = cryptographic_hash(bot_token)
+        self.bot_token_id = None
+        self._max_size = max_size
+        self._file_ids = OrderedDict()
+        self._lock = Lock()
+
+    def matches(self, bot_token: str) -> bool:
+        """
+        :param bot_token: a bot token
+        :return: True if the given token is the token of this context
+        """
+        return bot_token == self.token
+
+    def load(self, bot_token_id: int, file_ids: Iterable[Tuple[int, str]]) -> None:
+        """
+        Initializes the context
+        :param bot_token_id: the id of the BotToken entity
+        :param file_ids: known (image id, file id) tuples of this bot
+        """
+        self.bot_token_id = bot_token_id
+        with self._lock:
+            self._file_ids.clear()
+            for image_id, file_id in file_ids:
+                if len(self._file_ids) >= self._max_size:
+                    break
+                self._file_ids[image_id] = file_id
+        LOGGER.debug("Loaded {} telegram file ids for the current bot".format(len(self._file_ids)))
+
+    def get_file_id(self, image_id: int) -> str or None:
+        """
+        :param image_id: image entity id
+        :return: the cached file id, None if the image is known to not be uploaded, or MISSING if unknown
+        """
+        with self._lock:
+            file_id = self._file_ids.get(image_id, MISSING)
+            if file_id is not MISSING:
+                self._file_ids.move_to_end(image_id)
+            return file_id
+
+    def put_file_id(self, image_id: int, file_id: str or None) -> None:
+        """
+        Caches the file id of an image, an existing file id is not replaced by a different one
+        :param image_id: image entity id
+        :param file_id: the file id, or None if the image has not been uploaded by this bot
+        """
+        if self._max_size <= 0:
+            return
+        with self._lock:
+            existing = self._file_ids.get(image_id, None)
+            if existing is None or file_id is not None:
+                self._file_ids[image_id] = existing or file_id
+            self._file_ids.move_to_end(image_id)
+            while len(self._file_ids) > self._max_size:
+                self._file_ids.popitem(last=False)
+
+    def remove(self, image_id: int) -> None:
+        """
+        Removes an image from the cache
+        :param image_id: image entity id
+        """
+        with self._lock:
+            self._file_ids.pop(image_id, None)
@@ -0,0 +1,100 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+from itertools import islice
+from threading import Lock
+from typing import Callable, Dict, Set
+
+from infinitewisdom import RegularIntervalWorker
+from infinitewisdom.stats import TELEGRAM_FILE_ID_BUFFER_LENGTH
+
+LOGGER = logging.getLogger(__name__)
+
+
+class TelegramFileIdBuffer(RegularIntervalWorker):
+    """
+    Write-behind buffer for (image id, bot token, file id) associations.
+    Associations are collected in memory and written in bulk in a regular interval.
+    If the buffer is not started every association is written immediately.
+    """
+
+    def __init__(self, interval: float, write: Callable[[str, Dict[int, Set[str]]], None], batch_size: int = 500):
+        """
+        :param interval: flush interval in seconds
+        :param write: function that persists the file ids (per image id) of a bot token
+        :param batch_size: maximum number of images to write in a single call
+        """
+        super().__init__(interval)
+        self._write = write
+        self._batch_size = batch_size
+        self._pending = {}
+        self._lock = Lock()
+        self._running = False
+
+    def start(self):
+        self._running = True
+        super().start()
+
+    def stop(self):
+        super().stop()
+        self._running = False
+        self.flush()
+
+    def add(self, image_id: int, bot_token: str, file_ids: [str]) -> None:
+        """
+        Adds file ids of an image to the buffer
+        :param image_id: the image entity id
+        :param bot_token: the bot token that was used to send the image
+        :param file_ids: the file ids returned by telegram
+        """
+        with self._lock:
+            self._pending.setdefault(bot_token, {}).setdefault(image_id, set()).update(file_ids)
+            TELEGRAM_FILE_ID_BUFFER_LENGTH.set(sum(map(len, self._pending.values())))
+
+        if not self._running:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes all buffered associations
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            TELEGRAM_FILE_ID_BUFFER_LENGTH.set(0)
+
+        try:
+            for bot_token, file_ids in pending.items():
+                while len(file_ids) > 0:
+                    batch = dict(islice(file_ids.items(), self._batch_size))
+                    self._write(bot_token, batch)
+                    for image_id in batch.keys():
+                        file_ids.pop(image_id)
+                    LOGGER.debug("Saved telegram file ids of {} images".format(len(batch)))
+        except Exception:
+            # keep everything that has not been written yet for the next try
+            self._restore(pending)
+            raise
+
+    def _restore(self, pending: Dict[str, Dict[int, Set[str]]]) -> None:
+        with self._lock:
+            for bot_token, file_ids in pending.items():
+                for image_id, ids in file_ids.items():
+                    self._pending.setdefault(bot_token, {}).setdefault(image_id, set()).update(ids)
+            TELEGRAM_FILE_ID_BUFFER_LENGTH.set(sum(map(len, self._pending.values())))
+
+    def _run(self):
+        self.flush()
@@ -0,0 +1,278 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import io
+import logging
+import tempfile
+from typing import Iterator, BinaryIO
+
+from infinitewisdom.util import create_hash, create_incremental_hash
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ImageDataBackend:
+    """
+    Base class for image data storage backends.
+    Image data is content addressed, the key of every entry is the hash of its data.
+    """
+
+    def get(self, image_hash: str) -> bytes or None:
+        """
+        Get the image data for a database entity
+        :param image_hash: expected image hash
+        :return: image bytes or None if no data exist
+        """
+        raise NotImplementedError()
+
+    def put(self, image_hash: str, image_data: bytes) -> None:
+        """
+        Stores image data, existing data for the same hash is kept
+        :param image_hash: the image hash
+        :param image_data: the image data
+        """
+        raise NotImplementedError()
+
+    def delete(self, image_hash: str) -> None:
+        """
+        Removes image data, if it exists
+        :param image_hash: the image hash
+        """
+        raise NotImplementedError()
+
+    def exists(self, image_hash: str) -> bool:
+        """
+        Checks if image data exists for the given hash without reading it
+        :param image_hash: image hash
+        :return: True if data exists, false otherwise
+        """
+        raise NotImplementedError()
+
+    def iterate(self) -> Iterator[str]:
+        """
+        :return: iterator of the hashes of all stored entries
+        """
+        raise NotImplementedError()
+
+    def open(self, image_hash: str) -> BinaryIO or None:
+        """
+        Opens a (read-only) stream of the image data, the caller has to close it
+        :param image_hash: image hash
+        :return: file like object or None if no data exist
+        """
+        image_data = self.get(image_hash)
+        if image_data is None:
+            return None
+        return BufferReader(image_data)
+
+    def stage(self) -> "StagedImageData":
+        """
+        Creates a writer for new image data whose hash is not known yet.
+        The data is hashed while it is written and only stored once it is committed.
+        :return: the staged image data
+        """
+        return SpooledStagedImageData(self)
+
+    def get_buffer(self, image_hash: str) -> memoryview or None:
+        """
+        Get the image data without copying it, if the backend supports it
+        :param image_hash: image hash
+        :return: read-only view of the image data or None if no data exist
+        """
+        image_data = self.get(image_hash)
+        if image_data is None:
+            return None
+        return memoryview(image_data)
+
+    def verify(self, image_hash: str) -> bool:
+        """
+        Reads the image data of the given hash and checks if its content matches the hash
+        :param image_hash: image hash
+        :return: True if the data exists and is valid, false otherwise
+        """
+        buffer = self.get_buffer(image_hash)
+        return buffer is not None and create_hash(buffer) == image_hash
+
+    def scrub(self, repair: bool = False) -> [str]:
+        """
+        Verifies the content of all entries
+        :param repair: if True, entries with invalid content are removed
+        :return: list of hashes whose data is invalid
+        """
+        invalid = []
+        for image_hash in list(self.iterate()):
+            if self.verify(image_hash):
+                continue
+            LOGGER.warning("Invalid image data: {}".format(image_hash))
+            invalid.append(image_hash)
+            if repair:
+                self.delete(image_hash)
+        return invalid
+
+    def clear(self) -> None:
+        """
+        Removes all image data
+        """
+        for image_hash in list(self.iterate()):
+            self.delete(image_hash)
+
+    def close(self) -> None:
+        """
+        Releases all resources held by this backend
+        """
+        pass
+
+
+class BufferReader(io.RawIOBase):
+    """
+    Read-only file like object on top of an existing buffer, the buffer is not copied
+    """
+
+    def __init__(self, buffer: bytes or memoryview):
+        self._buffer = memoryview(buffer)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        count = max(0, min(len(b), len(self._buffer) - self._position))
+        b[:count] = self._buffer[self._position:self._position + count]
+        self._position += count
+        return count
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += len(self._buffer)
+        self._position = max(0, offset)
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def close(self) -> None:
+        self._buffer.release()
+        super().close()
+
+
+class StagedImageData(io.RawIOBase):
+    """
+    Writable file like object for image data that is hashed while it is written.
+    Use it as a context manager to discard the data automatically if it has not been committed.
+    """
+
+    def __init__(self):
+        self._hash = create_incremental_hash()
+        self.size = 0
+        self._finished = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        if self._finished:
+            raise ValueError("Staged image data has already been committed or discarded")
+        self._hash.update(b)
+        self.size += len(b)
+        self._write(b)
+        return len(b)
+
+    @property
+    def image_hash(self) -> str:
+        """
+        :return: the hash of the data written so far
+        """
+        return self._hash.hexdigest()
+
+    def getvalue(self) -> bytes:
+        """
+        Reads back the data written so far, e.g. to inspect it before it is committed
+        :return: the written data
+        """
+        if self._finished:
+            raise ValueError("Staged image data has already been committed or discarded")
+        return self._read()
+
+    def commit(self) -> str:
+        """
+        Stores the written data, existing data for the same hash is kept
+        :return: the hash of the data
+        """
+        if self._finished:
+            raise ValueError("Staged image data has already been committed or discarded")
+        self._finished = True
+        self._commit(self.image_hash)
+        self.close()
+        return self.image_hash
+
+    def discard(self) -> None:
+        """
+        Drops the written data
+        """
+        if not self._finished:
+            self._finished = True
+            self._discard()
+        self.close()
+
+    def __exit__(self, *args):
+        self.discard()
+
+    def _write(self, b) -> None:
+        raise NotImplementedError()
+
+    def _read(self) -> bytes:
+        raise NotImplementedError()
+
+    def _commit(self, image_hash: str) -> None:
+        raise NotImplementedError()
+
+    def _discard(self) -> None:
+        raise NotImplementedError()
+
+
+class SpooledStagedImageData(StagedImageData):
+    """
+    Staged image data that is kept in memory (or a temporary file if it gets big)
+    and passed to ImageDataBackend.put on commit
+    """
+
+    def __init__(self, backend: ImageDataBackend, max_memory_size: int = 1024 * 1024):
+        super().__init__()
+        self._backend = backend
+        self._file = tempfile.SpooledTemporaryFile(max_size=max_memory_size)
+
+    def _write(self, b) -> None:
+        self._file.write(b)
+
+    def _read(self) -> bytes:
+        self._file.seek(0)
+        try:
+            return self._file.read()
+        finally:
+            self._file.seek(0, io.SEEK_END)
+
+    def _commit(self, image_hash: str) -> None:
+        if not self._backend.exists(image_hash):
+            self._file.seek(0)
+            self._backend.put(image_hash, self._file.read())
+        self._file.close()
+
+    def _discard(self) -> None:
+        self._file.close()
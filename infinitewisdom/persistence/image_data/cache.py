@@ -0,0 +1,172 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+from collections import OrderedDict
+from threading import Lock
+from typing import Iterator, BinaryIO
+
+from infinitewisdom.persistence.image_data import ImageDataBackend, BufferReader, StagedImageData
+from infinitewisdom.stats import IMAGE_DATA_CACHE_HITS, IMAGE_DATA_CACHE_MISSES, IMAGE_DATA_CACHE_EVICTIONS, \
+    IMAGE_DATA_CACHE_SIZE
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CachedBackend(ImageDataBackend):
+    """
+    Keeps the most recently used image data of another backend in memory.
+    The cache is limited by the total number of bytes it holds, the least recently used entries are evicted first.
+    """
+
+    def __init__(self, store: ImageDataBackend, capacity: int):
+        """
+        :param store: the backend to cache
+        :param capacity: maximum number of bytes to keep in memory
+        """
+        self._store = store
+        self._capacity = capacity
+        self._entries = OrderedDict()
+        self._size = 0
+        # incremented on every invalidation, to not cache data that was removed while it was read
+        self._generation = 0
+        self._lock = Lock()
+
+    def get(self, image_hash: str) -> bytes or None:
+        """
+        Get the image data for a database entity
+        :param image_hash: expected image hash
+        :return: image bytes or None if no data exist
+        """
+        if image_hash is None:
+            return None
+
+        with self._lock:
+            image_data = self._entries.get(image_hash, None)
+            if image_data is not None:
+                self._entries.move_to_end(image_hash)
+                IMAGE_DATA_CACHE_HITS.inc()
+                return image_data
+            generation = self._generation
+
+        IMAGE_DATA_CACHE_MISSES.inc()
+        image_data = self._store.get(image_hash)
+        if image_data is not None:
+            self._add(image_hash, image_data, generation)
+        return image_data
+
+    def exists(self, image_hash: str) -> bool:
+        """
+        Checks if image data exists for the given hash
+        :param image_hash: image hash
+        :return: True if data exists, false otherwise
+        """
+        with self._lock:
+            if image_hash in self._entries:
+                return True
+        return self._store.exists(image_hash)
+
+    def put(self, image_hash: str, image_data: bytes):
+        self._invalidate(image_hash)
+        self._store.put(image_hash, image_data)
+
+    def delete(self, image_hash: str) -> None:
+        self._invalidate(image_hash)
+        self._store.delete(image_hash)
+
+    def iterate(self) -> Iterator[str]:
+        return self._store.iterate()
+
+    def open(self, image_hash: str) -> BinaryIO or None:
+        """
+        Opens a stream of cached data, streams of uncached data are opened by the cached backend
+        and do not populate the cache
+        :param image_hash: image hash
+        :return: file like object or None if no data exist
+        """
+        with self._lock:
+            image_data = self._entries.get(image_hash, None)
+        if image_data is not None:
+            IMAGE_DATA_CACHE_HITS.inc()
+            return BufferReader(image_data)
+        return self._store.open(image_hash)
+
+    def stage(self) -> StagedImageData:
+        # data is content addressed, so committing staged data never changes cached entries
+        return self._store.stage()
+
+    def get_buffer(self, image_hash: str) -> memoryview or None:
+        image_data = self.get(image_hash)
+        if image_data is None:
+            return None
+        return memoryview(image_data)
+
+    def verify(self, image_hash: str) -> bool:
+        """
+        Checks the stored (not the cached) data of the given hash
+        :param image_hash: image hash
+        :return: True if the data exists and is valid, false otherwise
+        """
+        return self._store.verify(image_hash)
+
+    def scrub(self, repair: bool = False) -> [str]:
+        """
+        Verifies the content of the cached backend
+        :param repair: if True, invalid data is removed
+        :return: list of hashes whose data is invalid
+        """
+        invalid = self._store.scrub(repair)
+        for image_hash in invalid:
+            self._invalidate(image_hash)
+        return invalid
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self._size = 0
+            IMAGE_DATA_CACHE_SIZE.set(0)
+        self._store.clear()
+
+    def close(self) -> None:
+        self._store.close()
+
+    def _add(self, image_hash: str, image_data: bytes, generation: int) -> None:
+        size = len(image_data)
+        if size > self._capacity:
+            return
+
+        with self._lock:
+            if generation != self._generation:
+                return
+            existing = self._entries.pop(image_hash, None)
+            if existing is not None:
+                self._size -= len(existing)
+            self._entries[image_hash] = image_data
+            self._size += size
+
+            while self._size > self._capacity:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+                IMAGE_DATA_CACHE_EVICTIONS.inc()
+            IMAGE_DATA_CACHE_SIZE.set(self._size)
+
+    def _invalidate(self, image_hash: str) -> None:
+        with self._lock:
+            self._generation += 1
+            existing = self._entries.pop(image_hash, None)
+            if existing is not None:
+                self._size -= len(existing)
+                IMAGE_DATA_CACHE_SIZE.set(self._size)
@@ -0,0 +1,78 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from infinitewisdom.config.config import AppConfig
+from infinitewisdom.const import IMAGE_DATA_BACKEND_PACKFILE, IMAGE_DATA_BACKEND_SQLITE, IMAGE_DATA_BACKEND_S3, \
+    IMAGE_DATA_BACKEND_FILESYSTEM
+from infinitewisdom.persistence.image_data import ImageDataBackend
+from infinitewisdom.persistence.image_data.cache import CachedBackend
+from infinitewisdom.persistence.image_data.filesystem import FileSystemBackend
+from infinitewisdom.persistence.image_data.packfile import PackfileBackend
+from infinitewisdom.persistence.image_data.sqlite import SQLiteBackend
+
+
+def get_image_data_backend_settings(config: AppConfig) -> dict:
+    """
+    Collects the image data backend settings of the given configuration.
+    The result is a plain (picklable) dict, so it can be passed to other processes.
+    :param config: the configuration
+    :return: keyword arguments for create_image_data_backend
+    """
+    return {
+        "backend_type": config.FILE_PERSISTENCE_BACKEND.value,
+        "base_path": config.FILE_PERSISTENCE_BASE_PATH.value,
+        "cache_size": config.FILE_PERSISTENCE_CACHE_SIZE.value,
+        "s3_bucket": config.FILE_PERSISTENCE_S3_BUCKET.value,
+        "s3_prefix": config.FILE_PERSISTENCE_S3_PREFIX.value or "",
+        "s3_endpoint_url": config.FILE_PERSISTENCE_S3_ENDPOINT_URL.value,
+        "s3_region": config.FILE_PERSISTENCE_S3_REGION.value,
+        "s3_access_key_id": config.FILE_PERSISTENCE_S3_ACCESS_KEY_ID.value,
+        "s3_secret_access_key": config.FILE_PERSISTENCE_S3_SECRET_ACCESS_KEY.value,
+    }
+
+
+def create_image_data_backend(backend_type: str = IMAGE_DATA_BACKEND_FILESYSTEM, base_path: str = None,
+                              cache_size: int = 0, s3_bucket: str = None, s3_prefix: str = "",
+                              s3_endpoint_url: str = None, s3_region: str = None, s3_access_key_id: str = None,
+                              s3_secret_access_key: str = None, read_only: bool = False) -> ImageDataBackend:
+    """
+    Creates an image data backend
+    :param backend_type: one of IMAGE_DATA_BACKENDS
+    :param base_path: base path of local backends
+    :param cache_size: size of the in memory cache in bytes, 0 disables the cache
+    :param s3_bucket: bucket of the S3 backend
+    :param s3_prefix: object key prefix of the S3 backend
+    :param s3_endpoint_url: custom endpoint of the S3 backend
+    :param s3_region: region of the S3 backend
+    :param s3_access_key_id: access key id of the S3 backend
+    :param s3_secret_access_key: secret access key of the S3 backend
+    :param read_only: open the store for reading only, required for worker processes that access
+    a store while the main process is writing to it
+    :return: the backend
+    """
+    if backend_type == IMAGE_DATA_BACKEND_PACKFILE:
+        backend = PackfileBackend(base_path, read_only=read_only)
+    elif backend_type == IMAGE_DATA_BACKEND_SQLITE:
+        backend = SQLiteBackend(base_path)
+    elif backend_type == IMAGE_DATA_BACKEND_S3:
+        from infinitewisdom.persistence.image_data.s3 import S3Backend
+        backend = S3Backend(bucket=s3_bucket, prefix=s3_prefix, endpoint_url=s3_endpoint_url, region=s3_region,
+                            access_key_id=s3_access_key_id, secret_access_key=s3_secret_access_key)
+    else:
+        backend = FileSystemBackend(base_path)
+
+    if cache_size > 0:
+        backend = CachedBackend(backend, cache_size)
+    return backend
@@ -0,0 +1,237 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import os
+import tempfile
+from threading import Lock
+from typing import Iterator, BinaryIO
+
+from infinitewisdom.persistence.image_data import ImageDataBackend, StagedImageData
+
+LOGGER = logging.getLogger(__name__)
+
+LOCK_STRIPES = 64
+
+
+class FileSystemBackend(ImageDataBackend):
+    """
+    Stores every image in its own file in a folder tree below a base path.
+
+    Files are written to a temporary file first and then atomically moved to their final location,
+    so readers never see partially written files and don't need any locking.
+    Writers are serialized per folder using a fixed number of striped locks.
+    """
+
+    def __init__(self, base_path: str):
+        self._base_path = base_path
+        self._locks = [Lock() for _ in range(LOCK_STRIPES)]
+
+    def get(self, image_hash: str) -> bytes or None:
+        """
+        Get the image data for a database entity
+        :param image_hash: expected image hash
+        :return: image bytes or None if no data exist
+        """
+        if image_hash is None:
+            return None
+
+        file_path = self._get_file_path(image_hash)
+        try:
+            with open(file_path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def exists(self, image_hash: str) -> bool:
+        """
+        Checks if image data exists for the given hash without reading it
+        :param image_hash: image hash
+        :return: True if data exists, false otherwise
+        """
+        if image_hash is None:
+            return False
+        return self._get_size(self._get_file_path(image_hash)) is not None
+
+    def open(self, image_hash: str) -> BinaryIO or None:
+        if image_hash is None:
+            return None
+        try:
+            return open(self._get_file_path(image_hash), 'rb')
+        except FileNotFoundError:
+            return None
+
+    def stage(self) -> StagedImageData:
+        return FileSystemStagedImageData(self)
+
+    def iterate(self) -> Iterator[str]:
+        for root, dirs, files in os.walk(self._base_path):
+            for file in files:
+                image_hash, extension = os.path.splitext(file)
+                if extension != ".jpg" or file.startswith("."):
+                    continue
+                yield image_hash
+
+    def put(self, image_hash: str, image_data: bytes):
+        """
+        Stores image data for
+        :param image_hash: the image hash
+        :param image_data: the image data
+        """
+        if image_hash is None:
+            LOGGER.debug("Trying to put with a None hash is ignored")
+            return
+
+        file_path = self._get_file_path(image_hash)
+        folder, file = os.path.split(file_path)
+
+        with self._get_lock(image_hash):
+            # files are only ever moved into place completely, so a file with the expected size
+            # is trusted without reading it (see verify() for a full check)
+            if self._get_size(file_path) == len(image_data):
+                LOGGER.debug("Image data already present: {}".format(image_hash))
+                return
+
+            os.makedirs(folder, exist_ok=True)
+            self._write_atomic(file_path, image_data)
+
+            LOGGER.debug("Image data saved: {}".format(image_hash))
+
+    def delete(self, image_hash: str) -> None:
+        if image_hash is None:
+            return
+
+        with self._get_lock(image_hash):
+            self._remove(self._get_file_path(image_hash))
+        LOGGER.debug("Image data removed: {}".format(image_hash))
+
+    def _commit_staged(self, image_hash: str, temp_path: str, size: int) -> None:
+        """
+        Moves a completely written temporary file to the location of the given hash
+        :param image_hash: the hash of the file content
+        :param temp_path: path of the temporary file
+        :param size: size of the file
+        """
+        file_path = self._get_file_path(image_hash)
+        folder, file = os.path.split(file_path)
+        with self._get_lock(image_hash):
+            if self._get_size(file_path) == size:
+                LOGGER.debug("Image data already present: {}".format(image_hash))
+                os.remove(temp_path)
+                return
+            os.makedirs(folder, exist_ok=True)
+            os.replace(temp_path, file_path)
+        LOGGER.debug("Image data saved: {}".format(image_hash))
+
+    @staticmethod
+    def _write_atomic(file_path: str, image_data: bytes) -> None:
+        """
+        Writes data to a temporary file in the target folder and moves it to the given path
+        :param file_path: target file path
+        :param image_data: data to write
+        """
+        folder, file = os.path.split(file_path)
+        fd, temp_path = tempfile.mkstemp(prefix=".{}.".format(file), suffix=".tmp", dir=folder)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image_data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, file_path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def _remove(file_path: str) -> None:
+        """
+        Removes a file and its folder, if it is empty afterwards
+        :param file_path: the file to remove
+        """
+        folder, file = os.path.split(file_path)
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(folder)
+        except OSError:
+            # folder does not exist or is not empty
+            pass
+
+    @staticmethod
+    def _get_size(file_path: str) -> int or None:
+        """
+        :param file_path: file path
+        :return: the size of the file in bytes or None if it does not exist
+        """
+        try:
+            return os.stat(file_path).st_size
+        except FileNotFoundError:
+            return None
+
+    def _get_lock(self, image_hash: str) -> Lock:
+        """
+        Selects the lock responsible for the folder of the given hash
+        :param image_hash: image hash
+        :return: lock
+        """
+        return self._locks[int(image_hash[:3], 16) % LOCK_STRIPES]
+
+    def _get_file_path(self, image_hash) -> os.path:
+        """
+        Constructs the file path where the image date is located
+        :param image_hash: image hash
+        :return: file path
+        """
+        return os.path.abspath(os.path.join(self._base_path, *list(image_hash[:3]), "{}.jpg".format(image_hash)))
+
+
+class FileSystemStagedImageData(StagedImageData):
+    """
+    Staged image data that is written to a temporary file in the base path of a FileSystemBackend,
+    the file is moved to its final location on commit.
+    """
+
+    def __init__(self, backend: FileSystemBackend):
+        super().__init__()
+        self._backend = backend
+        os.makedirs(backend._base_path, exist_ok=True)
+        fd, self._temp_path = tempfile.mkstemp(prefix=".staged.", suffix=".tmp", dir=backend._base_path)
+        self._file = os.fdopen(fd, 'wb')
+
+    def _write(self, b) -> None:
+        self._file.write(b)
+
+    def _read(self) -> bytes:
+        self._file.flush()
+        with open(self._temp_path, 'rb') as f:
+            return f.read()
+
+    def _commit(self, image_hash: str) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        try:
+            self._backend._commit_staged(image_hash, self._temp_path, self.size)
+        except:
+            self._discard()
+            raise
+
+    def _discard(self) -> None:
+        self._file.close()
+        if os.path.exists(self._temp_path):
+            os.remove(self._temp_path)
@@ -0,0 +1,523 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import mmap
+import os
+import re
+import struct
+from threading import RLock
+from typing import Iterator, Tuple, BinaryIO
+
+from infinitewisdom.persistence.image_data import ImageDataBackend, BufferReader
+
+LOGGER = logging.getLogger(__name__)
+
+INDEX_FILE_NAME = "index.idx"
+SEGMENT_FILE_NAME = "segment-{:08d}.pack"
+SEGMENT_FILE_PATTERN = re.compile(r"^segment-(\d{8})\.pack$")
+
+DEFAULT_SEGMENT_SIZE = 1024 * 1024 * 1024
+
+INDEX_MAGIC = b"IWPI"
+INDEX_VERSION = 1
+INITIAL_INDEX_CAPACITY = 1024
+MAX_INDEX_LOAD = 0.7
+
+# magic, version, capacity, live entries, tombstones
+INDEX_HEADER = struct.Struct("<4sIQQQ")
+# digest, segment number + 1, data offset, data length
+INDEX_SLOT = struct.Struct("<16sIQI")
+# digest, data length
+RECORD_HEADER = struct.Struct("<16sI")
+
+SLOT_EMPTY = 0
+SLOT_TOMBSTONE = 0xFFFFFFFF
+
+
+class PackfileIndex:
+    """
+    Memory mapped open addressing hash table: image digest -> (segment, offset, length)
+
+    The file starts with a header followed by fixed size slots, collisions are resolved using linear probing.
+    Removed entries are marked with a tombstone and the table is rebuilt with twice the capacity
+    when it gets too full.
+    A read-only index follows the changes of the (single) writing process, see refresh().
+    """
+
+    def __init__(self, path: str, capacity: int = INITIAL_INDEX_CAPACITY, read_only: bool = False):
+        """
+        :param path: path of the index file, it is created if it does not exist (unless opened read-only)
+        :param capacity: initial number of slots of a new index
+        :param read_only: open an existing index for reading only
+        """
+        self._path = path
+        self._read_only = read_only
+        if not read_only and not os.path.exists(path):
+            self._create(path, capacity)
+        self._open()
+
+    def __len__(self):
+        return self._count
+
+    def close(self):
+        if not self._read_only:
+            self._mmap.flush()
+        self._mmap.close()
+        os.close(self._fd)
+
+    def refresh(self) -> bool:
+        """
+        Catches up with the writing process of a read-only index.
+        Slots that are changed in place are visible through the shared memory map anyway,
+        but growing or compacting the index replaces the whole file, which has to be mapped again.
+        :return: True if the index file has been replaced and is mapped again
+        """
+        if not self._read_only:
+            return False
+        if os.stat(self._path).st_ino == os.fstat(self._fd).st_ino:
+            self._read_header()
+            return False
+        LOGGER.debug("Packfile index has been replaced, mapping it again: {}".format(self._path))
+        self.close()
+        self._open()
+        return True
+
+    def flush(self):
+        self._mmap.flush()
+
+    def get(self, digest: bytes) -> Tuple[int, int, int] or None:
+        """
+        :param digest: binary image digest
+        :return: (segment, offset, length) or None if the digest is unknown
+        """
+        slot = self._find(digest)
+        if slot is None:
+            return None
+        _, segment, offset, length = self._read_slot(slot)
+        return segment - 1, offset, length
+
+    def put(self, digest: bytes, segment: int, offset: int, length: int) -> None:
+        """
+        Adds or replaces an entry
+        :param digest: binary image digest
+        :param segment: segment number
+        :param offset: offset of the data in the segment
+        :param length: length of the data
+        """
+        slot = self._find(digest)
+        if slot is None:
+            if (self._count + self._tombstones + 1) > self._capacity * MAX_INDEX_LOAD:
+                self._grow()
+            slot = self._find_free(digest)
+            if self._read_slot(slot)[1] == SLOT_TOMBSTONE:
+                self._tombstones -= 1
+            self._count += 1
+            self._write_header()
+        self._write_slot(slot, digest, segment + 1, offset, length)
+
+    def remove(self, digest: bytes) -> bool:
+        """
+        Removes an entry
+        :param digest: binary image digest
+        :return: True if an entry was removed, false otherwise
+        """
+        slot = self._find(digest)
+        if slot is None:
+            return False
+        self._write_slot(slot, bytes(16), SLOT_TOMBSTONE, 0, 0)
+        self._count -= 1
+        self._tombstones += 1
+        self._write_header()
+        return True
+
+    def entries(self) -> Iterator[Tuple[bytes, int, int, int]]:
+        """
+        :return: iterator of all (digest, segment, offset, length) entries
+        """
+        for slot in range(self._capacity):
+            digest, segment, offset, length = self._read_slot(slot)
+            if segment not in [SLOT_EMPTY, SLOT_TOMBSTONE]:
+                yield digest, segment - 1, offset, length
+
+    def _find(self, digest: bytes) -> int or None:
+        """
+        :return: the slot number of the given digest or None
+        """
+        for slot in self._probe(digest):
+            slot_digest, segment, _, _ = self._read_slot(slot)
+            if segment == SLOT_EMPTY:
+                return None
+            if segment != SLOT_TOMBSTONE and slot_digest == digest:
+                return slot
+        return None
+
+    def _find_free(self, digest: bytes) -> int:
+        """
+        :return: the first empty or removed slot for the given digest
+        """
+        for slot in self._probe(digest):
+            segment = self._read_slot(slot)[1]
+            if segment in [SLOT_EMPTY, SLOT_TOMBSTONE]:
+                return slot
+        raise AssertionError("Packfile index is full")
+
+    def _probe(self, digest: bytes) -> Iterator[int]:
+        start = int.from_bytes(digest[:8], "little") % self._capacity
+        for i in range(self._capacity):
+            yield (start + i) % self._capacity
+
+    def _read_slot(self, slot: int) -> Tuple[bytes, int, int, int]:
+        return INDEX_SLOT.unpack_from(self._mmap, INDEX_HEADER.size + slot * INDEX_SLOT.size)
+
+    def _write_slot(self, slot: int, digest: bytes, segment: int, offset: int, length: int) -> None:
+        INDEX_SLOT.pack_into(self._mmap, INDEX_HEADER.size + slot * INDEX_SLOT.size, digest, segment, offset, length)
+
+    def _write_header(self) -> None:
+        INDEX_HEADER.pack_into(self._mmap, 0, INDEX_MAGIC, INDEX_VERSION, self._capacity, self._count,
+                               self._tombstones)
+
+    def _grow(self) -> None:
+        """
+        Rebuilds the index with (at least) twice the capacity and without tombstones
+        """
+        capacity = self._capacity
+        while (self._count + 1) > capacity * MAX_INDEX_LOAD / 2:
+            capacity *= 2
+        LOGGER.debug("Growing packfile index to {} slots".format(capacity))
+
+        temp_path = self._path + ".tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        self._create(temp_path, capacity)
+        index = PackfileIndex(temp_path)
+        for digest, segment, offset, length in self.entries():
+            index.put(digest, segment, offset, length)
+        index.close()
+
+        self.close()
+        os.replace(temp_path, self._path)
+        self._open()
+
+    @staticmethod
+    def _create(path: str, capacity: int) -> None:
+        with open(path, "wb") as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, capacity, 0, 0))
+            f.truncate(INDEX_HEADER.size + capacity * INDEX_SLOT.size)
+
+    def _open(self) -> None:
+        if self._read_only:
+            self._fd = os.open(self._path, os.O_RDONLY)
+            self._mmap = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+        else:
+            self._fd = os.open(self._path, os.O_RDWR)
+            self._mmap = mmap.mmap(self._fd, 0)
+        if not self._read_header():
+            self.close()
+            raise ValueError("Not a packfile index: {}".format(self._path))
+
+    def _read_header(self) -> bool:
+        """
+        :return: True if the header is valid
+        """
+        magic, version, self._capacity, self._count, self._tombstones = INDEX_HEADER.unpack_from(self._mmap, 0)
+        return magic == INDEX_MAGIC and version == INDEX_VERSION
+
+
+class PackfileBackend(ImageDataBackend):
+    """
+    Image data backend that appends image data to large segment files instead of creating one file per image.
+
+    The location of every image is kept in a memory mapped PackfileIndex,
+    segments are memory mapped for reading so image data can be accessed without copying it.
+    Removed or replaced data stays in its segment until compact() is called.
+    A store directory must only be written by a single process at a time,
+    other processes (like analysis or scrubber workers) have to open it read-only.
+    """
+
+    def __init__(self, base_path: str, segment_size: int = DEFAULT_SEGMENT_SIZE, read_only: bool = False):
+        """
+        :param base_path: directory of the segment and index files
+        :param segment_size: size in bytes after which a new segment is started
+        :param read_only: open an existing store for reading only, while another process is writing to it
+        """
+        self._base_path = os.path.abspath(base_path)
+        self._segment_size = segment_size
+        self._read_only = read_only
+        self._lock = RLock()
+        self._maps = {}
+        self._writer = None
+
+        index_path = os.path.join(self._base_path, INDEX_FILE_NAME)
+        if read_only:
+            self._index = PackfileIndex(index_path, read_only=True)
+            return
+
+        os.makedirs(self._base_path, exist_ok=True)
+        rebuild = not os.path.exists(index_path)
+        self._index = PackfileIndex(index_path)
+        if rebuild and len(self._list_segments()) > 0:
+            self._rebuild_index()
+        self._open_writer(max(self._list_segments(), default=0))
+
+    def close(self) -> None:
+        """
+        Flushes and closes all open files
+        """
+        with self._lock:
+            self._close_writer()
+            self._index.close()
+            self._close_maps()
+
+    def get(self, image_hash: str) -> bytes or None:
+        """
+        Get the image data for a database entity
+        :param image_hash: expected image hash
+        :return: image bytes or None if no data exist
+        """
+        buffer = self.get_buffer(image_hash)
+        if buffer is None:
+            return None
+        return bytes(buffer)
+
+    def get_buffer(self, image_hash: str) -> memoryview or None:
+        """
+        Get the image data for a database entity without copying it
+        :param image_hash: expected image hash
+        :return: read-only view of the image data or None if no data exist
+        """
+        if image_hash is None:
+            return None
+
+        digest = bytes.fromhex(image_hash)
+        with self._lock:
+            self._refresh()
+            location = self._index.get(digest)
+            if location is None:
+                return None
+            segment, offset, length = location
+            try:
+                segment_map = self._get_map(segment, offset + length)
+            except FileNotFoundError:
+                if not self._read_only:
+                    raise
+                # the writer has compacted the store since the location has been read
+                self._refresh()
+                location = self._index.get(digest)
+                if location is None:
+                    return None
+                segment, offset, length = location
+                segment_map = self._get_map(segment, offset + length)
+        return memoryview(segment_map)[offset:offset + length]
+
+    def exists(self, image_hash: str) -> bool:
+        """
+        Checks if image data exists for the given hash without reading it
+        :param image_hash: image hash
+        :return: True if data exists, false otherwise
+        """
+        if image_hash is None:
+            return False
+        with self._lock:
+            self._refresh()
+            return self._index.get(bytes.fromhex(image_hash)) is not None
+
+    def open(self, image_hash: str) -> BinaryIO or None:
+        buffer = self.get_buffer(image_hash)
+        if buffer is None:
+            return None
+        return BufferReader(buffer)
+
+    def iterate(self) -> Iterator[str]:
+        with self._lock:
+            self._refresh()
+            hashes = [digest.hex() for digest, _, _, _ in self._index.entries()]
+        return iter(hashes)
+
+    def put(self, image_hash: str, image_data: bytes):
+        """
+        Stores image data for
+        :param image_hash: the image hash
+        :param image_data: the image data
+        """
+        if image_hash is None:
+            LOGGER.debug("Trying to put with a None hash is ignored")
+            return
+        self._check_writable()
+
+        digest = bytes.fromhex(image_hash)
+        with self._lock:
+            location = self._index.get(digest)
+            if location is not None and location[2] == len(image_data):
+                LOGGER.debug("Image data already present: {}".format(image_hash))
+                return
+
+            segment, offset = self._append(digest, image_data)
+            self._index.put(digest, segment, offset, len(image_data))
+
+        LOGGER.debug("Image data saved: {}".format(image_hash))
+
+    def delete(self, image_hash: str) -> None:
+        if image_hash is None:
+            return
+        self._check_writable()
+
+        with self._lock:
+            self._index.remove(bytes.fromhex(image_hash))
+        LOGGER.debug("Image data removed: {}".format(image_hash))
+
+    def clear(self):
+        self._check_writable()
+        with self._lock:
+            self._close_writer()
+            self._close_maps()
+            for segment in self._list_segments():
+                os.remove(self._segment_path(segment))
+            index_path = os.path.join(self._base_path, INDEX_FILE_NAME)
+            self._index.close()
+            os.remove(index_path)
+            self._index = PackfileIndex(index_path)
+            self._open_writer(0)
+
+    def compact(self) -> None:
+        """
+        Rewrites all live entries to new segments and removes the old segments
+        to free the space of removed or replaced image data.
+        """
+        self._check_writable()
+        with self._lock:
+            old_segments = self._list_segments()
+            entries = sorted(self._index.entries(), key=lambda x: (x[1], x[2]))
+            self._close_writer()
+
+            first_segment = max(old_segments, default=-1) + 1
+            self._open_writer(first_segment)
+            index_path = os.path.join(self._base_path, INDEX_FILE_NAME)
+            temp_path = index_path + ".tmp"
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            index = PackfileIndex(temp_path, capacity=max(INITIAL_INDEX_CAPACITY, int(len(entries) * 2)))
+            for digest, segment, offset, length in entries:
+                data = memoryview(self._get_map(segment, offset + length))[offset:offset + length]
+                new_segment, new_offset = self._append(digest, data)
+                index.put(digest, new_segment, new_offset, length)
+            index.close()
+
+            # the new index only becomes active once all data has been copied
+            self._index.close()
+            os.replace(temp_path, index_path)
+            self._index = PackfileIndex(index_path)
+
+            for segment in old_segments:
+                self._maps.pop(segment, None)
+                os.remove(self._segment_path(segment))
+
+            LOGGER.debug("Compacted {} segments into {} entries".format(len(old_segments), len(entries)))
+
+    def _check_writable(self) -> None:
+        if self._read_only:
+            raise ValueError("Packfile store is opened read-only: {}".format(self._base_path))
+
+    def _refresh(self) -> None:
+        """
+        Follows index replacements of the writing process, cached segment maps may belong to removed segments then
+        """
+        if self._index.refresh():
+            self._close_maps()
+
+    def _append(self, digest: bytes, image_data: bytes or memoryview) -> Tuple[int, int]:
+        """
+        Appends a record to the current segment, a new segment is started if the current one is full
+        :return: (segment, offset) of the data
+        """
+        segment, f = self._writer
+        position = f.tell()
+        if position > 0 and position + RECORD_HEADER.size + len(image_data) > self._segment_size:
+            self._close_writer()
+            self._open_writer(segment + 1)
+            segment, f = self._writer
+            position = f.tell()
+
+        f.write(RECORD_HEADER.pack(digest, len(image_data)))
+        f.write(image_data)
+        f.flush()
+        os.fsync(f.fileno())
+        return segment, position + RECORD_HEADER.size
+
+    def _get_map(self, segment: int, end: int) -> mmap.mmap:
+        """
+        Returns a read-only memory map of a segment that covers at least the given number of bytes
+        """
+        segment_map = self._maps.get(segment, None)
+        if segment_map is None or len(segment_map) < end:
+            # maps that are still referenced by a memoryview are freed once the view is released
+            with open(self._segment_path(segment), "rb") as f:
+                segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[segment] = segment_map
+        return segment_map
+
+    def _close_maps(self) -> None:
+        for segment_map in self._maps.values():
+            try:
+                segment_map.close()
+            except BufferError:
+                # still referenced by a memoryview
+                pass
+        self._maps.clear()
+
+    def _open_writer(self, segment: int) -> None:
+        self._writer = (segment, open(self._segment_path(segment), "ab"))
+
+    def _close_writer(self) -> None:
+        if self._writer is not None:
+            self._writer[1].close()
+            self._writer = None
+
+    def _list_segments(self) -> [int]:
+        """
+        :return: sorted list of all existing segment numbers
+        """
+        segments = []
+        for file in os.listdir(self._base_path):
+            match = SEGMENT_FILE_PATTERN.match(file)
+            if match is not None:
+                segments.append(int(match.group(1)))
+        return sorted(segments)
+
+    def _segment_path(self, segment: int) -> str:
+        return os.path.join(self._base_path, SEGMENT_FILE_NAME.format(segment))
+
+    def _rebuild_index(self) -> None:
+        """
+        Recreates the index by scanning all segments, a truncated record at the end of a segment is removed.
+        Removals are not recorded in segments, so data that was removed before the last compaction reappears.
+        """
+        LOGGER.info("Rebuilding packfile index of {}".format(self._base_path))
+        for segment in self._list_segments():
+            path = self._segment_path(segment)
+            size = os.path.getsize(path)
+            with open(path, "rb") as f:
+                position = 0
+                while position + RECORD_HEADER.size <= size:
+                    digest, length = RECORD_HEADER.unpack(f.read(RECORD_HEADER.size))
+                    if position + RECORD_HEADER.size + length > size:
+                        break
+                    self._index.put(digest, segment, position + RECORD_HEADER.size, length)
+                    position += RECORD_HEADER.size + length
+                    f.seek(position)
+            if position < size:
+                LOGGER.warning("Removing truncated record at the end of segment {}".format(path))
+                os.truncate(path, position)
+        self._index.flush()
@@ -0,0 +1,127 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+from typing import Iterator, BinaryIO
+
+from infinitewisdom.persistence.image_data import ImageDataBackend
+
+LOGGER = logging.getLogger(__name__)
+
+NOT_FOUND_ERROR_CODES = ["NoSuchKey", "NotFound", "404"]
+
+
+class S3Backend(ImageDataBackend):
+    """
+    Stores image data as objects in an S3 compatible object storage.
+    Requires boto3 unless a client is passed in.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url: str = None, region: str = None,
+                 access_key_id: str = None, secret_access_key: str = None, client=None):
+        """
+        :param bucket: name of the bucket
+        :param prefix: prefix of all object keys
+        :param endpoint_url: custom endpoint of a S3 compatible service
+        :param region: region name
+        :param access_key_id: access key id
+        :param secret_access_key: secret access key
+        :param client: a boto3 S3 client (or compatible object) to use instead of creating one
+        """
+        if client is None:
+            import boto3
+            client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region,
+                                  aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
+        self._client = client
+        self._bucket = bucket
+        self._prefix = prefix
+
+    def get(self, image_hash: str) -> bytes or None:
+        stream = self.open(image_hash)
+        if stream is None:
+            return None
+        try:
+            return stream.read()
+        finally:
+            stream.close()
+
+    def put(self, image_hash: str, image_data: bytes) -> None:
+        if image_hash is None:
+            LOGGER.debug("Trying to put with a None hash is ignored")
+            return
+        if self._get_size(image_hash) == len(image_data):
+            LOGGER.debug("Image data already present: {}".format(image_hash))
+            return
+
+        self._client.put_object(Bucket=self._bucket, Key=self._get_key(image_hash), Body=image_data,
+                                ContentType="image/jpeg")
+        LOGGER.debug("Image data saved: {}".format(image_hash))
+
+    def delete(self, image_hash: str) -> None:
+        if image_hash is None:
+            return
+        self._client.delete_object(Bucket=self._bucket, Key=self._get_key(image_hash))
+        LOGGER.debug("Image data removed: {}".format(image_hash))
+
+    def exists(self, image_hash: str) -> bool:
+        if image_hash is None:
+            return False
+        return self._get_size(image_hash) is not None
+
+    def iterate(self) -> Iterator[str]:
+        kwargs = {"Bucket": self._bucket, "Prefix": self._prefix}
+        while True:
+            response = self._client.list_objects_v2(**kwargs)
+            for item in response.get("Contents", []):
+                key = item["Key"][len(self._prefix):]
+                if key.endswith(".jpg"):
+                    yield key[:-len(".jpg")]
+            if not response.get("IsTruncated", False):
+                break
+            kwargs["ContinuationToken"] = response["NextContinuationToken"]
+
+    def open(self, image_hash: str) -> BinaryIO or None:
+        if image_hash is None:
+            return None
+        try:
+            response = self._client.get_object(Bucket=self._bucket, Key=self._get_key(image_hash))
+        except Exception as e:
+            if self._is_not_found(e):
+                return None
+            raise
+        return response["Body"]
+
+    def _get_size(self, image_hash: str) -> int or None:
+        """
+        :return: the size of the object in bytes or None if it does not exist
+        """
+        try:
+            response = self._client.head_object(Bucket=self._bucket, Key=self._get_key(image_hash))
+        except Exception as e:
+            if self._is_not_found(e):
+                return None
+            raise
+        return response["ContentLength"]
+
+    def _get_key(self, image_hash: str) -> str:
+        return "{}{}.jpg".format(self._prefix, image_hash)
+
+    @staticmethod
+    def _is_not_found(e: Exception) -> bool:
+        """
+        :return: True if the given client error means that the object does not exist
+        """
+        response = getattr(e, "response", None) or {}
+        return response.get("Error", {}).get("Code", None) in NOT_FOUND_ERROR_CODES
@@ -0,0 +1,125 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import os
+import sqlite3
+import threading
+from typing import Iterator, BinaryIO
+
+from infinitewisdom.persistence.image_data import ImageDataBackend
+
+LOGGER = logging.getLogger(__name__)
+
+DATABASE_FILE_NAME = "image_data.sqlite"
+
+
+class SQLiteBackend(ImageDataBackend):
+    """
+    Stores image data as blobs in a separate SQLite database file.
+    Every thread uses its own connection, the database is opened in WAL mode so readers don't block writers.
+    """
+
+    def __init__(self, base_path: str):
+        """
+        :param base_path: directory of the database file
+        """
+        os.makedirs(base_path, exist_ok=True)
+        self._path = os.path.abspath(os.path.join(base_path, DATABASE_FILE_NAME))
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+        connection = self._get_connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("CREATE TABLE IF NOT EXISTS image_data (hash TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        connection.commit()
+
+    def get(self, image_hash: str) -> bytes or None:
+        if image_hash is None:
+            return None
+        row = self._get_connection().execute("SELECT data FROM image_data WHERE hash = ?", (image_hash,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def put(self, image_hash: str, image_data: bytes) -> None:
+        if image_hash is None:
+            LOGGER.debug("Trying to put with a None hash is ignored")
+            return
+
+        connection = self._get_connection()
+        with connection:
+            # like the other backends, existing data is only replaced if its size is different
+            connection.execute("INSERT INTO image_data (hash, data) VALUES (?, ?) "
+                               "ON CONFLICT(hash) DO UPDATE SET data = excluded.data "
+                               "WHERE length(image_data.data) != length(excluded.data)",
+                               (image_hash, sqlite3.Binary(image_data)))
+        LOGGER.debug("Image data saved: {}".format(image_hash))
+
+    def delete(self, image_hash: str) -> None:
+        if image_hash is None:
+            return
+
+        connection = self._get_connection()
+        with connection:
+            connection.execute("DELETE FROM image_data WHERE hash = ?", (image_hash,))
+        LOGGER.debug("Image data removed: {}".format(image_hash))
+
+    def exists(self, image_hash: str) -> bool:
+        if image_hash is None:
+            return False
+        row = self._get_connection().execute("SELECT 1 FROM image_data WHERE hash = ?", (image_hash,)).fetchone()
+        return row is not None
+
+    def iterate(self) -> Iterator[str]:
+        # fetch all hashes at once to not keep a read transaction open while the caller iterates
+        rows = self._get_connection().execute("SELECT hash FROM image_data").fetchall()
+        return map(lambda x: x[0], rows)
+
+    def open(self, image_hash: str) -> BinaryIO or None:
+        connection = self._get_connection()
+        if not hasattr(connection, "blobopen"):
+            # incremental blob I/O is only available since python 3.11
+            return super().open(image_hash)
+
+        row = connection.execute("SELECT rowid FROM image_data WHERE hash = ?", (image_hash,)).fetchone()
+        if row is None:
+            return None
+        return connection.blobopen("image_data", "data", row[0], readonly=True)
+
+    def clear(self) -> None:
+        connection = self._get_connection()
+        with connection:
+            connection.execute("DELETE FROM image_data")
+
+    def close(self) -> None:
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """
+        :return: the connection of the current thread
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self._path, check_same_thread=False)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
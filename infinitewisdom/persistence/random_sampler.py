@@ -0,0 +1,139 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import random
+from array import array
+from threading import Lock
+from typing import Iterable, List
+
+LOGGER = logging.getLogger(__name__)
+
+# a disabled sampler is only enabled again once the pool is this much smaller than the maximum size,
+# to not reload all ids over and over while the pool size is around the maximum
+REENABLE_RATIO = 0.9
+
+
+class RandomImageSampler:
+    """
+    Keeps a compact in-memory array of all image ids to select random images
+    in constant time without asking the database to sort the whole table.
+    The position of every id in the array is indexed, so ids can be removed in constant time too.
+    """
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: maximum number of ids to hold in memory, the sampler is disabled if the pool is bigger
+        """
+        self._max_size = max_size
+        self._ids = array('q')
+        self._positions = {}
+        self._enabled = False
+        self._lock = Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """
+        :return: True if the sampler holds the complete id set and can be used, false otherwise
+        """
+        return self._enabled
+
+    def __len__(self):
+        return len(self._ids)
+
+    def load(self, entity_ids: Iterable[int]) -> None:
+        """
+        (Re-)Initializes the sampler with the given ids
+        :param entity_ids: all existing entity ids
+        """
+        ids = array('q')
+        positions = {}
+        for entity_id in entity_ids:
+            if entity_id in positions:
+                continue
+            if len(ids) >= self._max_size:
+                LOGGER.info("Image pool exceeds {} entries, random sampler disabled".format(self._max_size))
+                self.disable()
+                return
+            positions[entity_id] = len(ids)
+            ids.append(entity_id)
+
+        with self._lock:
+            self._ids = ids
+            self._positions = positions
+            self._enabled = True
+        LOGGER.debug("Random sampler loaded {} image ids".format(len(ids)))
+
+    def disable(self) -> None:
+        """
+        Disables the sampler and frees its memory
+        """
+        with self._lock:
+            self._ids = array('q')
+            self._positions = {}
+            self._enabled = False
+
+    def can_enable(self, pool_size: int) -> bool:
+        """
+        :param pool_size: current number of entities
+        :return: True if the sampler is disabled, but the pool has become small enough to load it again
+        """
+        return not self._enabled and pool_size <= self._max_size * REENABLE_RATIO
+
+    def add(self, entity_id: int) -> None:
+        """
+        Adds an id to the sampler
+        :param entity_id: the new entity id
+        """
+        with self._lock:
+            if not self._enabled or entity_id in self._positions:
+                return
+            if len(self._ids) >= self._max_size:
+                LOGGER.info("Image pool exceeds {} entries, random sampler disabled".format(self._max_size))
+                self._ids = array('q')
+                self._positions = {}
+                self._enabled = False
+                return
+            self._positions[entity_id] = len(self._ids)
+            self._ids.append(entity_id)
+
+    def remove(self, entity_id: int) -> None:
+        """
+        Removes an id from the sampler, the last element is moved into the freed slot to keep the array dense.
+        :param entity_id: the removed entity id
+        """
+        with self._lock:
+            if not self._enabled:
+                return
+            index = self._positions.pop(entity_id, None)
+            if index is None:
+                return
+            last = self._ids.pop()
+            if index < len(self._ids):
+                self._ids[index] = last
+                self._positions[last] = index
+
+    def sample(self, count: int) -> List[int]:
+        """
+        Selects random ids without duplicates
+        :param count: number of ids to select
+        :return: list of random ids (may be shorter than count if the pool is smaller)
+        """
+        with self._lock:
+            size = len(self._ids)
+            if size <= 0:
+                return []
+            indices = random.sample(range(size), min(count, size))
+            return [self._ids[i] for i in indices]
@@ -0,0 +1,304 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+from typing import Iterable, Iterator, Dict, Set, Tuple, List
+
+from infinitewisdom.persistence import ImageDataPersistence
+from infinitewisdom.persistence.image_data.factory import create_image_data_backend
+from infinitewisdom.persistence.sqlalchemy import _session_scope
+from infinitewisdom.stats import IMAGE_DATA_SCRUB_FILES, IMAGE_DATA_SCRUB_BYTES, IMAGE_DATA_SCRUB_TIME
+from infinitewisdom.util import create_hash, download_image
+
+LOGGER = logging.getLogger(__name__)
+
+RESULT_VALID = "valid"
+RESULT_CORRUPT = "corrupt"
+RESULT_ORPHANED = "orphaned"
+RESULT_MISSING = "missing"
+
+PROGRESS_INTERVAL = 10000
+
+# image data backend of a scrubber worker process
+_worker_store = None
+
+
+def _init_worker(backend_settings: dict) -> None:
+    """
+    Opens the image data backend of a worker process
+    :param backend_settings: keyword arguments for create_image_data_backend
+    """
+    global _worker_store
+    _worker_store = create_image_data_backend(**backend_settings)
+
+
+def _verify_batch(image_hashes: List[str]) -> List[Tuple[str, int or None, bool]]:
+    """
+    Hashes the stored data of the given hashes in a worker process
+    :param image_hashes: the hashes to check
+    :return: list of (hash, size in bytes or None if the data vanished, valid) tuples
+    """
+    result = []
+    for image_hash in image_hashes:
+        buffer = _worker_store.get_buffer(image_hash)
+        if buffer is None:
+            result.append((image_hash, None, False))
+            continue
+        try:
+            result.append((image_hash, len(buffer), create_hash(buffer) == image_hash))
+        finally:
+            if isinstance(buffer, memoryview):
+                buffer.release()
+    return result
+
+
+def _batched(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if len(batch) <= 0:
+            return
+        yield batch
+
+
+class ScrubReport:
+    """
+    Result of a scrubber run
+    """
+
+    def __init__(self):
+        self.checked = 0
+        self.bytes = 0
+        self.corrupt = []
+        self.orphaned = []
+        self.missing = []
+        self.repaired = 0
+        self.duration = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.checked / self.duration if self.duration > 0 else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.duration if self.duration > 0 else 0.0
+
+    def __str__(self):
+        return "\n".join([
+            "Checked: {} files ({} bytes)".format(self.checked, self.bytes),
+            "Corrupt: {}".format(len(self.corrupt)),
+            "Orphaned: {}".format(len(self.orphaned)),
+            "Missing: {}".format(len(self.missing)),
+            "Repaired: {}".format(self.repaired),
+            "Duration: {:.1f}s ({:.1f} files/s, {:.1f} MiB/s)".format(self.duration, self.files_per_second,
+                                                                      self.bytes_per_second / (1024 * 1024)),
+        ])
+
+
+class ImageDataScrubber:
+    """
+    Compares the image data store with the database and verifies the content of all stored entries.
+    The store is walked while the database is read in a separate thread, hashing is done in a process pool.
+    Finds:
+    - corrupt data, whose content does not match its hash
+    - orphaned data, that no entity references
+    - missing data, of entities whose hash is not in the store
+    """
+
+    def __init__(self, persistence: ImageDataPersistence, workers: int = None, batch_size: int = 64,
+                 download_workers: int = 8):
+        """
+        :param persistence: the persistence to check
+        :param workers: number of hashing processes, defaults to the number of CPUs
+        :param batch_size: number of entries hashed per task
+        :param download_workers: number of threads used to download missing image data when repairing
+        """
+        self._persistence = persistence
+        self._workers = workers or os.cpu_count() or 1
+        self._batch_size = batch_size
+        self._download_workers = download_workers
+
+    @IMAGE_DATA_SCRUB_TIME.time()
+    def run(self, repair: bool = False) -> ScrubReport:
+        """
+        Checks the whole store
+        :param repair: if True, corrupt and orphaned data is removed and missing data is downloaded again
+        (entities whose image can not be downloaded anymore are removed)
+        :return: the report
+        """
+        report = ScrubReport()
+        start = time.time()
+
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="scrubber-db") as executor:
+            database_future = executor.submit(self._load_database_hashes)
+            stored = self._verify_store(report)
+            referenced = database_future.result()
+
+        report.orphaned = sorted(stored.difference(referenced.keys()))
+        corrupt = set(report.corrupt)
+        store = self._persistence.image_data_store
+        # data that has been written after the store listing has been taken is not missing
+        report.missing = sorted([entity_id for image_hash, entity_id in referenced.items()
+                                 if image_hash in corrupt
+                                 or (image_hash not in stored and not store.exists(image_hash))])
+        IMAGE_DATA_SCRUB_FILES.labels(result=RESULT_ORPHANED).inc(len(report.orphaned))
+        IMAGE_DATA_SCRUB_FILES.labels(result=RESULT_MISSING).inc(len(report.missing))
+
+        if repair:
+            report.repaired += self._remove_corrupt(report.corrupt)
+            report.repaired += self._remove_orphaned([x for x in report.orphaned if x not in corrupt])
+            report.repaired += self._restore_missing(report.missing)
+
+        report.duration = time.time() - start
+        LOGGER.info("Image data scrub finished:\n{}".format(report))
+        return report
+
+    def _load_database_hashes(self) -> Dict[str, int]:
+        """
+        :return: image hash -> entity id of all entities with image data
+        """
+        result = {}
+        with _session_scope(False) as session:
+            for entity_id, image_hash in self._persistence.get_all_image_hashes(session):
+                if image_hash is not None:
+                    result[image_hash] = entity_id
+        LOGGER.debug("Loaded {} image hashes from the database".format(len(result)))
+        return result
+
+    def _verify_store(self, report: ScrubReport) -> Set[str]:
+        """
+        Hashes all entries of the store
+        :param report: the report to fill
+        :return: hashes of all stored entries
+        """
+        stored = set()
+        backend_settings = self._persistence.image_data_backend_settings
+        # the workers read from the backend directly, caching would only waste their memory
+        backend_settings["cache_size"] = 0
+        # the store is written by the main process only
+        backend_settings["read_only"] = True
+
+        # spawn, to not fork while the database thread is running
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=self._workers, mp_context=context, initializer=_init_worker,
+                                 initargs=(backend_settings,)) as pool:
+            pending = set()
+            next_progress = PROGRESS_INTERVAL
+            for batch in _batched(self._persistence.image_data_store.iterate(), self._batch_size):
+                pending.add(pool.submit(_verify_batch, batch))
+                # limit the number of queued batches to not hold the whole store listing in memory
+                if len(pending) >= self._workers * 4:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    self._collect(done, report, stored)
+                    if report.checked >= next_progress:
+                        LOGGER.info("Scrubbed {} files ({} bytes)".format(report.checked, report.bytes))
+                        next_progress += PROGRESS_INTERVAL
+            done, _ = wait(pending)
+            self._collect(done, report, stored)
+
+        return stored
+
+    def _collect(self, futures, report: ScrubReport, stored: Set[str]) -> None:
+        for future in futures:
+            for image_hash, size, valid in future.result():
+                if size is None:
+                    size, valid = self._verify_locally(image_hash)
+                if size is None:
+                    # removed while the scrubber was running
+                    continue
+                stored.add(image_hash)
+                report.checked += 1
+                report.bytes += size
+                IMAGE_DATA_SCRUB_BYTES.inc(size)
+                if valid:
+                    IMAGE_DATA_SCRUB_FILES.labels(result=RESULT_VALID).inc()
+                else:
+                    LOGGER.warning("Corrupt image data: {}".format(image_hash))
+                    IMAGE_DATA_SCRUB_FILES.labels(result=RESULT_CORRUPT).inc()
+                    report.corrupt.append(image_hash)
+
+    def _verify_locally(self, image_hash: str) -> Tuple[int or None, bool]:
+        """
+        Hashes data that a worker process did not find using the store of this process
+        :param image_hash: the hash to check
+        :return: size in bytes or None if the data vanished, valid
+        """
+        buffer = self._persistence.image_data_store.get_buffer(image_hash)
+        if buffer is None:
+            return None, False
+        try:
+            return len(buffer), create_hash(buffer) == image_hash
+        finally:
+            if isinstance(buffer, memoryview):
+                buffer.release()
+
+    def _remove_corrupt(self, image_hashes: [str]) -> int:
+        store = self._persistence.image_data_store
+        for image_hash in image_hashes:
+            store.delete(image_hash)
+            LOGGER.info("Removed corrupt image data: {}".format(image_hash))
+        return len(image_hashes)
+
+    def _remove_orphaned(self, image_hashes: [str]) -> int:
+        store = self._persistence.image_data_store
+        removed = 0
+        for image_hash in image_hashes:
+            with _session_scope(False) as session:
+                # the crawler stores image data before the entity, so check again
+                if self._persistence.find_by_image_hash(session, image_hash) is not None:
+                    continue
+            store.delete(image_hash)
+            removed += 1
+            LOGGER.info("Removed orphaned image data: {}".format(image_hash))
+        return removed
+
+    def _restore_missing(self, entity_ids: [int]) -> int:
+        with ThreadPoolExecutor(max_workers=self._download_workers,
+                                thread_name_prefix="scrubber-download") as executor:
+            return sum(executor.map(self._restore, entity_ids))
+
+    def _restore(self, entity_id: int) -> bool:
+        """
+        Downloads the image data of an entity again, the entity is removed if that is not possible
+        :param entity_id: the entity id
+        :return: True if the entity has been repaired or removed
+        """
+        store = self._persistence.image_data_store
+        try:
+            with _session_scope() as session:
+                entity = self._persistence.get_image(session, entity_id)
+                if entity is None or store.exists(entity.image_hash):
+                    return False
+
+                with self._persistence.stage_image_data() as image_data:
+                    try:
+                        download_image(entity.url, image_data)
+                    except Exception as e:
+                        LOGGER.warning("Removing entity whose image can not be downloaded: {} ({})".format(
+                            entity.url, e))
+                        self._persistence.delete(session, entity)
+                        return True
+
+                    self._persistence.update(session, entity, image_data)
+                LOGGER.info("Restored image data: {}".format(entity.url))
+                return True
+        except Exception as e:
+            LOGGER.error("Error restoring image data of entity {}: {}".format(entity_id, e))
+            return False
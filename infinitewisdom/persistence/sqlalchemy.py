@@ -14,13 +14,15 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 import logging
+import random
+import re
 import time
-from collections import Counter
 from contextlib import contextmanager
 from datetime import datetime
-from typing import List
+from typing import Iterator, Dict, Set, Tuple
 
-from sqlalchemy import create_engine, Column, Integer, String, Float, func, and_, ForeignKey, Table
+from sqlalchemy import create_engine, Column, Integer, String, Float, func, and_, ForeignKey, Table, Index, \
+    inspect, exists, select, null, text as sql_text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
 
@@ -34,7 +36,8 @@ Base = declarative_base()
 association_table = Table(
     'association', Base.metadata,
     Column('bot_token_id', Integer, ForeignKey('bot_tokens.id')),
-    Column('telegram_file_id_id', String, ForeignKey('telegram_file_ids.id'))
+    Column('telegram_file_id_id', String, ForeignKey('telegram_file_ids.id')),
+    Index('ix_association_telegram_file_id_id_bot_token_id', 'telegram_file_id_id', 'bot_token_id')
 )
 
 
@@ -65,6 +68,7 @@ class Image(Base):
     analyser_quality = Column(Float)
     created = Column(Float)
     image_hash = Column(String, index=True)
+    perceptual_hash = Column(String)
     telegram_file_ids = relationship("TelegramFileId",
                                      back_populates="image",
                                      single_parent=True,
@@ -77,6 +81,7 @@ class Image(Base):
              "URL: {}".format(self.url),
              "Telegram file ids: [{}]".format(", ".join(list(map(lambda x: x.id, self.telegram_file_ids)))),
              "Hash: {}".format(self.image_hash),
+             "Perceptual hash: {}".format(self.perceptual_hash),
              "Analyser: {}".format(self.analyser),
              "Analyser quality: {}".format(self.analyser_quality),
              "Text: `{}`".format(self.text)])
@@ -110,7 +115,7 @@ class TelegramFileId(Base):
     __tablename__ = 'telegram_file_ids'
 
     id = Column(String, primary_key=True)
-    image_id = Column(Integer, ForeignKey('images.id'))
+    image_id = Column(Integer, ForeignKey('images.id'), index=True)
     bot_tokens = relationship("BotToken",
                               secondary=association_table,
                               back_populates="telegram_file_ids",
@@ -118,6 +123,20 @@ class TelegramFileId(Base):
     image = relationship("Image", back_populates="telegram_file_ids")
 
 
+class ImageRecord:
+    """
+    Lightweight read-only projection of a single quote for a specific bot
+    """
+    __slots__ = ['id', 'image_hash', 'url', 'text', 'telegram_file_id']
+
+    def __init__(self, id: int, image_hash: str, url: str, text: str or None, telegram_file_id: str or None):
+        self.id = id
+        self.image_hash = image_hash
+        self.url = url
+        self.text = text
+        self.telegram_file_id = telegram_file_id
+
+
 _sessionmaker = sessionmaker()
 
 
@@ -152,6 +171,10 @@ class SQLAlchemyPersistence:
         engine = create_engine(url)
         _sessionmaker.configure(bind=engine)
 
+        self._text_search_dialect = self._detect_text_search_dialect(engine)
+        if self._text_search_dialect is None:
+            LOGGER.warning("No full text search index available, falling back to slow text search")
+
         with _session_scope() as session:
             LOGGER.debug("SQLAlchemy persistence loaded: {} entities".format(self.count(session)))
 
@@ -166,6 +189,29 @@ class SQLAlchemyPersistence:
 
         alembic.command.upgrade(config, 'head')
 
+    @staticmethod
+    def _detect_text_search_dialect(engine) -> str or None:
+        """
+        :return: the name of the dialect if the full text search index created by alembic is available, None otherwise
+        """
+        dialect = engine.dialect.name
+        if dialect == 'postgresql':
+            # expression indexes are not reflected by the inspector
+            with engine.connect() as connection:
+                index = connection.execute(
+                    sql_text("SELECT 1 FROM pg_indexes WHERE tablename = 'images' AND indexname = :name"),
+                    {"name": "ix_images_text_fts"}).first()
+            if index is not None:
+                return dialect
+        if dialect == 'sqlite' and 'images_fts' in inspect(engine).get_table_names():
+            return dialect
+        return None
+
+    @staticmethod
+    def find_bot_token_id(session: Session, bot_token: str) -> int or None:
+        hashed_bot_token = cryptographic_hash(bot_token)
+        return session.query(BotToken.id).filter_by(hashed_token=hashed_bot_token).scalar()
+
     @staticmethod
     def get_or_add_bot_token(session: Session, bot_token: str) -> BotToken:
         hashed_bot_token = cryptographic_hash(bot_token)
@@ -182,10 +228,107 @@ class SQLAlchemyPersistence:
     def get(session: Session, entity_id: int):
         return session.query(Image).get(entity_id)
 
+    @staticmethod
+    def get_by_ids(session: Session, entity_ids: [int]) -> [Image]:
+        if len(entity_ids) <= 0:
+            return []
+        entities = {e.id: e for e in session.query(Image).filter(Image.id.in_(entity_ids)).all()}
+        # keep the order of the given ids
+        return [entities[entity_id] for entity_id in entity_ids if entity_id in entities]
+
+    @staticmethod
+    def get_records_by_ids(session: Session, entity_ids: [int], bot_token_id: int or None) -> [ImageRecord]:
+        if len(entity_ids) <= 0:
+            return []
+
+        if bot_token_id is None:
+            file_id = null()
+        else:
+            file_id = select([TelegramFileId.id]).select_from(
+                TelegramFileId.__table__.join(
+                    association_table, association_table.c.telegram_file_id_id == TelegramFileId.id)
+            ).where(and_(
+                TelegramFileId.image_id == Image.id,
+                association_table.c.bot_token_id == bot_token_id
+            )).limit(1).correlate(Image.__table__).as_scalar()
+
+        rows = session.query(Image.id, Image.image_hash, Image.url, Image.text, file_id).filter(
+            Image.id.in_(entity_ids)).all()
+        records = {row[0]: ImageRecord(*row) for row in rows}
+        # keep the order of the given ids
+        return [records[entity_id] for entity_id in entity_ids if entity_id in records]
+
+    @staticmethod
+    def get_file_ids_of_bot(session: Session, bot_token_id: int) -> Iterator[tuple]:
+        query = session.query(TelegramFileId.image_id, TelegramFileId.id).join(
+            association_table, association_table.c.telegram_file_id_id == TelegramFileId.id).filter(
+            association_table.c.bot_token_id == bot_token_id).execution_options(stream_results=True).yield_per(10000)
+        return map(tuple, query)
+
+    @staticmethod
+    def add_telegram_file_ids(session: Session, bot_token_id: int, file_ids: Dict[int, Set[str]]) -> [int]:
+        """
+        Inserts telegram file ids and their bot token association in bulk, skipping existing rows
+        :param bot_token_id: id of the BotToken entity
+        :param file_ids: image id -> file ids
+        :return: ids of images that did not have any file id for this bot token before
+        """
+        image_ids = set(map(lambda x: x[0], session.query(Image.id).filter(Image.id.in_(list(file_ids.keys())))))
+        # the same file id might be reported for multiple images, the first one wins
+        file_id_images = {}
+        for image_id in image_ids:
+            for file_id in file_ids[image_id]:
+                file_id_images.setdefault(file_id, image_id)
+        if len(file_id_images) <= 0:
+            return []
+
+        known_file_ids = set(map(lambda x: x[0], session.query(TelegramFileId.id).filter(
+            TelegramFileId.id.in_(list(file_id_images.keys())))))
+        associated_file_ids = set(map(lambda x: x[0], session.query(association_table.c.telegram_file_id_id).filter(
+            and_(association_table.c.bot_token_id == bot_token_id,
+                 association_table.c.telegram_file_id_id.in_(list(file_id_images.keys()))))))
+        uploaded_image_ids = set(map(lambda x: x[0], session.query(TelegramFileId.image_id).join(
+            association_table, association_table.c.telegram_file_id_id == TelegramFileId.id).filter(
+            and_(association_table.c.bot_token_id == bot_token_id,
+                 TelegramFileId.image_id.in_(list(image_ids)))).distinct()))
+
+        new_file_ids = [{"id": file_id, "image_id": image_id}
+                        for file_id, image_id in file_id_images.items() if file_id not in known_file_ids]
+        new_associations = [{"bot_token_id": bot_token_id, "telegram_file_id_id": file_id}
+                            for file_id in file_id_images.keys() if file_id not in associated_file_ids]
+        if len(new_file_ids) > 0:
+            session.execute(TelegramFileId.__table__.insert(), new_file_ids)
+        if len(new_associations) > 0:
+            session.execute(association_table.insert(), new_associations)
+
+        return [image_id for image_id in set(file_id_images.values()) if image_id not in uploaded_image_ids]
+
     @staticmethod
     def get_all(session: Session) -> [Image]:
         return session.query(Image).order_by(Image.created.desc()).all()
 
+    @staticmethod
+    def get_all_ids(session: Session) -> Iterator[int]:
+        query = session.query(Image.id).execution_options(stream_results=True).yield_per(10000)
+        return map(lambda x: x[0], query)
+
+    @staticmethod
+    def get_all_image_hashes(session: Session) -> Iterator[Tuple[int, str]]:
+        query = session.query(Image.id, Image.image_hash).execution_options(stream_results=True).yield_per(10000)
+        return map(lambda x: (x[0], x[1]), query)
+
+    @staticmethod
+    def get_all_urls(session: Session, min_id: int = 0) -> Iterator[Tuple[int, str]]:
+        query = session.query(Image.id, Image.url).filter(Image.id > min_id) \
+            .execution_options(stream_results=True).yield_per(10000)
+        return map(lambda x: (x[0], x[1]), query)
+
+    @staticmethod
+    def get_all_perceptual_hashes(session: Session) -> Iterator[Tuple[str, int]]:
+        query = session.query(Image.perceptual_hash, Image.id).filter(Image.perceptual_hash.isnot(None)) \
+            .execution_options(stream_results=True).yield_per(10000)
+        return map(lambda x: (x[0], x[1]), query)
+
     @staticmethod
     def add_all(session: Session, entities: [Image]):
         session.add_all(entities)
@@ -197,13 +340,35 @@ class SQLAlchemyPersistence:
         session.refresh(image)
         return image
 
-    @staticmethod
-    def get_random(session: Session, page_size: int = None) -> Image or [Image]:
-        query = session.query(Image).order_by(func.random()).limit(page_size)
+    def get_random(self, session: Session, page_size: int = None) -> Image or [Image]:
+        count = 1 if page_size is None else page_size
+        entities = self.get_by_ids(session, self.get_random_ids(session, count))
         if page_size is None:
-            return query.first()
+            return entities[0] if len(entities) > 0 else None
         else:
-            return query.all()
+            return entities
+
+    @staticmethod
+    def get_random_ids(session: Session, count: int) -> [int]:
+        """
+        Selects random ids using the primary key index only.
+        A random value between the lowest and the highest id is picked and the next existing id
+        is used, so the cost does not depend on the size of the table.
+        Ids following a gap are slightly more likely to be picked.
+        """
+        min_id, max_id = session.query(func.min(Image.id), func.max(Image.id)).one()
+        if min_id is None:
+            return []
+
+        result = []
+        attempts = 0
+        while len(result) < count and attempts < count * 3:
+            attempts += 1
+            pivot = random.randint(min_id, max_id)
+            entity_id = session.query(Image.id).filter(Image.id >= pivot).order_by(Image.id).limit(1).scalar()
+            if entity_id is not None and entity_id not in result:
+                result.append(entity_id)
+        return result
 
     @staticmethod
     def find_by_image_hash(session: Session, image_hash: str) -> Image or None:
@@ -212,19 +377,51 @@ class SQLAlchemyPersistence:
     def find_by_url(self, session: Session, url: str) -> [Image]:
         return session.query(Image).filter_by(url=url).all()
 
+    @staticmethod
+    def has_url(session: Session, url: str) -> bool:
+        return session.query(exists().where(Image.url == url)).scalar()
+
     @staticmethod
     def find_by_telegram_file_id(session: Session, telegram_file_id: str) -> [Image]:
         return session.query(Image).filter(Image.telegram_file_ids.any(id=telegram_file_id)).first()
 
-    @staticmethod
-    def find_by_text(session: Session, text: str = None, limit: int = None, offset: int = None) -> [Image]:
+    def find_by_text(self, session: Session, text: str = None, limit: int = None, offset: int = None) -> [Image]:
+        return self.get_by_ids(session, self.find_ids_by_text(session, text, limit, offset))
+
+    def find_ids_by_text(self, session: Session, text: str = None, limit: int = None,
+                         offset: int = None) -> [int]:
+        """
+        Finds the ids of all entities containing words starting with each of the words in the given text,
+        ordered by relevance
+        """
         if limit is None:
             limit = 16
+        if offset is None:
+            offset = 0
 
-        words = text.split(" ")
+        words = re.findall(r"\w+", text or "")
+        if len(words) <= 0:
+            return []
+
+        if self._text_search_dialect == 'sqlite':
+            match = " ".join(map(lambda word: '"{}"*'.format(word), words))
+            rows = session.execute(
+                sql_text("SELECT rowid FROM images_fts WHERE images_fts MATCH :match "
+                         "ORDER BY rank LIMIT :limit OFFSET :offset"),
+                {"match": match, "limit": limit, "offset": offset})
+            return [row[0] for row in rows]
+
+        if self._text_search_dialect == 'postgresql':
+            # this expression has to match the index created by alembic
+            vector = func.to_tsvector('simple', func.coalesce(Image.text, ''))
+            query = func.to_tsquery('simple', " & ".join(map(lambda word: "{}:*".format(word), words)))
+            rows = session.query(Image.id).filter(vector.op('@@')(query)).order_by(
+                func.ts_rank(vector, query).desc(), Image.id).limit(limit).offset(offset)
+            return [row[0] for row in rows]
 
         filters = list(map(lambda word: Image.text.ilike("%{}%".format(word)), words))
-        return session.query(Image).filter(and_(*filters)).limit(limit).offset(offset).all()
+        rows = session.query(Image.id).filter(and_(*filters)).order_by(Image.id).limit(limit).offset(offset)
+        return [row[0] for row in rows]
 
     def find_all_non_optimal(self, session: Session, target_quality: int, limit: int = None) -> [Image]:
         never_analysed = session.query(Image.id).filter(Image.analyser_quality.is_(None)).order_by(
@@ -242,29 +439,18 @@ class SQLAlchemyPersistence:
         return never_analysed + improvement_possible
 
     @staticmethod
-    def get_not_uploaded_image_ids(session: Session, bot_token: str) -> List[int]:
+    def get_not_uploaded_image_ids(session: Session, bot_token: str) -> Iterator[int]:
         hashed_bot_token = cryptographic_hash(bot_token)
-        image_ids = session.query(Image.id).all()
         bot_token_entity = session.query(BotToken).filter_by(hashed_token=hashed_bot_token).first()
         if bot_token_entity is None:
-            return []
-        uploaded_image_ids = set(map(lambda x: x.image_id, bot_token_entity.telegram_file_ids))
-
-        x = image_ids
-        y = uploaded_image_ids
-        remaining = Counter(y)
+            return iter([])
 
-        # out would be the full substraction
-        out = []
-        for val in x:
-            if remaining[val]:
-                remaining[val] -= 1
-            else:
-                out.append(val)
-
-        # TODO: this still takes about 30 seconds and shifts part of the load to the client,
-        #  but its the best we have now
-        return out
+        uploaded = exists().where(and_(
+            TelegramFileId.image_id == Image.id,
+            association_table.c.telegram_file_id_id == TelegramFileId.id,
+            association_table.c.bot_token_id == bot_token_entity.id))
+        query = session.query(Image.id).filter(~uploaded).execution_options(stream_results=True).yield_per(10000)
+        return map(lambda x: x[0], query)
 
     @staticmethod
     def count(session: Session) -> int:
@@ -286,8 +472,13 @@ class SQLAlchemyPersistence:
     def delete(session: Session, entity_id: int) -> None:
         session.query(Image).filter_by(id=entity_id).delete()
 
-    def clear(self) -> None:
-        raise NotImplementedError()
+    @staticmethod
+    def clear(session: Session) -> None:
+        # bulk deletes in dependency order, bot tokens are kept
+        session.execute(association_table.delete())
+        session.query(TelegramFileId).delete(synchronize_session=False)
+        session.query(Image).delete(synchronize_session=False)
+        session.commit()
 
     @staticmethod
     def count_items_with_telegram_upload(session: Session, bot_token: str) -> int:
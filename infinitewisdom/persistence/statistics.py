@@ -0,0 +1,190 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import logging
+from collections import Counter
+from threading import Lock
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, sessionmaker
+
+from infinitewisdom import RegularIntervalWorker
+from infinitewisdom.persistence.sqlalchemy import Image, TelegramFileId, _session_scope
+from infinitewisdom.stats import POOL_SIZE, ENTITIES_WITH_IMAGE_DATA_COUNT, TELEGRAM_ENTITIES_COUNT, \
+    IMAGE_ANALYSIS_TYPE_COUNT, IMAGE_ANALYSIS_HAS_TEXT_COUNT
+from infinitewisdom.util import cryptographic_hash
+
+LOGGER = logging.getLogger(__name__)
+
+KEY_POOL_SIZE = "pool_size"
+KEY_WITH_IMAGE_DATA = "with_image_data"
+KEY_WITH_TELEGRAM_UPLOAD = "with_telegram_upload"
+KEY_WITH_TEXT = "with_text"
+KEY_ANALYSER = "analyser:{}"
+
+_SESSION_INFO_KEY = "statistics_delta"
+
+
+class PersistenceStatistics:
+    """
+    Holds the persistence related statistics and publishes them to prometheus.
+
+    When tracking is enabled the values are updated from the changes written by each session
+    instead of counting all rows of the database after every write.
+    Changes are collected before every flush and only applied when the transaction is committed.
+    """
+
+    def __init__(self, bot_token: str):
+        """
+        :param bot_token: the bot token used to count uploaded images
+        """
+        self._hashed_bot_token = cryptographic_hash(bot_token)
+        self._values = Counter()
+        self._lock = Lock()
+
+    def track(self, session_factory: sessionmaker) -> None:
+        """
+        Starts tracking changes of sessions created by the given factory
+        :param session_factory: the session factory
+        """
+        event.listen(session_factory, "before_flush", self._before_flush)
+        event.listen(session_factory, "after_commit", self._after_commit)
+        event.listen(session_factory, "after_soft_rollback", self._after_soft_rollback)
+
+    def reset(self, values: Counter) -> None:
+        """
+        Replaces all values with the given (counted) ones
+        :param values: the new values
+        """
+        with self._lock:
+            self._values = Counter(values)
+            self._publish()
+
+    def record_delete(self, session: Session, entity: Image) -> None:
+        """
+        Records the removal of an entity that is deleted without using the session unit of work
+        :param session: the session the entity is deleted in
+        :param entity: the entity to remove
+        """
+        delta = session.info.setdefault(_SESSION_INFO_KEY, Counter())
+        delta.subtract(self._snapshot(entity, committed=True))
+
+    def record_uploads(self, session: Session, count: int) -> None:
+        """
+        Records images that have been uploaded using bulk inserts, which are not seen by the session unit of work
+        :param session: the session the file ids are inserted in
+        :param count: number of images that have been uploaded by the current bot for the first time
+        """
+        delta = session.info.setdefault(_SESSION_INFO_KEY, Counter())
+        delta[KEY_WITH_TELEGRAM_UPLOAD] += count
+
+    def _before_flush(self, session: Session, flush_context, instances) -> None:
+        images = set()
+        for obj in session.new | session.dirty | session.deleted:
+            if isinstance(obj, Image):
+                images.add(obj)
+            elif isinstance(obj, TelegramFileId) and obj.image is not None:
+                images.add(obj.image)
+
+        delta = session.info.setdefault(_SESSION_INFO_KEY, Counter())
+        for image in images:
+            if image not in session.new:
+                delta.subtract(self._snapshot(image, committed=True))
+            if image not in session.deleted:
+                delta.update(self._snapshot(image, committed=False))
+
+    def _after_commit(self, session: Session) -> None:
+        delta = session.info.pop(_SESSION_INFO_KEY, None)
+        if delta is None:
+            return
+        with self._lock:
+            self._values.update(delta)
+            self._publish()
+
+    @staticmethod
+    def _after_soft_rollback(session: Session, previous_transaction) -> None:
+        session.info.pop(_SESSION_INFO_KEY, None)
+
+    def _snapshot(self, image: Image, committed: bool) -> Counter:
+        """
+        Determines the contribution of a single image to the statistics
+        :param image: the image entity
+        :param committed: True to use the state as last loaded from the database,
+                          False to use the (possibly modified) current state
+        :return: counter with the statistic keys this image contributes to
+        """
+        state = inspect(image)
+        image_hash = self._values_of(state, "image_hash", committed)
+        analyser = self._values_of(state, "analyser", committed)
+        text = self._values_of(state, "text", committed)
+        file_ids = self._values_of(state, "telegram_file_ids", committed)
+
+        result = Counter({KEY_POOL_SIZE: 1})
+        if len(image_hash) > 0 and image_hash[0] is not None:
+            result[KEY_WITH_IMAGE_DATA] = 1
+        if len(analyser) > 0 and analyser[0] is not None:
+            result[KEY_ANALYSER.format(analyser[0])] = 1
+        if len(text) > 0 and text[0] is not None and len(text[0]) > 0:
+            result[KEY_WITH_TEXT] = 1
+        if self._is_uploaded(file_ids, committed):
+            result[KEY_WITH_TELEGRAM_UPLOAD] = 1
+        return result
+
+    def _is_uploaded(self, file_ids: [TelegramFileId], committed: bool) -> bool:
+        for file_id in file_ids:
+            bot_tokens = self._values_of(inspect(file_id), "bot_tokens", committed)
+            if any(map(lambda x: x.hashed_token == self._hashed_bot_token, bot_tokens)):
+                return True
+        return False
+
+    @staticmethod
+    def _values_of(state, key: str, committed: bool) -> list:
+        """
+        :return: the committed or current value(s) of the given attribute as a list
+        """
+        history = state.attrs[key].load_history()
+        if committed:
+            return list(history.unchanged) + list(history.deleted)
+        else:
+            return list(history.unchanged) + list(history.added)
+
+    def _publish(self):
+        POOL_SIZE.set(self._values[KEY_POOL_SIZE])
+        ENTITIES_WITH_IMAGE_DATA_COUNT.set(self._values[KEY_WITH_IMAGE_DATA])
+        TELEGRAM_ENTITIES_COUNT.set(self._values[KEY_WITH_TELEGRAM_UPLOAD])
+        IMAGE_ANALYSIS_HAS_TEXT_COUNT.set(self._values[KEY_WITH_TEXT])
+        for key, value in self._values.items():
+            if key.startswith(KEY_ANALYSER.format("")):
+                analyser = key[len(KEY_ANALYSER.format("")):]
+                IMAGE_ANALYSIS_TYPE_COUNT.labels(type=analyser).set(value)
+
+
+class StatisticsReconciler(RegularIntervalWorker):
+    """
+    Worker that regularly recounts all persistence statistics to correct
+    any drift of the incrementally tracked values.
+    """
+
+    def __init__(self, interval: float, persistence):
+        """
+        :param interval: reconciliation interval in seconds
+        :param persistence: the ImageDataPersistence to reconcile
+        """
+        super().__init__(interval)
+        self._persistence = persistence
+
+    def _run(self):
+        with _session_scope(False) as session:
+            self._persistence.update_stats(session)
@@ -45,9 +45,46 @@ CRAWLER_TIME = REGULAR_INTERVAL_WORKER_TIME.labels(name="crawler")
 UPLOADER_TIME = REGULAR_INTERVAL_WORKER_TIME.labels(name="uploader")
 ANALYSER_TIME = REGULAR_INTERVAL_WORKER_TIME.labels(name="analyser")
 
+CRAWLER_NEAR_DUPLICATES = Counter('crawler_near_duplicates',
+                                  'Number of crawled images that have been skipped because a similar image exists')
+
+CRAWLER_IN_FLIGHT = Gauge('crawler_in_flight', 'Number of images the crawler is currently fetching or processing')
+CRAWLER_THROUGHPUT = Gauge('crawler_throughput', 'Number of images added by the crawler per second (last minute)')
+CRAWLER_NOVELTY_RATIO = Gauge('crawler_novelty_ratio', 'Ratio of new images among the recently crawled images')
+CRAWLER_EFFECTIVE_RATE = Gauge('crawler_effective_rate',
+                               'Number of image api requests per second the crawler is currently adjusted to')
+CRAWLER_STAGE_QUEUE_LENGTH = Gauge('crawler_stage_queue_length',
+                                   'Number of items waiting for a stage of the asyncio crawl pipeline', ['stage'])
+CRAWLER_STAGE_PROCESSED = Counter('crawler_stage_processed',
+                                  'Number of items processed by a stage of the asyncio crawl pipeline', ['stage'])
+
 UPLOADER_QUEUE_LENGTH = Gauge('uploader_queue_length',
                               'Number of entity ids in the uploader worker queue')
 
+TELEGRAM_FILE_ID_BUFFER_LENGTH = Gauge('telegram_file_id_buffer_length',
+                                       'Number of images with telegram file ids waiting to be saved')
+
+IMAGE_DATA_CACHE_HITS = Counter('image_data_cache_hits', 'Number of image data reads served from memory')
+IMAGE_DATA_CACHE_MISSES = Counter('image_data_cache_misses', 'Number of image data reads that missed the cache')
+IMAGE_DATA_CACHE_EVICTIONS = Counter('image_data_cache_evictions',
+                                     'Number of image data entries evicted from the cache')
+IMAGE_DATA_CACHE_SIZE = Gauge('image_data_cache_size_bytes', 'Number of bytes held by the image data cache')
+
+IMAGE_DATA_SCRUB_FILES = Counter('image_data_scrub_files', 'Number of image data entries checked by the scrubber',
+                                 ['result'])
+IMAGE_DATA_SCRUB_BYTES = Counter('image_data_scrub_bytes', 'Number of image data bytes hashed by the scrubber')
+IMAGE_DATA_SCRUB_TIME = Summary('image_data_scrub_processing_seconds', 'Time spent for a full image data scrub')
+
+HTTP_REQUESTS = Counter('http_requests', 'Number of outbound HTTP requests', ['host', 'status'])
+HTTP_REQUEST_TIME = Summary('http_request_seconds', 'Time spent for outbound HTTP requests (including retries)',
+                            ['host'])
+HTTP_RETRIES = Counter('http_retries', 'Number of retried outbound HTTP requests', ['host'])
+HTTP_POOL_CONNECTIONS_IN_USE = Gauge('http_pool_connections_in_use',
+                                     'Number of pooled HTTP connections that are currently in use', ['host'])
+HTTP_POOL_CONNECTIONS_CREATED = Gauge('http_pool_connections_created',
+                                      'Number of HTTP connections that have been opened by a connection pool',
+                                      ['host'])
+
 ANALYSER_FIND_TEXT_TIME = Summary('analyser_find_text_processing_seconds',
                                   'Time spent to find text for a given image',
                                   ['name'])
@@ -56,6 +93,19 @@ GOOGLE_VISION_FIND_TEXT_TIME = ANALYSER_FIND_TEXT_TIME.labels(name=IMAGE_ANALYSI
 MICROSOFT_AZURE_FIND_TEXT_TIME = ANALYSER_FIND_TEXT_TIME.labels(name=IMAGE_ANALYSIS_TYPE_AZURE)
 TESSERACT_FIND_TEXT_TIME = ANALYSER_FIND_TEXT_TIME.labels(name=IMAGE_ANALYSIS_TYPE_TESSERACT)
 
+ANALYSER_FIND_TEXT_BATCH_TIME = Summary('analyser_find_text_batch_processing_seconds',
+                                        'Time spent to find text for a batch of images',
+                                        ['name'])
+
+GOOGLE_VISION_FIND_TEXT_BATCH_TIME = ANALYSER_FIND_TEXT_BATCH_TIME.labels(name=IMAGE_ANALYSIS_TYPE_GOOGLE_VISION)
+MICROSOFT_AZURE_FIND_TEXT_BATCH_TIME = ANALYSER_FIND_TEXT_BATCH_TIME.labels(name=IMAGE_ANALYSIS_TYPE_AZURE)
+
+IMAGE_ANALYSIS_WORKER_BUSY_TIME = Counter('image_analysis_worker_busy_seconds',
+                                          'Time spent analysing images by each analysis process', ['worker'])
+IMAGE_ANALYSIS_WORKER_UTILIZATION = Gauge('image_analysis_worker_utilization',
+                                          'Ratio of time each analysis process spent analysing images (last minute)',
+                                          ['worker'])
+
 ANALYSER_CAPACITY = Gauge('analyser_remaining_monthly_capacity',
                           'Current capacity of a given analyser',
                           ['name'])
@@ -20,9 +20,10 @@ from telegram import Bot
 
 from infinitewisdom import RegularIntervalWorker
 from infinitewisdom.config.config import AppConfig
+from infinitewisdom.id_queue import IdQueue
 from infinitewisdom.persistence import ImageDataPersistence, _session_scope
 from infinitewisdom.stats import UPLOADER_TIME, UPLOADER_QUEUE_LENGTH
-from infinitewisdom.util import send_photo, download_image_bytes
+from infinitewisdom.util import send_photo, download_image
 
 LOGGER = logging.getLogger(__name__)
 
@@ -38,9 +39,8 @@ class TelegramUploader(RegularIntervalWorker):
         self._persistence = persistence
         self._bot = bot
         self._chat_id = config.UPLOADER_CHAT_ID.value
-
-        with _session_scope() as session:
-            self._not_uploaded_ids = set(self._persistence.get_not_uploaded_image_ids(session, self._bot.token))
+        self._not_uploaded_ids = IdQueue(config.UPLOADER_QUEUE_SIZE.value, UPLOADER_QUEUE_LENGTH)
+        self._load_queue()
 
     def start(self):
         if self._chat_id is None:
@@ -48,41 +48,76 @@ class TelegramUploader(RegularIntervalWorker):
             return
         super().start()
 
-    def add_image_to_queue(self, image_entity_id: int):
-        self._not_uploaded_ids.add(image_entity_id)
+    def add_image_to_queue(self, image_entity_id: int, timeout: float = None) -> bool:
+        """
+        Schedules an image for upload, waiting if the queue is full
+        :param image_entity_id: the entity id
+        :param timeout: maximum number of seconds to wait, None waits forever
+        :return: True if the image has been queued, False if it will be picked up from the database later
+        """
+        if not self.running:
+            # nobody is going to empty the queue
+            timeout = 0
+        return self._not_uploaded_ids.put(image_entity_id, timeout)
+
+    def _load_queue(self) -> None:
+        with _session_scope(False) as session:
+            self._not_uploaded_ids.load(self._persistence.get_not_uploaded_image_ids(session, self._bot.token))
 
     @UPLOADER_TIME.time()
     def _run(self):
-        with _session_scope() as session:
-            queue_length = len(self._not_uploaded_ids)
-            UPLOADER_QUEUE_LENGTH.set(queue_length)
-            if queue_length <= 0:
-                # sleep for a longer time period to reduce load
-                time.sleep(60)
-                return
-
+        image_id = self._not_uploaded_ids.pop()
+        if image_id is None:
+            # images that did not fit into the queue are still waiting in the database
+            self._load_queue()
             image_id = self._not_uploaded_ids.pop()
+        if image_id is None:
+            # sleep for a longer time period to reduce load
+            time.sleep(60)
+            return
 
-            entity = self._persistence.get_image(session, image_id)
-            image_data = self._persistence.get_image_data(entity)
-            if image_data is None:
-                LOGGER.warning("Missing image data for entity, trying to download: {}".format(entity))
-                try:
-                    image_data = download_image_bytes(entity.url)
-                    self._persistence.update(session, entity, image_data)
+        # database sessions are only held for short reads and writes, never during network calls
+        with _session_scope(False) as session:
+            records = self._persistence.get_records(session, self._bot.token, [image_id])
+        if len(records) <= 0:
+            LOGGER.warning("Image id scheduled for upload not found: {}".format(image_id))
+            return
+        record = records[0]
+        if record.telegram_file_id is not None:
+            LOGGER.debug("Image has already been uploaded in the meantime: {}".format(record.url))
+            return
+
+        image_file = self._persistence.open_image_data(record)
+        if image_file is None:
+            LOGGER.warning("Missing image data for entity, trying to download: {}".format(record.url))
+            staged = self._persistence.stage_image_data()
+            try:
+                download_image(record.url, staged)
+            except Exception as e:
+                staged.discard()
+                LOGGER.error(
+                    "Error trying to download missing image data for url '{}', deleting entity.".format(record.url),
+                    e)
+                with _session_scope() as session:
                     entity = self._persistence.get_image(session, image_id)
-                except Exception as e:
-                    LOGGER.error(
-                        "Error trying to download missing image data for url '{}', deleting entity.".format(entity.url),
-                        e)
-                    self._persistence.delete(session, entity)
+                    if entity is not None:
+                        self._persistence.delete(session, entity)
+                return
+
+            with staged, _session_scope() as session:
+                entity = self._persistence.get_image(session, image_id)
+                if entity is None:
+                    # the entity has been removed while the image data was downloaded
+                    staged.discard()
                     return
+                self._persistence.update(session, entity, staged)
+                image_file = self._persistence.open_image_data(entity)
 
-            file_ids = send_photo(bot=self._bot, chat_id=self._chat_id, image_data=image_data)
-            bot_token = self._persistence.get_bot_token(session, self._bot.token)
-            for file_id in file_ids:
-                entity.add_file_id(bot_token, file_id)
-            self._persistence.update(session, entity, image_data)
-            LOGGER.debug(
-                "Send image '{}' to chat '{}' and updated entity with file_id {}.".format(
-                    entity.url, self._chat_id, file_ids))
+        try:
+            file_ids = send_photo(bot=self._bot, chat_id=self._chat_id, image_data=image_file)
+        finally:
+            image_file.close()
+        self._persistence.add_telegram_file_ids(image_id, self._bot.token, file_ids)
+        LOGGER.debug(
+            "Send image '{}' to chat '{}' and updated entity with file_id {}.".format(
+                record.url, self._chat_id, file_ids))
@@ -0,0 +1,285 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import hashlib
+import logging
+import math
+import os
+import struct
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Iterable, Tuple, BinaryIO
+
+LOGGER = logging.getLogger(__name__)
+
+FILE_MAGIC = b"IWUC"
+FILE_VERSION = 2
+# magic, version, max entity id, number of filters
+FILE_HEADER = struct.Struct("<4sIqI")
+# number of filters of unverifiable urls (since version 2)
+FILE_HEADER_V2 = struct.Struct("<I")
+# capacity, error rate, count, number of bits
+FILTER_HEADER = struct.Struct("<QdQQ")
+
+
+def _hash_pair(key: str) -> Tuple[int, int]:
+    """
+    :return: two independent 64 bit hashes of the key, used for double hashing
+    """
+    digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+class BloomFilter:
+    """
+    Fixed size bloom filter
+    """
+
+    def __init__(self, capacity: int, error_rate: float, count: int = 0, bits: bytearray = None):
+        """
+        :param capacity: number of entries the filter is sized for
+        :param error_rate: false positive probability when the filter holds capacity entries
+        :param count: number of entries already contained in bits
+        :param bits: existing bit array
+        """
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = count
+        self.num_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))))
+        self.num_hashes = max(1, int(round(self.num_bits / capacity * math.log(2))))
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+    def contains(self, hashes: Tuple[int, int]) -> bool:
+        for position in self._positions(hashes):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, hashes: Tuple[int, int]) -> None:
+        for position in self._positions(hashes):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def _positions(self, hashes: Tuple[int, int]) -> Iterable[int]:
+        h1, h2 = hashes
+        return ((h1 + i * h2) % self.num_bits for i in range(self.num_hashes))
+
+
+class ScalableBloomFilter:
+    """
+    Bloom filter that grows with the number of entries by adding bigger filters with tighter error rates,
+    so the overall false positive probability stays below the given error rate.
+    """
+    GROWTH = 2
+    TIGHTENING = 0.5
+
+    def __init__(self, initial_capacity: int = 100000, error_rate: float = 0.001):
+        """
+        :param initial_capacity: capacity of the first filter
+        :param error_rate: overall false positive probability
+        """
+        self._initial_capacity = initial_capacity
+        self._error_rate = error_rate
+        self._filters = []
+
+    def __len__(self):
+        return sum(map(lambda x: x.count, self._filters))
+
+    def __contains__(self, key: str) -> bool:
+        hashes = _hash_pair(key)
+        return any(map(lambda x: x.contains(hashes), self._filters))
+
+    def add(self, key: str) -> bool:
+        """
+        Adds a key
+        :param key: the key
+        :return: True if the key has been added, False if it (probably) was contained already
+        """
+        hashes = _hash_pair(key)
+        if any(map(lambda x: x.contains(hashes), self._filters)):
+            return False
+        if len(self._filters) <= 0 or self._filters[-1].full:
+            self._filters.append(self._create_filter(len(self._filters)))
+        self._filters[-1].add(hashes)
+        return True
+
+    def write(self, f: BinaryIO) -> None:
+        """
+        Writes the filters to a file
+        """
+        for bloom_filter in self._filters:
+            f.write(FILTER_HEADER.pack(bloom_filter.capacity, bloom_filter.error_rate, bloom_filter.count,
+                                       bloom_filter.num_bits))
+            f.write(bloom_filter.bits)
+
+    def read(self, f: BinaryIO, filter_count: int) -> None:
+        """
+        Replaces the filters with the ones of a file written by write()
+        """
+        filters = []
+        for _ in range(filter_count):
+            capacity, error_rate, count, num_bits = FILTER_HEADER.unpack(f.read(FILTER_HEADER.size))
+            bits = bytearray(f.read((num_bits + 7) // 8))
+            bloom_filter = BloomFilter(capacity, error_rate, count, bits)
+            if bloom_filter.num_bits != num_bits or len(bits) != len(bloom_filter.bits):
+                raise ValueError("Invalid bloom filter")
+            filters.append(bloom_filter)
+        self._filters = filters
+
+    @property
+    def filter_count(self) -> int:
+        return len(self._filters)
+
+    def _create_filter(self, index: int) -> BloomFilter:
+        # the error rates of all filters form a geometric series that sums up to at most the given error rate
+        return BloomFilter(self._initial_capacity * (self.GROWTH ** index),
+                           self._error_rate * (1 - self.TIGHTENING) * (self.TIGHTENING ** index))
+
+
+class UrlCache:
+    """
+    Bounded set of already processed image urls.
+    Recently seen urls are kept in a LRU, all others in a scalable bloom filter.
+    Since bloom filters can report false positives, hits that are not in the LRU
+    can be confirmed using a verify function (f.ex. a database lookup).
+    Urls the verify function does not know about (f.ex. skipped near duplicates) are kept in a separate
+    bloom filter whose hits are trusted.
+    """
+
+    def __init__(self, max_size: int, verify: Callable[[str], bool] = None, error_rate: float = 0.001):
+        """
+        :param max_size: maximum number of urls in the LRU
+        :param verify: function to confirm that a url that is contained in the bloom filter is really known
+        :param error_rate: false positive probability of the bloom filter
+        """
+        self._max_size = max_size
+        self._verify = verify
+        self._recent = OrderedDict()
+        self._bloom_filter = ScalableBloomFilter(error_rate=error_rate)
+        self._unverifiable = ScalableBloomFilter(error_rate=error_rate)
+        self.max_entity_id = 0
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._bloom_filter) + len(self._unverifiable)
+
+    def __contains__(self, url: str) -> bool:
+        with self._lock:
+            if url in self._recent:
+                self._recent.move_to_end(url)
+                return True
+            unverifiable = url in self._unverifiable
+            if not unverifiable and url not in self._bloom_filter:
+                return False
+
+        if unverifiable:
+            self._remember(url)
+            return True
+
+        if self._verify is None or self._verify(url):
+            self._remember(url)
+            return True
+        return False
+
+    def add(self, url: str, entity_id: int = None, verifiable: bool = True) -> None:
+        """
+        Adds a processed url
+        :param url: the url
+        :param entity_id: id of the entity that was created for the url, if any
+        :param verifiable: False if the verify function can not confirm the url, because it has not been stored
+        """
+        with self._lock:
+            if verifiable:
+                self._bloom_filter.add(url)
+            else:
+                self._unverifiable.add(url)
+            if entity_id is not None:
+                self.max_entity_id = max(self.max_entity_id, entity_id)
+        self._remember(url)
+
+    def seed(self, entries: Iterable[Tuple[int, str]]) -> None:
+        """
+        Adds the urls of existing entities
+        :param entries: (entity id, url) tuples
+        """
+        count = 0
+        with self._lock:
+            for entity_id, url in entries:
+                if url is not None:
+                    self._bloom_filter.add(url)
+                self.max_entity_id = max(self.max_entity_id, entity_id)
+                count += 1
+        LOGGER.debug("Seeded url cache with {} urls".format(count))
+
+    def save(self, path: str) -> None:
+        """
+        Saves the bloom filter to a file, the file is replaced atomically
+        :param path: file path
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=".url_cache.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                with self._lock:
+                    f.write(FILE_HEADER.pack(FILE_MAGIC, FILE_VERSION, self.max_entity_id,
+                                             self._bloom_filter.filter_count))
+                    f.write(FILE_HEADER_V2.pack(self._unverifiable.filter_count))
+                    self._bloom_filter.write(f)
+                    self._unverifiable.write(f)
+            os.replace(temp_path, path)
+        except:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        LOGGER.debug("Saved url cache to {}".format(path))
+
+    def load(self, path: str) -> bool:
+        """
+        Loads a bloom filter written by save()
+        :param path: file path
+        :return: True if the file has been loaded, False if it does not exist or is invalid
+        """
+        if not os.path.exists(path):
+            return False
+        try:
+            with open(path, "rb") as f:
+                magic, version, max_entity_id, filter_count = FILE_HEADER.unpack(f.read(FILE_HEADER.size))
+                if magic != FILE_MAGIC or version not in [1, FILE_VERSION]:
+                    raise ValueError("Unsupported file format")
+                unverifiable_count = 0
+                if version >= 2:
+                    unverifiable_count, = FILE_HEADER_V2.unpack(f.read(FILE_HEADER_V2.size))
+                with self._lock:
+                    self._bloom_filter.read(f, filter_count)
+                    self._unverifiable.read(f, unverifiable_count)
+                    self.max_entity_id = max_entity_id
+        except Exception as e:
+            LOGGER.warning("Ignoring invalid url cache file {}: {}".format(path, e))
+            return False
+        LOGGER.debug("Loaded url cache from {}".format(path))
+        return True
+
+    def _remember(self, url: str) -> None:
+        with self._lock:
+            self._recent[url] = True
+            self._recent.move_to_end(url)
+            while len(self._recent) > self._max_size:
+                self._recent.popitem(last=False)
@@ -13,31 +13,60 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import functools
 import hashlib
 import logging
 import os
 from io import BytesIO
+from typing import BinaryIO
 
-import requests
 from emoji import emojize
 from telegram import Bot
 
 from infinitewisdom.analysis import ImageAnalyser
-from infinitewisdom.const import TELEGRAM_CAPTION_LENGTH_LIMIT, REQUESTS_TIMEOUT
+from infinitewisdom.const import TELEGRAM_CAPTION_LENGTH_LIMIT
+from infinitewisdom.httpclient import HTTP_CLIENT
 
 LOGGER = logging.getLogger(__name__)
 
 
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+PERCEPTUAL_HASH_SIZE = 16
+
+
+def fetch_generated_image_url(image_api_url: str) -> str:
+    """
+    Requests the image api to generate a new image url
+    :param image_api_url: url of the image api
+    :return: the image url
+    """
+    url_page = HTTP_CLIENT.get(image_api_url, params={'generate': 'true'})
+    url_page.raise_for_status()
+    return url_page.text
+
+
 def download_image_bytes(url: str) -> bytes:
     """
     Downloads the image from the given url
     :return: the downloaded image
     """
-    image = requests.get(url, timeout=REQUESTS_TIMEOUT)
+    image = HTTP_CLIENT.get(url)
     image.raise_for_status()
     return image.content
 
 
+def download_image(url: str, target: BinaryIO) -> None:
+    """
+    Downloads the image from the given url in chunks, without holding the whole image in memory
+    :param url: the image url
+    :param target: file like object the image data is written to
+    """
+    with HTTP_CLIENT.get(url, stream=True) as response:
+        response.raise_for_status()
+        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            target.write(chunk)
+
+
 def create_hash(data: bytes) -> str:
     """
     Creates a hash of the given bytes
@@ -47,15 +76,44 @@ def create_hash(data: bytes) -> str:
     return hashlib.md5(data).hexdigest()
 
 
+def create_incremental_hash():
+    """
+    Creates a hash object that can be updated with chunks of data and results in the same hash as create_hash
+    :return: hash object
+    """
+    return hashlib.md5()
+
+
+def create_perceptual_hash(image_data: bytes, hash_size: int = PERCEPTUAL_HASH_SIZE) -> str or None:
+    """
+    Creates a difference hash (dHash) of the given image.
+    Unlike create_hash the result is similar for images that look similar, e.g. after re-encoding or resizing.
+    :param image_data: encoded image
+    :param hash_size: width and height of the gradient grid, the hash has hash_size^2 bits
+    :return: hex representation of the hash or None if the image can not be decoded
+    """
+    import cv2
+    import numpy as np
+
+    image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None
+
+    image = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    gradient = image[:, 1:] > image[:, :-1]
+    return np.packbits(gradient.flatten()).tobytes().hex()
+
+
+@functools.lru_cache(maxsize=16)
 def cryptographic_hash(data: bytes or str) -> str:
     """
-    Creates a cryptographic hash of the given bytes
+    Creates a cryptographic hash of the given bytes.
+    This is used for (a small number of) bot tokens, so results are memoized.
     :param data: data to hash
     :return: hash
     """
     if isinstance(data, str):
         data = data.encode()
-    import hashlib
     hash = hashlib.sha512(data).hexdigest()
     return hash
 
@@ -90,21 +148,24 @@ def select_best_available_analyser(session, analysers: [ImageAnalyser], persiste
         return sorted(available, key=lambda x: (-x.get_quality(), -remaining_capacity(session, x, persistence)))[0]
 
 
-def send_photo(bot: Bot, chat_id: str, file_id: int or None = None, image_data: bytes or None = None,
+def send_photo(bot: Bot, chat_id: str, file_id: int or None = None, image_data: bytes or BinaryIO or None = None,
                caption: str = None) -> [str]:
     """
     Sends a photo to the given chat
     :param bot: the bot
     :param chat_id: the chat id to send the image to
     :param file_id: the telegram file id of the already uploaded image
-    :param image_data: the image data
+    :param image_data: the image data, either as bytes or as a file like object
     :param caption: an optional image caption
     :return: a set of telegram image file_id's
     """
     if image_data is not None:
-        image_bytes_io = BytesIO(image_data)
-        image_bytes_io.name = 'inspireme.jpeg'
-        photo = image_bytes_io
+        if hasattr(image_data, 'read'):
+            photo = image_data
+        else:
+            image_bytes_io = BytesIO(image_data)
+            image_bytes_io.name = 'inspireme.jpeg'
+            photo = image_bytes_io
     elif file_id is not None:
         photo = file_id
     else:
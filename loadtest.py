@@ -0,0 +1,79 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import argparse
+import logging
+import random
+import time
+
+from infinitewisdom.const import COMMAND_INSPIRE
+from infinitewisdom.loadtest.bot_api import FakeBotApi
+from infinitewisdom.loadtest.image_api import FakeImageApi
+
+LOGGER = logging.getLogger(__name__)
+
+INLINE_QUERIES = ["", "wisdom", "life", "believe", "success", "love"]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Runs local stand-ins for the image api and the telegram bot API to load test the bot")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--image-api-port", type=int, default=8081, help="port of the fake image api")
+    parser.add_argument("--bot-api-port", type=int, default=8082, help="port of the fake telegram bot API")
+    parser.add_argument("--latency", type=float, default=0.1, help="seconds every response is delayed by")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="maximum number of seconds randomly added to the latency")
+    parser.add_argument("--corpus-size", type=int, default=10000, help="number of distinct images")
+    parser.add_argument("--update-rate", type=float, default=1.0,
+                        help="number of commands and inline queries per second sent to the bot")
+    parser.add_argument("--inline-ratio", type=float, default=0.5,
+                        help="ratio of inline queries among the sent updates")
+    parser.add_argument("--users", type=int, default=100, help="number of distinct users sending updates")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    server_args = {"host": args.host, "latency": args.latency, "jitter": args.jitter}
+    image_api = FakeImageApi(corpus_size=args.corpus_size, port=args.image_api_port, **server_args)
+    bot_api = FakeBotApi(port=args.bot_api_port, **server_args)
+    image_api.start()
+    bot_api.start()
+
+    print("Configure the bot with:")
+    print("INFINITEWISDOM_CRAWLER_IMAGE_API_URL={}".format(image_api.api_url))
+    print("INFINITEWISDOM_TELEGRAM_BOT_API_URL={}".format(bot_api.bot_api_url))
+
+    try:
+        next_update = time.time() if args.update_rate > 0 else float("inf")
+        next_report = time.time() + 10
+        while True:
+            now = time.time()
+            if now >= next_update:
+                user_id = random.randint(2, args.users + 1)
+                if random.random() < args.inline_ratio:
+                    bot_api.add_inline_query(random.choice(INLINE_QUERIES), user_id=user_id)
+                else:
+                    bot_api.add_command("/{}".format(COMMAND_INSPIRE[0]), chat_id=user_id)
+                next_update += 1 / args.update_rate
+            if now >= next_report:
+                LOGGER.info("Image api: {} | Bot API: {} ({} updates pending)".format(
+                    image_api.request_counts, bot_api.request_counts, bot_api.pending_updates))
+                next_report += 10
+            time.sleep(max(0.0, min(next_update, next_report) - time.time()))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        image_api.stop()
+        bot_api.stop()
@@ -0,0 +1,30 @@
+import argparse
+import logging
+
+from infinitewisdom.config.config import AppConfig
+from infinitewisdom.persistence import ImageDataPersistence
+from infinitewisdom.persistence.scrubber import ImageDataScrubber
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Finds corrupt, orphaned and missing image data by comparing the image data store with the database")
+    parser.add_argument("--repair", action="store_true",
+                        help="remove corrupt and orphaned image data and download missing image data again")
+    parser.add_argument("--workers", type=int, default=None, help="number of hashing processes")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    config = AppConfig()
+    persistence = ImageDataPersistence(config)
+
+    report = ImageDataScrubber(persistence, workers=args.workers).run(repair=args.repair)
+    persistence.image_data_store.close()
+
+    for image_hash in report.corrupt:
+        print("! Corrupt: {}".format(image_hash))
+    for image_hash in report.orphaned:
+        print("- Orphaned: {}".format(image_hash))
+    for entity_id in report.missing:
+        print("? Missing: {}".format(entity_id))
+    print(report)
@@ -0,0 +1,94 @@
+import os
+import tempfile
+import unittest
+
+from alembic import command
+from alembic.config import Config
+from alembic.operations import Operations
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import create_engine
+
+from infinitewisdom.config.config import AppConfig
+from infinitewisdom.const import IMAGE_DATA_BACKEND_FILESYSTEM
+from infinitewisdom.persistence.sqlalchemy import Base
+
+# migrations that create database objects which are not part of the models
+NON_MODEL_MIGRATIONS = ["3b2a9d4c1f07"]
+
+
+def create_database(url: str) -> None:
+    """
+    Creates an up to date database from the models, without running all migrations
+    (some of the early ones do not work on an empty SQLite database)
+    :param url: the database url
+    """
+    engine = create_engine(url)
+    Base.metadata.create_all(engine)
+
+    config = Config("alembic.ini")
+    config.set_main_option("sqlalchemy.url", url)
+    config.attributes["configure_logger"] = False
+    scripts = ScriptDirectory.from_config(config)
+    with engine.connect() as connection:
+        with Operations.context(MigrationContext.configure(connection)):
+            for revision in NON_MODEL_MIGRATIONS:
+                scripts.get_revision(revision).module.upgrade()
+    command.stamp(config, "head")
+    engine.dispose()
+
+
+class PersistenceTestBase(unittest.TestCase):
+    """
+    Base class for tests that need an ImageDataPersistence with an empty database and image data store
+    """
+    image_data_backend = IMAGE_DATA_BACKEND_FILESYSTEM
+
+    def setUp(self):
+        from infinitewisdom.persistence import ImageDataPersistence
+
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._original_config = {}
+        self.config = AppConfig()
+        url = "sqlite:///{}".format(os.path.join(self._temp_dir.name, "test.db"))
+        create_database(url)
+        self.set_config(self.config.SQL_PERSISTENCE_URL, url)
+        self.set_config(self.config.FILE_PERSISTENCE_BACKEND, self.image_data_backend)
+        self.set_config(self.config.FILE_PERSISTENCE_BASE_PATH, os.path.join(self._temp_dir.name, "image_data"))
+        self.set_config(self.config.FILE_PERSISTENCE_CACHE_SIZE, 0)
+        # incremental statistics register listeners on the global session factory
+        self.set_config(self.config.STATS_INCREMENTAL, False)
+        self.configure()
+        self.persistence = ImageDataPersistence(self.config)
+
+    def tearDown(self):
+        self.persistence.image_data_store.close()
+        for entry, value in self._original_config.items():
+            entry.value = value
+        self._temp_dir.cleanup()
+
+    def add_image(self, session, text: str) -> int:
+        """
+        Adds an entity whose text, url and image data are derived from the given text
+        :return: the entity id
+        """
+        from infinitewisdom.persistence import Image
+
+        entity = Image(url="https://example.com/{}.jpg".format(text), text=text, created=0)
+        self.persistence.add(session, entity, text.encode())
+        return entity.id
+
+    def configure(self) -> None:
+        """
+        Override to change the configuration before the persistence is created, see set_config
+        """
+        pass
+
+    def set_config(self, entry, value) -> None:
+        """
+        Changes a value of the (shared) configuration for the current test only
+        :param entry: the config entry
+        :param value: the new value
+        """
+        self._original_config.setdefault(entry, entry.value)
+        entry.value = value
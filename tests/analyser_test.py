@@ -0,0 +1,194 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import sys
+import threading
+import time
+import unittest
+from types import ModuleType, SimpleNamespace
+from unittest import mock
+
+from infinitewisdom.analysis.googlevision import GoogleVision
+from infinitewisdom.analysis.microsoftazure import AzureComputerVision
+from infinitewisdom.analysis.tesseract_api import TesseractApi
+
+
+class FakeVisionClient:
+    """
+    Stand-in for the google vision ImageAnnotatorClient, images with the content b"error" fail
+    """
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def batch_annotate_images(self, requests):
+        self.batch_sizes.append(len(requests))
+        responses = []
+        for request in requests:
+            content = request.image.content
+            if content == b"error":
+                responses.append(SimpleNamespace(error=SimpleNamespace(code=3, message="Bad image"),
+                                                 text_annotations=[]))
+            elif content == b"empty":
+                responses.append(SimpleNamespace(error=SimpleNamespace(code=0, message=""), text_annotations=[]))
+            else:
+                responses.append(SimpleNamespace(error=SimpleNamespace(code=0, message=""), text_annotations=[
+                    SimpleNamespace(description=content.decode())]))
+        return SimpleNamespace(responses=responses)
+
+
+def _fake_vision_modules(client: FakeVisionClient) -> dict:
+    """
+    :return: modules replacing the google cloud vision library
+    """
+    vision = ModuleType("google.cloud.vision")
+    vision.ImageAnnotatorClient = SimpleNamespace(from_service_account_file=lambda path: client)
+    vision.enums = SimpleNamespace(Feature=SimpleNamespace(Type=SimpleNamespace(TEXT_DETECTION=1)))
+    vision.types = SimpleNamespace(Feature=SimpleNamespace, Image=SimpleNamespace,
+                                   AnnotateImageRequest=SimpleNamespace)
+    cloud = ModuleType("google.cloud")
+    cloud.vision = vision
+    google = ModuleType("google")
+    google.cloud = cloud
+    return {"google": google, "google.cloud": cloud, "google.cloud.vision": vision}
+
+
+class GoogleVisionTests(unittest.TestCase):
+    """
+    Tests for the batch analysis of the google vision analyser
+    """
+
+    def test_find_text_batch(self):
+        client = FakeVisionClient()
+        with mock.patch.dict(sys.modules, _fake_vision_modules(client)):
+            analyser = GoogleVision("auth.json")
+            images = [str(i).encode() for i in range(GoogleVision.MAX_BATCH_SIZE + 4)]
+            images[3] = b"error"
+            images[GoogleVision.MAX_BATCH_SIZE + 1] = b"empty"
+
+            result = analyser.find_text_batch(images)
+
+        self.assertEqual([GoogleVision.MAX_BATCH_SIZE, 4], client.batch_sizes)
+        self.assertEqual(len(images), len(result))
+        self.assertIsInstance(result[3], Exception)
+        self.assertIsNone(result[GoogleVision.MAX_BATCH_SIZE + 1])
+        for i, text in enumerate(result):
+            if i not in [3, GoogleVision.MAX_BATCH_SIZE + 1]:
+                self.assertEqual(str(i), text)
+
+
+class AzureComputerVisionTests(unittest.TestCase):
+    """
+    Tests for the batch analysis of the microsoft azure analyser
+    """
+
+    def setUp(self):
+        self._lock = threading.Lock()
+        self._concurrent = 0
+        self.max_concurrent = 0
+
+    def _post(self, url, headers, params, data):
+        with self._lock:
+            self._concurrent += 1
+            self.max_concurrent = max(self.max_concurrent, self._concurrent)
+        try:
+            # later images finish first
+            time.sleep(0.05 / (1 + int(data) if data.isdigit() else 1))
+            if data == b"error":
+                raise IOError("Bad image")
+            regions = [{"lines": [{"words": [{"text": data.decode()}]}]}]
+            return mock.Mock(json=lambda: {"regions": regions})
+        finally:
+            with self._lock:
+                self._concurrent -= 1
+
+    def test_find_text_batch(self):
+        analyser = AzureComputerVision("key", concurrency=3)
+        images = [str(i).encode() for i in range(8)]
+        images[2] = b"error"
+
+        with mock.patch("infinitewisdom.analysis.microsoftazure.HTTP_CLIENT.post", side_effect=self._post):
+            result = analyser.find_text_batch(images)
+        analyser.close()
+
+        self.assertEqual(3, self.max_concurrent)
+        self.assertIsInstance(result[2], IOError)
+        self.assertEqual(["0", "1", "3", "4", "5", "6", "7"], [text for i, text in enumerate(result) if i != 2])
+
+
+class FakeTessBaseApi:
+    """
+    Stand-in for tesserocr.PyTessBaseAPI
+    """
+    instances = []
+
+    def __init__(self, lang: str):
+        self.ended = False
+        FakeTessBaseApi.instances.append(self)
+
+    def End(self):
+        self.ended = True
+
+    def SetImageBytes(self, image: bytes, width: int, height: int, bytes_per_pixel: int, bytes_per_line: int):
+        raise RuntimeError("Engine failed")
+
+
+class TesseractApiTests(unittest.TestCase):
+    """
+    Tests for the engines of the tesserocr analyser
+    """
+
+    @staticmethod
+    def _fake_tesserocr_modules() -> dict:
+        """
+        :return: modules replacing the tesserocr library
+        """
+        tesserocr = ModuleType("tesserocr")
+        tesserocr.PyTessBaseAPI = FakeTessBaseApi
+        return {"tesserocr": tesserocr}
+
+    def test_missing_library_fails_on_startup(self):
+        with mock.patch.dict(sys.modules, {"tesserocr": None}):
+            self.assertRaises(ImportError, TesseractApi)
+
+    def test_engine_errors_are_returned(self):
+        import cv2
+        import numpy as np
+
+        _, image = cv2.imencode(".png", np.zeros((8, 8), dtype=np.uint8))
+        with mock.patch.dict(sys.modules, self._fake_tesserocr_modules()):
+            analyser = TesseractApi()
+            result = analyser.find_text_batch([image.tobytes()])
+            analyser.close()
+
+        self.assertEqual(1, len(result))
+        self.assertIsInstance(result[0], RuntimeError)
+
+    def test_close_ends_engines_of_all_threads(self):
+        FakeTessBaseApi.instances.clear()
+        with mock.patch.dict(sys.modules, self._fake_tesserocr_modules()):
+            analyser = TesseractApi()
+            first = analyser._get_api()
+            self.assertIs(first, analyser._get_api())
+            thread = threading.Thread(target=analyser._get_api)
+            thread.start()
+            thread.join()
+            self.assertEqual(2, len(FakeTessBaseApi.instances))
+
+            analyser.close()
+            self.assertTrue(all(map(lambda x: x.ended, FakeTessBaseApi.instances)))
+
+            # a new engine is created when the analyser is used again
+            self.assertIsNot(first, analyser._get_api())
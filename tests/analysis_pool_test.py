@@ -0,0 +1,202 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+from concurrent.futures import Future
+
+from infinitewisdom.analysis import ImageAnalyser
+from infinitewisdom.analysis.pool import AnalysisPool, AnalysisResult
+from infinitewisdom.analysis.worker import AnalysisWorker
+from infinitewisdom.const import IMAGE_DATA_BACKEND_PACKFILE
+from infinitewisdom.persistence import Image, _session_scope
+from infinitewisdom.util import create_hash
+from tests import PersistenceTestBase
+
+
+class LengthAnalyser(ImageAnalyser):
+    """
+    Local analyser that "recognizes" the length of the image data
+    """
+
+    def get_identifier(self) -> str:
+        return "length"
+
+    def get_quality(self) -> float:
+        return 1.0
+
+    def get_monthly_capacity(self) -> float:
+        return float("inf")
+
+    def is_local(self) -> bool:
+        return True
+
+    def find_text(self, image: bytes) -> str or None:
+        return str(len(image))
+
+
+class ClosingAnalyser(LengthAnalyser):
+    """
+    Analyser that appends its process id to a file when it is closed
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+
+    def close(self) -> None:
+        with open(self._path, "a") as f:
+            f.write("{}\n".format(os.getpid()))
+
+
+class AnalysisPoolTests(PersistenceTestBase):
+    """
+    Tests for running analysers in a process pool
+    """
+    image_data_backend = IMAGE_DATA_BACKEND_PACKFILE
+
+    def configure(self):
+        self.set_config(self.config.IMAGE_ANALYSIS_WORKERS, 2)
+
+    def _add_image(self, session, image_data: bytes) -> Image:
+        entity = Image(url="http://127.0.0.1:1/{}.jpg".format(create_hash(image_data)), created=0)
+        self.persistence.add(session, entity, image_data)
+        return entity
+
+    def test_workers_see_data_written_later(self):
+        pool = AnalysisPool(LengthAnalyser(), self.persistence.image_data_backend_settings, 2)
+        try:
+            # start the workers before writing, adding many images grows (and replaces) the packfile index
+            self.assertFalse(pool.submit(create_hash(b"unknown")).result().found)
+
+            images = [os.urandom(100 + i) for i in range(2000)]
+            for image_data in images:
+                self.persistence.image_data_store.put(create_hash(image_data), image_data)
+
+            futures = {pool.submit(create_hash(image_data)): image_data for image_data in images[::20]}
+            for future, image_data in futures.items():
+                result = future.result()
+                self.assertTrue(result.found)
+                self.assertEqual(str(len(image_data)), result.text)
+        finally:
+            pool.shutdown()
+
+    def test_analyser_closed_on_shutdown(self):
+        path = os.path.join(self._temp_dir.name, "closed")
+        pool = AnalysisPool(ClosingAnalyser(path), self.persistence.image_data_backend_settings, 2)
+        worker = pool.submit(create_hash(b"unknown")).result().worker
+        pool.shutdown()
+
+        with open(path) as f:
+            closed = list(map(int, f.read().split()))
+        self.assertIn(worker, closed)
+        self.assertNotIn(os.getpid(), closed)
+
+    def test_apply_result_keeps_existing_image(self):
+        worker = AnalysisWorker(self.config, self.persistence, [LengthAnalyser()])
+        with _session_scope() as session:
+            entity_id = self._add_image(session, b"existing").id
+
+        # the worker process did not see the image data
+        future = Future()
+        future.set_result(AnalysisResult(create_hash(b"existing"), os.getpid(), 0.0, found=False))
+        with _session_scope() as session:
+            worker._apply_result(session, entity_id, LengthAnalyser(), future)
+
+        with _session_scope() as session:
+            self.assertIsNotNone(self.persistence.get_image(session, entity_id))
+        self.assertIn(entity_id, worker._not_optimal_ids)
+
+    def test_apply_result_retries_failed_analysis(self):
+        worker = AnalysisWorker(self.config, self.persistence, [LengthAnalyser()])
+        with _session_scope() as session:
+            entity_id = self._add_image(session, b"failing").id
+
+        future = Future()
+        future.set_exception(IOError("Analysis failed"))
+        with _session_scope() as session:
+            worker._apply_result(session, entity_id, LengthAnalyser(), future)
+
+        self.assertIn(entity_id, worker._not_optimal_ids)
+        with _session_scope() as session:
+            self.assertIsNone(self.persistence.get_image(session, entity_id).analyser)
+
+    def test_apply_result_restores_missing_image(self):
+        worker = AnalysisWorker(self.config, self.persistence, [LengthAnalyser()])
+        with _session_scope() as session:
+            entity_id = self._add_image(session, b"missing").id
+        self.persistence.image_data_store.delete(create_hash(b"missing"))
+
+        future = Future()
+        future.set_result(AnalysisResult(create_hash(b"missing"), os.getpid(), 0.0, found=False))
+        with _session_scope() as session:
+            worker._apply_result(session, entity_id, LengthAnalyser(), future)
+
+        # the image can not be downloaded again
+        with _session_scope() as session:
+            self.assertIsNone(self.persistence.get_image(session, entity_id))
+
+
+class FailingAnalyser(LengthAnalyser):
+    """
+    Analyser whose every analysis fails
+    """
+
+    def is_local(self) -> bool:
+        return False
+
+    def find_text(self, image: bytes) -> str or None:
+        raise IOError("Analysis failed")
+
+
+class FailingBatchAnalyser(FailingAnalyser):
+    """
+    Analyser whose batch requests fail as a whole
+    """
+
+    def find_text_batch(self, images: [bytes]) -> [str or None or Exception]:
+        raise IOError("Quota exceeded")
+
+
+class AnalysisWorkerTests(PersistenceTestBase):
+    """
+    Tests for analysing images in the worker thread
+    """
+
+    def _assert_failed_analysis_is_retried(self, analyser: ImageAnalyser):
+        worker = AnalysisWorker(self.config, self.persistence, [analyser])
+        entity_ids = []
+        with _session_scope() as session:
+            for i in range(3):
+                entity = Image(url="http://127.0.0.1:1/image{}.jpg".format(i), created=0)
+                self.persistence.add(session, entity, "image{}".format(i).encode())
+                entity_ids.append(entity.id)
+        for entity_id in entity_ids:
+            worker.add_image_to_queue(entity_id, 0)
+
+        with _session_scope() as session:
+            analyser, entities = worker._next_batch(session)
+            self.assertEqual(len(entity_ids), len(entities))
+            self.assertEqual(0, len(worker._not_optimal_ids))
+            worker._analyse(session, analyser, entities)
+
+        with _session_scope() as session:
+            for entity_id in entity_ids:
+                self.assertIn(entity_id, worker._not_optimal_ids)
+                self.assertIsNone(self.persistence.get_image(session, entity_id).analyser)
+
+    def test_failed_analysis_is_retried(self):
+        self._assert_failed_analysis_is_retried(FailingAnalyser())
+
+    def test_failed_batch_is_retried(self):
+        self._assert_failed_analysis_is_retried(FailingBatchAnalyser())
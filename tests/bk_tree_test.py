@@ -0,0 +1,65 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import unittest
+
+from infinitewisdom.persistence.bk_tree import BKTree
+
+
+def _distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTreeTests(unittest.TestCase):
+    """
+    Tests for the perceptual hash BK-tree
+    """
+
+    def test_find_matches_linear_scan(self):
+        rng = random.Random(42)
+        keys = [rng.getrandbits(64) for _ in range(500)]
+        # add some near duplicates
+        keys += [key ^ (1 << rng.randrange(64)) for key in keys[:50]]
+
+        tree = BKTree()
+        tree.load(("{:016x}".format(key), i) for i, key in enumerate(keys))
+        self.assertEqual(len(keys), len(tree))
+
+        for query in keys[:20] + [rng.getrandbits(64) for _ in range(20)]:
+            for max_distance in [0, 1, 8, 20]:
+                expected = sorted((_distance(query, key), i) for i, key in enumerate(keys)
+                                  if _distance(query, key) <= max_distance)
+                self.assertEqual(expected, tree.find("{:016x}".format(query), max_distance))
+
+    def test_add_and_remove(self):
+        tree = BKTree()
+        tree.add("ff00", 1)
+        tree.add("ff00", 2)
+        tree.add("ff01", 3)
+        tree.add("00ff", 4)
+        self.assertEqual(4, len(tree))
+        self.assertEqual([(0, 1), (0, 2), (1, 3)], tree.find("ff00", 1))
+
+        tree.remove("ff00", 1)
+        tree.remove("ff00", 5)
+        self.assertEqual(3, len(tree))
+        self.assertEqual([(0, 2), (1, 3)], tree.find("ff00", 1))
+        self.assertEqual([], BKTree().find("ff00", 64))
+
+
+if __name__ == '__main__':
+    unittest.main()
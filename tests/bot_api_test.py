@@ -0,0 +1,59 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import io
+import unittest
+
+from telegram import Bot, InlineQueryResultCachedPhoto
+
+from infinitewisdom.loadtest.bot_api import FakeBotApi
+
+
+class BotApiTests(unittest.TestCase):
+    """
+    Tests for the telegram bot API stand-in
+    """
+
+    def setUp(self):
+        self.bot_api = FakeBotApi()
+        self.bot_api.start()
+        self.bot = Bot("123456:ABC-DEF1234ghIkl-zyx57W2v1u123ew11", base_url=self.bot_api.bot_api_url)
+
+    def tearDown(self):
+        self.bot_api.stop()
+
+    def test_send_photo(self):
+        message = self.bot.send_photo(chat_id=5, photo=io.BytesIO(b"image"), caption="wisdom")
+        self.assertEqual(5, message.chat_id)
+        self.assertEqual("wisdom", message.caption)
+        file_id = message.photo[-1].file_id
+
+        message = self.bot.send_photo(chat_id=5, photo=file_id)
+        self.assertEqual(file_id, message.photo[-1].file_id)
+
+    def test_updates(self):
+        self.bot_api.add_command("/inspire", chat_id=7)
+        self.bot_api.add_inline_query("life")
+
+        updates = self.bot.get_updates(timeout=1)
+        self.assertEqual(2, len(updates))
+        self.assertEqual("/inspire", updates[0].message.text)
+        self.assertEqual(7, updates[0].message.chat_id)
+        self.assertEqual("life", updates[1].inline_query.query)
+        self.assertTrue(self.bot.answer_inline_query(updates[1].inline_query.id,
+                                                     [InlineQueryResultCachedPhoto("1", "file_id")]))
+
+        self.assertEqual([], self.bot.get_updates(offset=updates[-1].update_id + 1))
+        self.assertEqual(0, self.bot_api.pending_updates)
@@ -0,0 +1,82 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import unittest
+
+from infinitewisdom.persistence.bot_context import BotContext, MISSING
+from infinitewisdom.util import cryptographic_hash
+
+
+class BotContextTests(unittest.TestCase):
+    """
+    Tests for the bounded telegram file id cache of the current bot
+    """
+
+    def test_token(self):
+        context = BotContext("token", max_size=2)
+        self.assertEqual(cryptographic_hash("token"), context.hashed_token)
+        self.assertTrue(context.matches("token"))
+        self.assertFalse(context.matches("other"))
+
+    def test_missing_vs_not_uploaded(self):
+        context = BotContext("token", max_size=2)
+        context.put_file_id(1, None)
+        self.assertIsNone(context.get_file_id(1))
+        self.assertIs(MISSING, context.get_file_id(2))
+
+    def test_existing_file_id_is_kept(self):
+        context = BotContext("token", max_size=2)
+        context.put_file_id(1, None)
+        context.put_file_id(1, "a")
+        self.assertEqual("a", context.get_file_id(1))
+
+        context.put_file_id(1, "b")
+        context.put_file_id(1, None)
+        self.assertEqual("a", context.get_file_id(1))
+
+    def test_evicts_least_recently_used(self):
+        context = BotContext("token", max_size=2)
+        context.put_file_id(1, "a")
+        context.put_file_id(2, "b")
+        # accessing 1 makes 2 the least recently used entry
+        self.assertEqual("a", context.get_file_id(1))
+        context.put_file_id(3, "c")
+
+        self.assertEqual("a", context.get_file_id(1))
+        self.assertIs(MISSING, context.get_file_id(2))
+        self.assertEqual("c", context.get_file_id(3))
+
+    def test_disabled(self):
+        context = BotContext("token", max_size=0)
+        context.put_file_id(1, "a")
+        self.assertIs(MISSING, context.get_file_id(1))
+
+    def test_load_is_bounded(self):
+        context = BotContext("token", max_size=2)
+        context.put_file_id(9, "z")
+        context.load(5, [(1, "a"), (2, "b"), (3, "c")])
+
+        self.assertEqual(5, context.bot_token_id)
+        self.assertEqual("a", context.get_file_id(1))
+        self.assertEqual("b", context.get_file_id(2))
+        self.assertIs(MISSING, context.get_file_id(3))
+        self.assertIs(MISSING, context.get_file_id(9))
+
+    def test_remove(self):
+        context = BotContext("token", max_size=2)
+        context.put_file_id(1, "a")
+        context.remove(1)
+        context.remove(2)
+        self.assertIs(MISSING, context.get_file_id(1))
@@ -0,0 +1,161 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import unittest
+from unittest import mock
+
+import cv2
+import numpy as np
+from prometheus_client import REGISTRY
+from sqlalchemy import event
+
+from infinitewisdom.config.config import AppConfig
+from infinitewisdom.const import DEFAULT_CRAWLER_MAX_INTERVAL
+from infinitewisdom.crawler import Crawler, AdaptiveCrawlRate
+from infinitewisdom.persistence import _session_scope, _sessionmaker
+from tests import PersistenceTestBase
+
+
+class QueueRecorder:
+    """
+    Stand-in for the uploader and the analysis worker, that records the number of database connections
+    in use while an image is queued
+    """
+
+    def __init__(self):
+        self.queued = []
+        self.connections = []
+        self._checked_out = 0
+        pool = _sessionmaker.kw["bind"].pool
+        event.listen(pool, "checkout", self._checkout)
+        event.listen(pool, "checkin", self._checkin)
+
+    def add_image_to_queue(self, image_entity_id: int, timeout: float = None) -> bool:
+        self.queued.append(image_entity_id)
+        self.connections.append(self._checked_out)
+        return True
+
+    def _checkout(self, *args):
+        self._checked_out += 1
+
+    def _checkin(self, *args):
+        self._checked_out -= 1
+
+
+class CrawlerTests(PersistenceTestBase):
+    """
+    Tests for the timer based crawler
+    """
+
+    def test_fan_out_after_commit(self):
+        uploader = QueueRecorder()
+        analysis_worker = QueueRecorder()
+        crawler = Crawler(self.config, self.persistence, uploader, [], analysis_worker)
+        crawler._fetch_generated_image_url = lambda: "https://example.com/new.jpg"
+        crawler._download = lambda url, image_data: image_data.write(b"new") and None
+
+        crawler._run()
+
+        with _session_scope(False) as session:
+            entity_id = self.persistence.find_by_url(session, "https://example.com/new.jpg")[0].id
+        self.assertEqual([entity_id], uploader.queued)
+        self.assertEqual([entity_id], analysis_worker.queued)
+        # waiting for full queues must not keep a transaction open
+        self.assertEqual([0], uploader.connections)
+        self.assertEqual([0], analysis_worker.connections)
+
+    def test_near_duplicate_is_skipped(self):
+        self.set_config(self.config.CRAWLER_NEAR_DUPLICATE_DISTANCE, 8)
+        uploader = QueueRecorder()
+        analysis_worker = QueueRecorder()
+        crawler = Crawler(self.config, self.persistence, uploader, [], analysis_worker)
+
+        image = cv2.resize(np.random.RandomState(0).randint(0, 256, (8, 8), dtype=np.uint8), (64, 64))
+        changed = image.copy()
+        changed[0, 0] = 255 - changed[0, 0]
+        images = {
+            "https://example.com/original.png": cv2.imencode(".png", image)[1].tobytes(),
+            "https://example.com/reencoded.jpg": cv2.imencode(".jpg", changed,
+                                                              [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes(),
+        }
+        near_duplicates = REGISTRY.get_sample_value("crawler_near_duplicates_total")
+
+        with mock.patch("infinitewisdom.crawler.download_image",
+                        side_effect=lambda url, image_data: image_data.write(images[url])) as download:
+            for url in images.keys():
+                crawler._fetch_generated_image_url = lambda: url
+                crawler._run()
+
+            with _session_scope(False) as session:
+                self.assertEqual(["https://example.com/original.png"],
+                                 [url for _, url in self.persistence.get_all_urls(session)])
+            self.assertEqual(1, len(uploader.queued))
+            self.assertEqual(near_duplicates + 1, REGISTRY.get_sample_value("crawler_near_duplicates_total"))
+
+            # the skipped url is known without downloading it again
+            crawler._run()
+            self.assertEqual(list(images.keys()), [call[0][0] for call in download.call_args_list])
+            self.assertEqual(1, len(uploader.queued))
+
+
+class AdaptiveCrawlRateTests(unittest.TestCase):
+    """
+    Tests for the adaptive crawl rate
+    """
+
+    def test_interpolates_between_bounds(self):
+        rate = AdaptiveCrawlRate(1.0, 11.0, window=4)
+        self.assertEqual(1.0, rate.interval)
+
+        self.assertEqual(1.0, rate.record(True))
+        self.assertEqual(6.0, rate.record(False))
+        rate.record(False)
+        self.assertAlmostEqual(8.5, rate.record(False))
+        self.assertEqual(0.25, rate.novelty_ratio)
+
+        # the oldest (new) result drops out of the window
+        self.assertEqual(11.0, rate.record(False))
+
+    def test_default_max_interval(self):
+        rate = AdaptiveCrawlRate(1.0, None, window=1)
+        self.assertEqual(DEFAULT_CRAWLER_MAX_INTERVAL, rate.record(False))
+
+        # a long crawler interval is never shortened
+        rate = AdaptiveCrawlRate(60.0, None, window=1)
+        self.assertEqual(60.0, rate.record(False))
+        self.assertEqual(60.0, rate.record(True))
+
+
+class CrawlerConfigTests(unittest.TestCase):
+    """
+    Tests for the validation of the crawler configuration
+    """
+
+    def setUp(self):
+        self.config = AppConfig()
+        self._original = (self.config.CRAWLER_INTERVAL.value, self.config.CRAWLER_MAX_INTERVAL.value)
+
+    def tearDown(self):
+        self.config.CRAWLER_INTERVAL.value, self.config.CRAWLER_MAX_INTERVAL.value = self._original
+
+    def test_interval_above_default_max_interval(self):
+        self.config.CRAWLER_INTERVAL.value = 30.0
+        self.config.CRAWLER_MAX_INTERVAL.value = None
+        self.config._validate()
+
+    def test_explicit_max_interval_below_interval(self):
+        self.config.CRAWLER_INTERVAL.value = 30.0
+        self.config.CRAWLER_MAX_INTERVAL.value = 10.0
+        self.assertRaises(AssertionError, self.config._validate)
@@ -0,0 +1,94 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import unittest
+
+from infinitewisdom.persistence.file_id_buffer import TelegramFileIdBuffer
+
+
+class TelegramFileIdBufferTests(unittest.TestCase):
+    """
+    Tests for the write-behind buffer of telegram file ids
+    """
+
+    def setUp(self):
+        self.writes = []
+        self.fail_writes = False
+
+    def _write(self, bot_token: str, file_ids: dict):
+        if self.fail_writes:
+            raise IOError("write failed")
+        self.writes.append((bot_token, {image_id: set(ids) for image_id, ids in file_ids.items()}))
+
+    def test_writes_immediately_if_not_started(self):
+        buffer = TelegramFileIdBuffer(interval=3600, write=self._write)
+        buffer.add(1, "token", ["a"])
+        self.assertEqual([("token", {1: {"a"}})], self.writes)
+
+    def test_buffers_until_flush(self):
+        buffer = TelegramFileIdBuffer(interval=3600, write=self._write)
+        buffer.start()
+        try:
+            buffer.add(1, "token", ["a"])
+            buffer.add(1, "token", ["b"])
+            buffer.add(2, "other", ["c"])
+            self.assertEqual([], self.writes)
+
+            buffer.flush()
+            self.assertCountEqual([("token", {1: {"a", "b"}}), ("other", {2: {"c"}})], self.writes)
+
+            buffer.flush()
+            self.assertEqual(2, len(self.writes))
+        finally:
+            buffer.stop()
+
+    def test_stop_flushes(self):
+        buffer = TelegramFileIdBuffer(interval=3600, write=self._write)
+        buffer.start()
+        buffer.add(1, "token", ["a"])
+        buffer.stop()
+        self.assertEqual([("token", {1: {"a"}})], self.writes)
+
+    def test_batch_size(self):
+        buffer = TelegramFileIdBuffer(interval=3600, write=self._write, batch_size=2)
+        buffer.start()
+        try:
+            for image_id in range(5):
+                buffer.add(image_id, "token", [str(image_id)])
+            buffer.flush()
+        finally:
+            buffer.stop()
+
+        self.assertEqual([2, 2, 1], [len(batch) for _, batch in self.writes])
+        written = {}
+        for _, batch in self.writes:
+            written.update(batch)
+        self.assertEqual({image_id: {str(image_id)} for image_id in range(5)}, written)
+
+    def test_failed_write_is_retried(self):
+        buffer = TelegramFileIdBuffer(interval=3600, write=self._write)
+        buffer.start()
+        try:
+            buffer.add(1, "token", ["a"])
+            self.fail_writes = True
+            self.assertRaises(IOError, buffer.flush)
+            self.assertEqual([], self.writes)
+
+            buffer.add(1, "token", ["b"])
+            self.fail_writes = False
+            buffer.flush()
+            self.assertEqual([("token", {1: {"a", "b"}})], self.writes)
+        finally:
+            buffer.stop()
@@ -0,0 +1,58 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import unittest
+
+from prometheus_client import REGISTRY
+
+from infinitewisdom.httpclient import HttpClient
+from infinitewisdom.loadtest import FakeServer
+
+
+class FlakyServer(FakeServer):
+    """
+    Server that responds with 503 to the given number of requests to a path, before it succeeds
+    """
+
+    def handle(self, request, path: str, params: dict) -> None:
+        self._count(path)
+        if self.request_counts[path] <= int(path.strip("/")):
+            request.send(503, b"Unavailable", "text/plain")
+        else:
+            request.send(200, b"OK", "text/plain")
+
+
+class HttpClientTests(unittest.TestCase):
+    """
+    Tests for the pooled HTTP client
+    """
+
+    @staticmethod
+    def _retries() -> float:
+        return REGISTRY.get_sample_value("http_retries_total", {"host": "127.0.0.1"}) or 0
+
+    def test_retries_are_counted(self):
+        client = HttpClient(retries=2, backoff_factor=0)
+        with FlakyServer() as server:
+            before = self._retries()
+            self.assertEqual(200, client.get(server.url + "/1").status_code)
+            self.assertEqual(1, self._retries() - before)
+
+            # the last failed attempt is not followed by a retry
+            before = self._retries()
+            self.assertEqual(503, client.get(server.url + "/5").status_code)
+            self.assertEqual(3, server.request_counts["/5"])
+            self.assertEqual(2, self._retries() - before)
+        client.close()
@@ -0,0 +1,57 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import threading
+import time
+import unittest
+
+from infinitewisdom.id_queue import IdQueue
+
+
+class IdQueueTests(unittest.TestCase):
+    """
+    Tests for the bounded worker queue
+    """
+
+    def test_fifo_and_unique(self):
+        queue = IdQueue(10)
+        queue.load([3, 1, 2])
+        self.assertTrue(queue.put(4))
+        self.assertTrue(queue.put(1))
+        self.assertEqual(4, len(queue))
+        self.assertEqual([3, 1, 2, 4], [queue.pop() for _ in range(4)])
+        self.assertIsNone(queue.pop())
+
+    def test_load_is_bounded(self):
+        queue = IdQueue(2)
+        queue.load(range(100))
+        self.assertEqual(2, len(queue))
+
+    def test_put_drops_on_timeout(self):
+        queue = IdQueue(1)
+        self.assertTrue(queue.put(1, 0))
+        self.assertFalse(queue.put(2, 0))
+        self.assertNotIn(2, queue)
+
+    def test_put_waits_for_space(self):
+        queue = IdQueue(1)
+        queue.put(1)
+        timer = threading.Timer(0.1, queue.pop)
+        timer.start()
+        start = time.time()
+        self.assertTrue(queue.put(2, 5))
+        self.assertGreaterEqual(time.time() - start, 0.05)
+        self.assertEqual(2, queue.pop())
+        timer.join()
@@ -14,22 +14,29 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import os
 import unittest
-from unittest import mock
 
-from infinitewisdom.const import ENV_PARAM_BOT_TOKEN
+from infinitewisdom.loadtest.image_api import FakeImageApi
+from infinitewisdom.util import fetch_generated_image_url, download_image_bytes
 
 
 class ImageApiTests(unittest.TestCase):
     """
-    Tests for the image api
+    Tests for the image api, using the local stand-in
     """
 
-    @mock.patch.dict(os.environ, {
-        ENV_PARAM_BOT_TOKEN: "123456:ABC-DEF1234ghIkl-zyx57W2v1u123ew11"
-    })
+    def setUp(self):
+        self.image_api = FakeImageApi(corpus_size=10, image_size=(200, 200), seed=1)
+        self.image_api.start()
+
+    def tearDown(self):
+        self.image_api.stop()
+
     def test_retrieve_new_image(self):
-        from infinitewisdom.bot import InfiniteWisdomBot
-        url = InfiniteWisdomBot._fetch_generated_image_url()
-        self.assertRegex(url, r'https://generated\.inspirobot\.me/\w/\w+\.jpg')
+        url = fetch_generated_image_url(self.image_api.api_url)
+        self.assertRegex(url, r'^http://127\.0\.0\.1:\d+/images/\d\.jpg$')
+
+        image_data = download_image_bytes(url)
+        self.assertTrue(image_data.startswith(b'\xff\xd8'))
+        self.assertEqual(image_data, download_image_bytes(url))
+        self.assertEqual({"generate": 1, "image": 2}, self.image_api.request_counts)
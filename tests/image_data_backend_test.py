@@ -0,0 +1,237 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import io
+import tempfile
+import unittest
+
+from prometheus_client import REGISTRY
+
+from infinitewisdom.persistence.image_data import ImageDataBackend
+from infinitewisdom.persistence.image_data.cache import CachedBackend
+from infinitewisdom.persistence.image_data.filesystem import FileSystemBackend
+from infinitewisdom.persistence.image_data.packfile import PackfileBackend
+from infinitewisdom.persistence.image_data.s3 import S3Backend
+from infinitewisdom.persistence.image_data.sqlite import SQLiteBackend
+from infinitewisdom.util import create_hash
+
+
+class LocalS3Client:
+    """
+    In-memory stand-in for the subset of the boto3 S3 client used by the S3 backend
+    """
+
+    class ClientError(Exception):
+        def __init__(self, code: str):
+            super().__init__(code)
+            self.response = {"Error": {"Code": code}}
+
+    def __init__(self, page_size: int = 2):
+        self.buckets = {}
+        self._page_size = page_size
+
+    def put_object(self, Bucket: str, Key: str, Body: bytes, **kwargs):
+        self.buckets.setdefault(Bucket, {})[Key] = bytes(Body)
+
+    def get_object(self, Bucket: str, Key: str):
+        if Key not in self.buckets.get(Bucket, {}):
+            raise self.ClientError("NoSuchKey")
+        return {"Body": io.BytesIO(self.buckets[Bucket][Key])}
+
+    def head_object(self, Bucket: str, Key: str):
+        if Key not in self.buckets.get(Bucket, {}):
+            raise self.ClientError("404")
+        return {"ContentLength": len(self.buckets[Bucket][Key])}
+
+    def delete_object(self, Bucket: str, Key: str):
+        self.buckets.get(Bucket, {}).pop(Key, None)
+
+    def list_objects_v2(self, Bucket: str, Prefix: str, ContinuationToken: str = None):
+        keys = sorted(filter(lambda x: x.startswith(Prefix), self.buckets.get(Bucket, {}).keys()))
+        start = 0 if ContinuationToken is None else int(ContinuationToken)
+        end = start + self._page_size
+        response = {"Contents": [{"Key": key} for key in keys[start:end]], "IsTruncated": end < len(keys)}
+        if response["IsTruncated"]:
+            response["NextContinuationToken"] = str(end)
+        return response
+
+
+class ImageDataBackendTestBase:
+    """
+    Tests every image data backend has to pass
+    """
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.backend = self.create_backend(self._temp_dir.name)
+
+    def tearDown(self):
+        self.backend.close()
+        self._temp_dir.cleanup()
+
+    def create_backend(self, base_path: str) -> ImageDataBackend:
+        raise NotImplementedError()
+
+    def test_put_get_delete(self):
+        images = {create_hash(data): data for data in [b"first", b"second", b"third"]}
+        for image_hash, data in images.items():
+            self.backend.put(image_hash, data)
+
+        for image_hash, data in images.items():
+            self.assertTrue(self.backend.exists(image_hash))
+            self.assertEqual(data, self.backend.get(image_hash))
+            self.assertEqual(data, bytes(self.backend.get_buffer(image_hash)))
+            with self.backend.open(image_hash) as f:
+                self.assertEqual(data, f.read())
+        self.assertEqual(set(images.keys()), set(self.backend.iterate()))
+
+        removed = create_hash(b"second")
+        self.backend.delete(removed)
+        self.assertFalse(self.backend.exists(removed))
+        self.assertIsNone(self.backend.get(removed))
+        self.assertIsNone(self.backend.open(removed))
+
+        self.backend.clear()
+        self.assertEqual([], list(self.backend.iterate()))
+
+    def test_stage(self):
+        data = b"staged image data"
+        with self.backend.stage() as staged:
+            staged.write(data[:5])
+            staged.write(data[5:])
+            self.assertEqual(create_hash(data), staged.commit())
+        self.assertEqual(data, self.backend.get(create_hash(data)))
+
+        with self.backend.stage() as staged:
+            staged.write(b"discarded")
+        self.assertFalse(self.backend.exists(create_hash(b"discarded")))
+        self.assertEqual([create_hash(data)], list(self.backend.iterate()))
+
+    def test_scrub(self):
+        valid = create_hash(b"valid")
+        self.backend.put(valid, b"valid")
+        invalid = create_hash(b"invalid")
+        self.backend.put(invalid, b"corrupt")
+
+        self.assertEqual([invalid], self.backend.scrub(repair=True))
+        self.assertFalse(self.backend.exists(invalid))
+        self.assertTrue(self.backend.verify(valid))
+
+
+class FileSystemBackendTests(ImageDataBackendTestBase, unittest.TestCase):
+
+    def create_backend(self, base_path: str) -> ImageDataBackend:
+        return FileSystemBackend(base_path)
+
+
+class PackfileBackendInterfaceTests(ImageDataBackendTestBase, unittest.TestCase):
+
+    def create_backend(self, base_path: str) -> ImageDataBackend:
+        return PackfileBackend(base_path)
+
+
+class SQLiteBackendTests(ImageDataBackendTestBase, unittest.TestCase):
+
+    def create_backend(self, base_path: str) -> ImageDataBackend:
+        return SQLiteBackend(base_path)
+
+
+class S3BackendTests(ImageDataBackendTestBase, unittest.TestCase):
+
+    def create_backend(self, base_path: str) -> ImageDataBackend:
+        return S3Backend(bucket="images", prefix="image_data/", client=LocalS3Client())
+
+
+class CachedBackendTests(ImageDataBackendTestBase, unittest.TestCase):
+
+    def create_backend(self, base_path: str) -> ImageDataBackend:
+        return CachedBackend(FileSystemBackend(base_path), capacity=10)
+
+    @staticmethod
+    def _metrics() -> dict:
+        """
+        :return: the current values of the cache metrics
+        """
+        return {
+            "hits": REGISTRY.get_sample_value("image_data_cache_hits_total"),
+            "misses": REGISTRY.get_sample_value("image_data_cache_misses_total"),
+            "evictions": REGISTRY.get_sample_value("image_data_cache_evictions_total"),
+            "size": REGISTRY.get_sample_value("image_data_cache_size_bytes"),
+        }
+
+    def _assert_metrics_changed(self, before: dict, hits: int, misses: int, evictions: int):
+        after = self._metrics()
+        self.assertEqual(hits, after["hits"] - before["hits"])
+        self.assertEqual(misses, after["misses"] - before["misses"])
+        self.assertEqual(evictions, after["evictions"] - before["evictions"])
+
+    def test_evicts_least_recently_used(self):
+        images = {name: create_hash(name.encode()) for name in ["aaaa", "bbbb", "cccc"]}
+        for name, image_hash in images.items():
+            self.backend.put(image_hash, name.encode())
+
+        before = self._metrics()
+        self.backend.get(images["aaaa"])
+        self.backend.get(images["bbbb"])
+        self._assert_metrics_changed(before, hits=0, misses=2, evictions=0)
+        self.assertEqual(8, self._metrics()["size"])
+
+        # reading "aaaa" makes "bbbb" the least recently used entry
+        before = self._metrics()
+        self.backend.get(images["aaaa"])
+        self.backend.get(images["cccc"])
+        self._assert_metrics_changed(before, hits=1, misses=1, evictions=1)
+        self.assertEqual(8, self._metrics()["size"])
+
+        before = self._metrics()
+        self.assertEqual(b"aaaa", self.backend.get(images["aaaa"]))
+        self.assertEqual(b"cccc", self.backend.get(images["cccc"]))
+        self._assert_metrics_changed(before, hits=2, misses=0, evictions=0)
+        self.assertEqual(b"bbbb", self.backend.get(images["bbbb"]))
+        self._assert_metrics_changed(before, hits=2, misses=1, evictions=1)
+
+    def test_entries_larger_than_capacity_are_not_cached(self):
+        image_hash = create_hash(b"larger than the capacity")
+        self.backend.put(image_hash, b"larger than the capacity")
+
+        before = self._metrics()
+        self.backend.get(image_hash)
+        self.backend.get(image_hash)
+        self._assert_metrics_changed(before, hits=0, misses=2, evictions=0)
+        self.assertEqual(0, self._metrics()["size"])
+
+    def test_put_invalidates(self):
+        image_hash = create_hash(b"old")
+        self.backend.put(image_hash, b"old")
+        self.assertEqual(b"old", self.backend.get(image_hash))
+        self.assertEqual(3, self._metrics()["size"])
+
+        # data with the same size is trusted by the filesystem backend
+        self.backend.put(image_hash, b"replaced")
+        self.assertEqual(0, self._metrics()["size"])
+        before = self._metrics()
+        self.assertEqual(b"replaced", self.backend.get(image_hash))
+        self._assert_metrics_changed(before, hits=0, misses=1, evictions=0)
+
+    def test_delete_invalidates(self):
+        image_hash = create_hash(b"data")
+        self.backend.put(image_hash, b"data")
+        self.assertEqual(b"data", self.backend.get(image_hash))
+
+        self.backend.delete(image_hash)
+        self.assertEqual(0, self._metrics()["size"])
+        self.assertFalse(self.backend.exists(image_hash))
+        self.assertIsNone(self.backend.get(image_hash))
+        self.assertIsNone(self.backend.open(image_hash))
@@ -0,0 +1,122 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import tempfile
+import unittest
+
+from infinitewisdom.persistence.image_data.packfile import PackfileBackend, INDEX_FILE_NAME
+from infinitewisdom.util import create_hash
+
+
+class PackfileBackendTests(unittest.TestCase):
+    """
+    Tests for the packfile image data store
+    """
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self.base_path = self._temp_dir.name
+
+    def tearDown(self):
+        self._temp_dir.cleanup()
+
+    @staticmethod
+    def _create_data(count: int) -> {str: bytes}:
+        data = [os.urandom(1000 + i) for i in range(count)]
+        return {create_hash(d): d for d in data}
+
+    def test_put_get_remove(self):
+        store = PackfileBackend(self.base_path, segment_size=10000)
+        images = self._create_data(2000)
+        for image_hash, data in images.items():
+            store.put(image_hash, data)
+
+        for image_hash, data in images.items():
+            self.assertEqual(data, store.get(image_hash))
+            self.assertEqual(data, store.get_buffer(image_hash).tobytes())
+
+        removed = list(images.keys())[:100]
+        for image_hash in removed:
+            store.delete(image_hash)
+            self.assertFalse(store.exists(image_hash))
+            self.assertIsNone(store.get(image_hash))
+
+        self.assertEqual(set(images.keys()) - set(removed), set(store.iterate()))
+        store.close()
+
+    def test_compact(self):
+        store = PackfileBackend(self.base_path, segment_size=10000)
+        images = self._create_data(50)
+        for image_hash, data in images.items():
+            store.put(image_hash, data)
+        removed = list(images.keys())[:25]
+        for image_hash in removed:
+            store.delete(image_hash)
+
+        size_before = sum(map(lambda x: os.path.getsize(os.path.join(self.base_path, x)), os.listdir(self.base_path)))
+        store.compact()
+        size_after = sum(map(lambda x: os.path.getsize(os.path.join(self.base_path, x)), os.listdir(self.base_path)))
+        self.assertLess(size_after, size_before)
+
+        for image_hash, data in images.items():
+            if image_hash in removed:
+                self.assertIsNone(store.get(image_hash))
+            else:
+                self.assertEqual(data, store.get(image_hash))
+        self.assertEqual([], store.scrub())
+        store.close()
+
+    def test_rebuild_index(self):
+        store = PackfileBackend(self.base_path)
+        images = self._create_data(10)
+        for image_hash, data in images.items():
+            store.put(image_hash, data)
+        store.close()
+
+        os.remove(os.path.join(self.base_path, INDEX_FILE_NAME))
+        store = PackfileBackend(self.base_path)
+        for image_hash, data in images.items():
+            self.assertEqual(data, store.get(image_hash))
+        store.close()
+
+    def test_read_only_follows_writer(self):
+        store = PackfileBackend(self.base_path, segment_size=10000)
+        reader = PackfileBackend(self.base_path, read_only=True)
+
+        # grows and replaces the index
+        images = self._create_data(2000)
+        for image_hash, data in images.items():
+            store.put(image_hash, data)
+        for image_hash, data in images.items():
+            self.assertEqual(data, reader.get(image_hash))
+
+        removed = list(images.keys())[:1000]
+        for image_hash in removed:
+            store.delete(image_hash)
+        self.assertFalse(reader.exists(removed[0]))
+
+        # replaces the index and removes all segments
+        store.compact()
+        for image_hash, data in images.items():
+            if image_hash in removed:
+                self.assertIsNone(reader.get(image_hash))
+            else:
+                self.assertEqual(data, reader.get(image_hash))
+        self.assertEqual(set(images.keys()) - set(removed), set(reader.iterate()))
+
+        self.assertRaises(ValueError, reader.put, removed[0], images[removed[0]])
+        reader.close()
+        store.close()
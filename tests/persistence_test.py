@@ -0,0 +1,95 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+
+from sqlalchemy import create_engine
+
+from infinitewisdom.persistence import Image, _session_scope, _sessionmaker
+from infinitewisdom.persistence.sqlalchemy import SQLAlchemyPersistence, Base
+from tests import PersistenceTestBase
+
+
+class ImageDataPersistenceTests(PersistenceTestBase):
+    """
+    Tests for the database queries of the persistence
+    """
+
+    def test_has_url(self):
+        with _session_scope() as session:
+            self.persistence.add(session, Image(url="https://example.com/a.jpg", created=0), b"a")
+
+        with _session_scope(False) as session:
+            self.assertTrue(self.persistence.has_url(session, "https://example.com/a.jpg"))
+            self.assertFalse(self.persistence.has_url(session, "https://example.com/b.jpg"))
+
+    def _find_ids(self, text: str) -> [int]:
+        with _session_scope(False) as session:
+            return list(map(lambda x: x.id, self.persistence.find_by_text(session, text)))
+
+    def test_text_search_index_follows_changes(self):
+        with _session_scope() as session:
+            first = self.add_image(session, "Wisdom is infinite")
+            second = self.add_image(session, "Infinite patience")
+        self.assertEqual({first, second}, set(self._find_ids("infinite")))
+
+        with _session_scope() as session:
+            entity = self.persistence.get_image(session, second)
+            entity.text = "Finite patience"
+            self.persistence.update(session, entity)
+        self.assertEqual([first], self._find_ids("infinite"))
+        self.assertEqual([second], self._find_ids("finite"))
+
+        with _session_scope() as session:
+            self.persistence.delete(session, self.persistence.get_image(session, first))
+        self.assertEqual([], self._find_ids("infinite"))
+        self.assertEqual([], self._find_ids("wisdom"))
+
+    def test_text_search_matches_word_prefixes(self):
+        with _session_scope() as session:
+            entity_id = self.add_image(session, "Wisdom is infinite")
+        self.assertEqual([entity_id], self._find_ids("wis INF"))
+        # words are matched from their start, not anywhere
+        self.assertEqual([], self._find_ids("isdom"))
+        self.assertEqual([], self._find_ids("wisdom patience"))
+
+    def test_text_search_dialect_requires_index(self):
+        self.assertEqual("sqlite", SQLAlchemyPersistence._detect_text_search_dialect(
+            _sessionmaker.kw["bind"]))
+
+        engine = create_engine("sqlite:///{}".format(os.path.join(self._temp_dir.name, "without_index.db")))
+        Base.metadata.create_all(engine)
+        self.assertIsNone(SQLAlchemyPersistence._detect_text_search_dialect(engine))
+        engine.dispose()
+
+
+class RandomSamplerPersistenceTests(PersistenceTestBase):
+    """
+    Tests for the random sampler of the persistence
+    """
+
+    def configure(self):
+        self.set_config(self.config.PERSISTENCE_RANDOM_SAMPLER_MAX_SIZE, 3)
+
+    def test_enabled_again_when_pool_shrinks(self):
+        with _session_scope() as session:
+            entity_ids = [self.add_image(session, str(i)) for i in range(4)]
+        self.assertFalse(self.persistence._random_sampler.enabled)
+
+        with _session_scope() as session:
+            for entity_id in entity_ids[:2]:
+                self.persistence.delete(session, self.persistence.get_image(session, entity_id))
+        self.assertTrue(self.persistence._random_sampler.enabled)
+        self.assertEqual(set(entity_ids[2:]), set(self.persistence._random_sampler.sample(10)))
@@ -0,0 +1,81 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import unittest
+
+from infinitewisdom.persistence.random_sampler import RandomImageSampler
+
+
+class RandomImageSamplerTests(unittest.TestCase):
+    """
+    Tests for the in-memory random image sampler
+    """
+
+    def test_sample_without_duplicates(self):
+        sampler = RandomImageSampler(max_size=100)
+        sampler.load(range(10))
+
+        sample = sampler.sample(5)
+        self.assertEqual(5, len(sample))
+        self.assertEqual(len(sample), len(set(sample)))
+
+        self.assertEqual(set(range(10)), set(sampler.sample(20)))
+
+    def test_add_and_remove(self):
+        sampler = RandomImageSampler(max_size=100)
+        sampler.load([1, 2, 3])
+
+        sampler.add(4)
+        sampler.remove(1)
+        sampler.remove(42)
+
+        self.assertEqual({2, 3, 4}, set(sampler.sample(10)))
+
+    def test_disabled_when_too_big(self):
+        sampler = RandomImageSampler(max_size=3)
+        sampler.load([1, 2, 3])
+        self.assertTrue(sampler.enabled)
+
+        sampler.add(4)
+        self.assertFalse(sampler.enabled)
+        self.assertEqual([], sampler.sample(1))
+
+        sampler.load(range(10))
+        self.assertFalse(sampler.enabled)
+
+    def test_remove_keeps_positions(self):
+        sampler = RandomImageSampler(max_size=1000)
+        sampler.load(range(100))
+
+        for entity_id in range(0, 100, 3):
+            sampler.remove(entity_id)
+        sampler.add(7)
+        sampler.add(200)
+
+        expected = set(range(100)).difference(range(0, 100, 3))
+        expected.add(200)
+        self.assertEqual(len(expected), len(sampler))
+        self.assertEqual(expected, set(sampler.sample(1000)))
+
+    def test_can_enable(self):
+        sampler = RandomImageSampler(max_size=10)
+        self.assertTrue(sampler.can_enable(9))
+        sampler.load(range(5))
+        self.assertFalse(sampler.can_enable(5))
+
+        sampler.disable()
+        self.assertFalse(sampler.can_enable(10))
+        self.assertTrue(sampler.can_enable(9))
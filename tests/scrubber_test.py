@@ -0,0 +1,61 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+from concurrent.futures import Future
+
+from infinitewisdom.const import IMAGE_DATA_BACKEND_PACKFILE
+from infinitewisdom.persistence import Image, _session_scope
+from infinitewisdom.persistence.scrubber import ImageDataScrubber, ScrubReport
+from infinitewisdom.util import create_hash
+from tests import PersistenceTestBase
+
+
+class ImageDataScrubberTests(PersistenceTestBase):
+    """
+    Tests for the image data scrubber
+    """
+    image_data_backend = IMAGE_DATA_BACKEND_PACKFILE
+
+    def test_orphaned_and_missing(self):
+        store = self.persistence.image_data_store
+        with _session_scope() as session:
+            for i in range(100):
+                self.persistence.add(session, Image(url="http://127.0.0.1:1/{}.jpg".format(i), created=0),
+                                     "image {}".format(i).encode())
+            missing = Image(url="http://127.0.0.1:1/missing.jpg", created=0)
+            self.persistence.add(session, missing, b"missing")
+            missing_id = missing.id
+        store.delete(create_hash(b"missing"))
+        store.put(create_hash(b"orphaned"), b"orphaned")
+
+        report = ImageDataScrubber(self.persistence, workers=2, batch_size=16).run()
+        self.assertEqual(101, report.checked)
+        self.assertEqual([], report.corrupt)
+        self.assertEqual([create_hash(b"orphaned")], report.orphaned)
+        self.assertEqual([missing_id], report.missing)
+
+    def test_data_not_seen_by_worker(self):
+        image_hash = create_hash(b"existing")
+        self.persistence.image_data_store.put(image_hash, b"existing")
+
+        future = Future()
+        future.set_result([(image_hash, None, False), (create_hash(b"vanished"), None, False)])
+        report = ScrubReport()
+        stored = set()
+        ImageDataScrubber(self.persistence)._collect([future], report, stored)
+
+        self.assertEqual({image_hash}, stored)
+        self.assertEqual(1, report.checked)
+        self.assertEqual([], report.corrupt)
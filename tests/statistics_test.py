@@ -0,0 +1,103 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+import os
+import tempfile
+import unittest
+from collections import Counter
+
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from infinitewisdom.persistence.sqlalchemy import Base, Image, BotToken
+from infinitewisdom.persistence.statistics import PersistenceStatistics, KEY_ANALYSER
+from infinitewisdom.util import cryptographic_hash
+
+
+class PersistenceStatisticsTests(unittest.TestCase):
+    """
+    Tests for the incrementally tracked persistence statistics
+    """
+
+    def setUp(self):
+        self._temp_dir = tempfile.TemporaryDirectory()
+        self._engine = create_engine("sqlite:///{}".format(os.path.join(self._temp_dir.name, "test.db")))
+        Base.metadata.create_all(self._engine)
+        self._sessionmaker = sessionmaker(bind=self._engine)
+
+        self.statistics = PersistenceStatistics("token")
+        self.statistics.reset(Counter({KEY_ANALYSER.format("tesseract"): 0}))
+        self.statistics.track(self._sessionmaker)
+
+    def tearDown(self):
+        self._engine.dispose()
+        self._temp_dir.cleanup()
+
+    def assertStatistics(self, pool_size: int, with_image_data: int, with_text: int, tesseract: int,
+                         uploaded: int):
+        self.assertEqual(pool_size, REGISTRY.get_sample_value("pool_size"))
+        self.assertEqual(with_image_data, REGISTRY.get_sample_value("entities_with_image_data_count"))
+        self.assertEqual(with_text, REGISTRY.get_sample_value("image_analysis_has_text_count"))
+        self.assertEqual(tesseract, REGISTRY.get_sample_value("image_analysis_type_count", {"type": "tesseract"}))
+        self.assertEqual(uploaded, REGISTRY.get_sample_value("telegram_entities_count"))
+
+    def test_track_changes(self):
+        session = self._sessionmaker()
+        first = Image(url="a", image_hash="1", text="wisdom", analyser="tesseract", created=0)
+        second = Image(url="b", created=0)
+        session.add_all([first, second])
+        session.commit()
+        self.assertStatistics(pool_size=2, with_image_data=1, with_text=1, tesseract=1, uploaded=0)
+
+        second.image_hash = "2"
+        second.text = ""
+        session.commit()
+        self.assertStatistics(pool_size=2, with_image_data=2, with_text=1, tesseract=1, uploaded=0)
+
+        # rolled back changes are not counted
+        session.add(Image(url="c", image_hash="3", created=0))
+        session.flush()
+        session.rollback()
+        self.assertStatistics(pool_size=2, with_image_data=2, with_text=1, tesseract=1, uploaded=0)
+
+        bot_token = BotToken(hashed_token=cryptographic_hash("token"))
+        other_bot_token = BotToken(hashed_token=cryptographic_hash("other"))
+        session.add_all([bot_token, other_bot_token])
+        first.add_file_id(bot_token, "file-1")
+        second.add_file_id(other_bot_token, "file-2")
+        session.commit()
+        self.assertStatistics(pool_size=2, with_image_data=2, with_text=1, tesseract=1, uploaded=1)
+
+        session.delete(first)
+        session.commit()
+        self.assertStatistics(pool_size=1, with_image_data=1, with_text=0, tesseract=0, uploaded=0)
+        session.close()
+
+    def test_record_bulk_changes(self):
+        session = self._sessionmaker()
+        entity = Image(url="a", image_hash="1", created=0)
+        session.add(entity)
+        session.commit()
+
+        self.statistics.record_uploads(session, 2)
+        session.commit()
+        self.assertStatistics(pool_size=1, with_image_data=1, with_text=0, tesseract=0, uploaded=2)
+
+        self.statistics.record_delete(session, entity)
+        session.query(Image).filter(Image.id == entity.id).delete()
+        session.commit()
+        self.assertStatistics(pool_size=0, with_image_data=0, with_text=0, tesseract=0, uploaded=2)
+        session.close()
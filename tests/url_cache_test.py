@@ -0,0 +1,92 @@
+# InfiniteWisdomBot - A Telegram bot that sends inspirational quotes of infinite wisdom...
+# Copyright (C) 2019  Max Rosin
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import unittest
+
+from infinitewisdom.url_cache import ScalableBloomFilter, UrlCache
+
+
+class ScalableBloomFilterTests(unittest.TestCase):
+    """
+    Tests for the scalable bloom filter
+    """
+
+    def test_no_false_negatives(self):
+        bloom_filter = ScalableBloomFilter(initial_capacity=100, error_rate=0.01)
+        keys = ["https://example.com/{}.jpg".format(i) for i in range(1000)]
+        for key in keys:
+            bloom_filter.add(key)
+
+        self.assertGreater(bloom_filter.filter_count, 1)
+        for key in keys:
+            self.assertIn(key, bloom_filter)
+
+        false_positives = sum(map(lambda i: "https://example.com/x{}.jpg".format(i) in bloom_filter, range(10000)))
+        self.assertLess(false_positives, 100)
+
+
+class UrlCacheTests(unittest.TestCase):
+    """
+    Tests for the crawler url cache
+    """
+
+    def test_verify_bloom_filter_hits(self):
+        known = {"a"}
+        cache = UrlCache(max_size=1, verify=lambda url: url in known)
+        cache.seed([(1, "a"), (2, "b")])
+        cache.add("c", 3)
+
+        self.assertEqual(3, cache.max_entity_id)
+        self.assertIn("a", cache)
+        # "b" is only contained in the bloom filter and not confirmed by the verify function
+        self.assertNotIn("b", cache)
+        self.assertNotIn("d", cache)
+
+    def test_unverifiable_urls_are_trusted(self):
+        cache = UrlCache(max_size=0, verify=lambda url: False)
+        cache.add("near-duplicate", verifiable=False)
+        cache.add("a", 1)
+
+        # both are only contained in the bloom filters now
+        self.assertNotIn("a", cache)
+        self.assertIn("near-duplicate", cache)
+
+    def test_save_and_load(self):
+        cache = UrlCache(max_size=10)
+        cache.seed([(1, "a"), (5, "b")])
+        cache.add("near-duplicate", verifiable=False)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "url_cache")
+            cache.save(path)
+
+            loaded = UrlCache(max_size=10, verify=lambda url: url in ["a", "b"])
+            self.assertTrue(loaded.load(path))
+            self.assertEqual(5, loaded.max_entity_id)
+            self.assertIn("a", loaded)
+            self.assertIn("b", loaded)
+            self.assertNotIn("c", loaded)
+            self.assertIn("near-duplicate", loaded)
+
+            with open(path, "wb") as f:
+                f.write(b"invalid")
+            self.assertFalse(UrlCache(max_size=10).load(path))
+
+
+if __name__ == '__main__':
+    unittest.main()